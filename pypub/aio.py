@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import functools
+import weakref
+
+try:
+    import aiohttp
+    aiohttp_module_exists = True
+except ImportError:
+    aiohttp_module_exists = False
+
+from . import chapter
+from . import fetch
+
+MAX_CONCURRENT_FETCHES = 16
+# Number of chapters whose images are downloaded ahead of the one being written
+IMAGE_PREFETCH_CHAPTERS = 8
+
+_default_fetchers = weakref.WeakKeyDictionary()
+
+
+class AsyncFetcher(object):
+    """
+    Downloads urls without blocking the event loop, at most max_concurrency
+    at a time. Uses aiohttp when it is installed, otherwise runs
+    pypub.fetch.fetch on the loop's default executor. Either way the default
+    fetch cache is used, and concurrent requests for the same normalized url
+    and headers share one download, as with pypub.fetch.fetch.
+
+    Args:
+        max_concurrency (Option[int]): Maximum number of downloads in flight.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENT_FETCHES):
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._session = None
+        self._in_flight = {}
+
+    async def fetch(self, url, headers=None):
+        """
+        Coroutine returning the pypub.fetch.FetchResult of url.
+
+        Raises:
+            pypub.fetch.FetchError: Raised if the url is invalid or can't be
+                reached.
+        """
+        key = fetch.get_request_key(url, headers)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url, headers))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, url, headers):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            if not aiohttp_module_exists:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(
+                        None, functools.partial(fetch.fetch, url, headers))
+            cache = fetch.get_default_cache()
+            if cache is not None:
+                cached = fetch._get_cached(cache, url)
+                if cached is not None:
+                    return cached
+            result, ok = await self._download(url, headers)
+            if cache is not None and ok:
+                fetch._set_cached(cache, result)
+            return result
+
+    async def _download(self, url, headers):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        request_headers = dict(fetch._DEFAULT_HEADERS)
+        request_headers.update(headers or {})
+        try:
+            async with self._session.get(url, headers=request_headers) as response:
+                content = await response.read()
+                result = fetch.FetchResult(url, content,
+                                           response.headers.get('Content-Type', ''))
+                return result, response.status < 400
+        except aiohttp.ClientSSLError:
+            raise fetch.FetchError(url, "Url %s doesn't have valid SSL certificate" % url)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            raise fetch.FetchError(url, "%s is an invalid url or no network connection" % url)
+
+    async def close(self):
+        """
+        Coroutine closing the HTTP session of this fetcher.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+def get_default_fetcher():
+    """
+    Returns the fetcher shared by everything running on the current event
+    loop. Await close_default_fetcher before closing the loop, to close its
+    HTTP session.
+    """
+    loop = asyncio.get_event_loop()
+    fetcher = _default_fetchers.get(loop)
+    if fetcher is None:
+        fetcher = _default_fetchers[loop] = AsyncFetcher()
+    return fetcher
+
+
+async def close_default_fetcher():
+    """
+    Coroutine closing the fetcher shared by everything running on the
+    current event loop, if there is one. A new one is created if it is
+    needed again.
+    """
+    fetcher = _default_fetchers.pop(asyncio.get_event_loop(), None)
+    if fetcher is not None:
+        await fetcher.close()
+
+
+async def create_chapter_from_url(factory, url, title=None, fetcher=None,
+                                  executor=None):
+    """
+    Coroutine version of ChapterFactory.create_chapter_from_url. The page is
+    downloaded without blocking the event loop, then cleaned on executor.
+    """
+    fetcher = fetcher or get_default_fetcher()
+    try:
+        fetch_result = await fetcher.fetch(url, factory.request_headers)
+    except fetch.FetchError as e:
+        raise ValueError(str(e))
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+            executor, factory._create_chapter_from_fetch_result,
+            fetch_result, title)
+
+
+async def _fetch_image(fetcher, image_url):
+    try:
+        result = await fetcher.fetch(image_url, {'Referer': image_url})
+        return result.content
+    except fetch.FetchError:
+        return None
+
+
+async def fetch_images(c, fetcher=None):
+    """
+    Coroutine downloading the online images of Chapter c concurrently.
+    Chapters read back from an epub or restored by a resumed build have
+    their images already, so nothing is downloaded for them.
+
+    Returns:
+        dict: The content of each image by url, or None for images that
+            failed to download.
+    """
+    if c.soup is None:
+        return {}
+    fetcher = fetcher or get_default_fetcher()
+    image_urls = []
+    for _, image_url in c._get_image_urls():
+        if (chapter.is_web_url(image_url) and chapter.get_image_type(image_url)
+                and image_url not in image_urls):
+            image_urls.append(image_url)
+    contents = await asyncio.gather(*[_fetch_image(fetcher, u) for u in image_urls])
+    return dict(zip(image_urls, contents))
+
+
+async def replace_images_in_chapter(c, ebook_folder, fetcher=None):
+    """
+    Coroutine version of Chapter._replace_images_in_chapter.
+    """
+    image_content = await fetch_images(c, fetcher)
+    c._replace_images_in_chapter(ebook_folder, image_content)
+
+
+async def add_chapters(book, chapters, fetcher=None, executor=None):
+    """
+    Coroutine version of adding each of chapters to book with
+    Epub.add_chapter. Images of up to IMAGE_PREFETCH_CHAPTERS chapters are
+    downloaded concurrently while earlier chapters are written, in order, on
+    executor.
+    """
+    fetcher = fetcher or get_default_fetcher()
+    loop = asyncio.get_event_loop()
+    pending = collections.deque()
+    chapters = iter(chapters)
+    while True:
+        while len(pending) < IMAGE_PREFETCH_CHAPTERS:
+            c = next(chapters, None)
+            if c is None:
+                break
+            pending.append((c, asyncio.ensure_future(fetch_images(c, fetcher))))
+        if not pending:
+            break
+        c, image_task = pending.popleft()
+        image_content = await image_task
+        await loop.run_in_executor(
+                executor, functools.partial(book.add_chapter, c, image_content))
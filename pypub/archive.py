@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import multiprocessing
+import multiprocessing.pool
+import os
+import stat
+import sys
+import time
+import zipfile
+import zlib
+
+# Most bytes of files read, and held with their compressed data, at a time
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+# Formats which are already compressed and gain nothing from deflate.
+STORED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3',
+                     '.mp4', '.m4a', '.ogg', '.woff', '.woff2', '.zip']
+
+
+def _list_entries(source_directory, extra_entries=None):
+    entries = {}
+    for root, dirs, files in os.walk(source_directory):
+        for name in files:
+            path = os.path.join(root, name)
+            arcname = os.path.relpath(path, source_directory).replace(os.sep, '/')
+            entries[arcname] = path
+    entries.update(extra_entries or {})
+    entries = list(entries.items())
+    # The epub spec requires mimetype to be the first entry of the archive.
+    entries.sort(key=lambda entry: (entry[0] != 'mimetype', entry[0]))
+    return entries
+
+
+def _get_batches(entries, max_count, max_bytes):
+    # splits entries into batches of at most max_count entries and max_bytes
+    # bytes of files, each with at least one entry
+    batch = []
+    batch_bytes = 0
+    for entry in entries:
+        size = os.path.getsize(entry[1])
+        if batch and (len(batch) >= max_count or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(entry)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _compress_entry(arcname, path, compress_level, store_media, date_time=None,
+                    compress=True):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if date_time is None:
+        st = os.stat(path)
+        date_time = time.localtime(st.st_mtime)[:6]
+        if date_time[0] < 1980:
+            date_time = (1980, 1, 1, 0, 0, 0)
+        zinfo = zipfile.ZipInfo(arcname, date_time)
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    else:
+        zinfo = zipfile.ZipInfo(arcname, date_time)
+        zinfo.external_attr = (stat.S_IFREG | 0o644) << 16
+        zinfo.create_system = 3
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    extension = os.path.splitext(arcname)[1].lower()
+    if (arcname == 'mimetype' or compress_level == 0 or
+            (store_media and extension in STORED_EXTENSIONS)):
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        if compress:
+            compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+            data = compressor.compress(data) + compressor.flush()
+    zinfo.compress_size = len(data)
+    return zinfo, data
+
+
+def _can_write_compressed_entries(zip_file):
+    # ZipFile has no public way to write data compressed elsewhere, so
+    # _write_compressed_entry uses ZipFile internals, which CPython 2.7 and
+    # 3.4 to 3.13 all have. Elsewhere entries are compressed by
+    # ZipFile.writestr, one at a time.
+    return (all(hasattr(zip_file, name)
+                for name in ('fp', 'filelist', 'NameToInfo', '_didModify')) and
+            hasattr(zipfile.ZipInfo, 'FileHeader') and
+            not getattr(zip_file, '_writing', False))
+
+
+def _write_compressed_entry(zip_file, zinfo, data):
+    # mirrors what ZipFile.writestr does after compressing
+    zinfo.header_offset = zip_file.fp.tell()
+    zip_file.fp.write(zinfo.FileHeader())
+    zip_file.fp.write(data)
+    zip_file.filelist.append(zinfo)
+    zip_file.NameToInfo[zinfo.filename] = zinfo
+    zip_file._didModify = True
+    if hasattr(zip_file, 'start_dir'):
+        zip_file.start_dir = zip_file.fp.tell()
+
+
+def write_epub_archive(source_directory, zip_file_name, compress_level=None,
+                       store_media=True, compress_threads=None, progress=None,
+                       date_time=None, extra_entries=None):
+    """
+    Writes the files of source_directory into a zip archive laid out as an
+    epub: mimetype first and uncompressed, then every other file in sorted
+    order. Entries are compressed in parallel threads, a batch of at most
+    MAX_BATCH_BYTES of files at a time, and written in order as each batch
+    completes.
+
+    Args:
+        source_directory (str): The directory containing the epub files.
+        zip_file_name (str): The archive to create.
+        compress_level (Option[int]): The deflate level, 0 to 9. 0 stores
+            every entry uncompressed. By default zlib's default level is used.
+        store_media (Option[bool]): Store already compressed media (images,
+            audio, video, fonts) without deflate. True by default.
+        compress_threads (Option[int]): Number of compression threads. By
+            default this is the number of CPUs.
+        progress (Option[function]): Called with the name and compressed
+            size of each entry once it is written.
+        date_time (Option[tuple]): The date of every entry, as a (year,
+            month, day, hour, minute, second) tuple. When given, entries also
+            get the same permissions, so the archive only depends on the
+            names and contents of the files. By default each entry has the
+            modification time and permissions of its file.
+        extra_entries (Option[dict]): Files to add from outside
+            source_directory, by name in the archive, such as
+            {'OEBPS/cover.jpg': '/home/me/cover.jpg'}. They are read from
+            where they are rather than copied into source_directory first,
+            and replace files of source_directory with the same name.
+
+    Returns:
+        str: zip_file_name
+    """
+    if compress_level is None:
+        compress_level = zlib.Z_DEFAULT_COMPRESSION
+    compress_threads = compress_threads or multiprocessing.cpu_count()
+    entries = _list_entries(source_directory, extra_entries)
+    zip_file = zipfile.ZipFile(zip_file_name, 'w', allowZip64=True)
+    compress_in_threads = _can_write_compressed_entries(zip_file)
+
+    def compress(entry):
+        return _compress_entry(entry[0], entry[1], compress_level, store_media,
+                               date_time, compress_in_threads)
+
+    pool = multiprocessing.pool.ThreadPool(compress_threads)
+    try:
+        with zip_file:
+            for batch in _get_batches(entries, compress_threads * 4, MAX_BATCH_BYTES):
+                for zinfo, data in pool.map(compress, batch):
+                    if compress_in_threads:
+                        _write_compressed_entry(zip_file, zinfo, data)
+                    elif sys.version_info >= (3, 7):
+                        zip_file.writestr(zinfo, data, compresslevel=compress_level)
+                    else:
+                        zip_file.writestr(zinfo, data)
+                    if progress is not None:
+                        progress(zinfo.filename, zinfo.compress_size)
+    finally:
+        pool.close()
+        pool.join()
+    return zip_file_name
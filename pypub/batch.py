@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import codecs
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import traceback
+
+from six import string_types
+
+try:
+    import yaml
+    yaml_module_exists = True
+except ImportError:
+    yaml_module_exists = False
+
+from . import cache
+from . import chapter
+from . import dedup
+from . import epub
+from . import fetch
+from . import profiling
+from . import progress
+
+EPUB_OPTIONS = ['creator', 'language', 'rights', 'publisher', 'cover_file',
+                'css_file', 'uid', 'reproducible', 'timestamp', 'max_chapter_bytes',
+                'check']
+
+
+def _normalize_source(source, base_directory):
+    try:
+        assert isinstance(source, (string_types, dict))
+    except AssertionError:
+        raise ValueError('chapter source must be a url, a file or an object: %r' % (source,))
+    if not isinstance(source, dict):
+        if chapter.is_web_url(source):
+            source = {'url': source}
+        else:
+            source = {'file': source}
+    try:
+        assert 'url' in source or 'file' in source
+        assert all(isinstance(source[k], string_types)
+                   for k in ('url', 'file') if k in source)
+    except AssertionError:
+        raise ValueError('chapter source needs a url or a file: %s' % source)
+    source = dict(source)
+    if 'file' in source:
+        source['file'] = os.path.join(base_directory, source['file'])
+    return source
+
+
+def load_manifest(file_name):
+    """
+    Reads a list of book jobs from a JSON or YAML manifest. The manifest is a
+    list of jobs (or an object with the list under "books"). Each job is an
+    object with a title, optional Epub metadata and options (creator,
+    language, rights, publisher, cover_file, css_file, uid, reproducible,
+    timestamp, max_chapter_bytes, check), an optional epub_name, an optional collect_css flag to keep
+    the stylesheets of html chapters, an optional deduplicate flag (or the
+    threshold of a pypub.dedup.DuplicateDetector) to drop chapters
+    duplicating an earlier chapter of the book, and a list of chapters. A chapter is a url, a file path, or an object with a url or
+    file and an optional title. Relative file paths are resolved against the
+    manifest's directory.
+
+    Args:
+        file_name (str): The manifest file. Files ending in .yaml or .yml are
+            read as YAML, which needs PyYAML installed, everything else is
+            read as JSON.
+
+    Returns:
+        list: The jobs in the manifest, with their chapters normalized to
+            dicts.
+
+    Raises:
+        ValueError: Raised if the manifest is malformed.
+    """
+    with codecs.open(file_name, 'r', 'utf-8') as f:
+        text = f.read()
+    if os.path.splitext(file_name)[1].lower() in ('.yaml', '.yml'):
+        if not yaml_module_exists:
+            raise ValueError('PyYAML is required to read %s' % file_name)
+        jobs = yaml.safe_load(text)
+    else:
+        jobs = json.loads(text)
+    if isinstance(jobs, dict):
+        jobs = jobs.get('books')
+    try:
+        assert isinstance(jobs, list)
+    except AssertionError:
+        raise ValueError('manifest must contain a list of books')
+    base_directory = os.path.dirname(os.path.abspath(file_name))
+    return [normalize_job(job, base_directory) for job in jobs]
+
+
+def normalize_job(job, base_directory):
+    """
+    Checks a job of a manifest and normalizes its chapters to dicts, see
+    load_manifest.
+
+    Args:
+        job (dict): The job.
+        base_directory (str): The directory relative file paths of the job
+            are resolved against.
+
+    Returns:
+        dict: job, normalized in place.
+
+    Raises:
+        ValueError: Raised if the job is malformed.
+    """
+    try:
+        assert isinstance(job, dict) and job.get('title')
+        assert isinstance(job.get('chapters'), list)
+    except AssertionError:
+        raise ValueError('every book needs a title and a list of chapters')
+    job['chapters'] = [_normalize_source(s, base_directory)
+                       for s in job['chapters']]
+    for option in ('cover_file', 'css_file'):
+        if job.get(option):
+            try:
+                assert isinstance(job[option], string_types)
+            except AssertionError:
+                raise ValueError('%s must be a file path' % option)
+            job[option] = os.path.join(base_directory, job[option])
+    return job
+
+
+_clean_cache = None
+
+
+def get_job_id(job):
+    """
+    Returns an id naming the resumable build of job, which changes whenever
+    the job does.
+    """
+    return hashlib.sha1(json.dumps(job, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def build_book(job, output_directory, chapter_factory=None,
+               memory_profiler=None, progress_tracker=None,
+               work_directory=None, workspace_directory=None,
+               max_workspace_bytes=None, job_id=None):
+    """
+    Builds one epub from a manifest job.
+
+    Args:
+        job (dict): A job as returned by load_manifest.
+        output_directory (str): Directory to output the epub file to.
+        chapter_factory (Option[ChapterFactory]): The factory used to create
+            chapters. By default this is a new ChapterFactory, using the
+            worker's clean cache if there is one.
+        memory_profiler (Option[pypub.profiling.MemoryProfiler]): Records the
+            memory allocated by each stage of building the book. It must be
+            started by the caller.
+        progress_tracker (Option[pypub.progress.ProgressTracker]): Receives
+            the progress events of the build. Its total_chapters is set to
+            the chapter count of the job if it isn't set.
+        work_directory (Option[str]): Build resumably in this directory, see
+            the work_dir argument of Epub. A build of the same job restarted
+            after a crash skips the chapters it had already added.
+        workspace_directory (Option[str]): Stage the book in a temporary
+            directory in this directory, see the workspace_dir argument of
+            Epub. Staged files are deleted whether the build succeeds or not,
+            unless it is resumable.
+        max_workspace_bytes (Option[int]): Fail the build if its staged
+            files grow past this many bytes.
+        job_id (Option[str]): The id of the resumable build. By default this
+            is get_job_id(job).
+
+    Returns:
+        dict: The title, path, chapter count and size in bytes of the epub,
+            and the seconds it took to build. If the chapter factory has a
+            duplicate detector, also the number of duplicate chapters skipped
+            and a report of them.
+    """
+    start_time = time.time()
+    if progress_tracker is not None and progress_tracker.total_chapters is None:
+        progress_tracker.total_chapters = len(job['chapters'])
+    duplicate_detector = None
+    if job.get('deduplicate') and chapter_factory is None:
+        if job['deduplicate'] is True:
+            duplicate_detector = dedup.DuplicateDetector()
+        else:
+            duplicate_detector = dedup.DuplicateDetector(int(job['deduplicate']))
+    chapter_factory = chapter_factory or chapter.ChapterFactory(
+            clean_cache=_clean_cache, memory_profiler=memory_profiler,
+            collect_css=bool(job.get('collect_css')), progress=progress_tracker,
+            duplicate_detector=duplicate_detector)
+    options = dict((k, job[k]) for k in EPUB_OPTIONS if job.get(k))
+    if work_directory is not None:
+        options.update(work_dir=work_directory, job_id=job_id or get_job_id(job))
+    with epub.Epub(job['title'], memory_profiler=memory_profiler,
+                   progress=progress_tracker, workspace_dir=workspace_directory,
+                   max_workspace_bytes=max_workspace_bytes, **options) as book:
+        for source in job['chapters']:
+            if book.resume_chapter(source.get('url') or
+                                   os.path.abspath(source['file'])):
+                continue
+            try:
+                if 'url' in source:
+                    c = chapter_factory.create_chapter_from_url(source['url'],
+                                                                source.get('title'))
+                else:
+                    c = chapter_factory.create_chapter_from_file(source['file'],
+                                                                 source.get('title'))
+            except dedup.DuplicateChapterError:
+                continue
+            book.add_chapter(c)
+        epub_path = book.create_epub(output_directory, job.get('epub_name'))
+        # chapters dropped as duplicates aren't in the book, and chapters
+        # restored by a resumed build are
+        chapter_count = len(book.chapters)
+    result = {'title': job['title'],
+              'path': epub_path,
+              'chapters': chapter_count,
+              'bytes': os.path.getsize(epub_path),
+              'seconds': time.time() - start_time,
+              'error': None}
+    duplicate_detector = getattr(chapter_factory, 'duplicate_detector', None)
+    if duplicate_detector is not None:
+        result['duplicates'] = len(duplicate_detector.skipped)
+        result['duplicate_report'] = duplicate_detector.format_report()
+    return result
+
+
+def _init_worker(cache_directory, verbose=False):
+    global _clean_cache
+    if verbose:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if cache_directory is not None:
+        fetch.set_default_cache(cache.FileCache(cache_directory))
+        _clean_cache = cache.FileCache(os.path.join(cache_directory, 'clean'))
+
+
+def _run_job(job_and_options):
+    job, output_directory, options = job_and_options
+    progress_tracker = None
+    if options['verbose']:
+        progress_tracker = progress.ProgressTracker(progress.log_event)
+    try:
+        directories = {'work_directory': options['work_directory'],
+                       'workspace_directory': options['workspace_directory'],
+                       'max_workspace_bytes': options['max_workspace_bytes'],
+                       'job_id': options.get('job_id')}
+        if not options['profile_memory']:
+            return build_book(job, output_directory,
+                              progress_tracker=progress_tracker, **directories)
+        with profiling.MemoryProfiler() as memory_profiler:
+            result = build_book(job, output_directory,
+                                memory_profiler=memory_profiler,
+                                progress_tracker=progress_tracker, **directories)
+        result['memory_report'] = memory_profiler.format_report()
+        return result
+    except Exception:
+        return {'title': job['title'],
+                'path': None,
+                'chapters': 0,
+                'bytes': 0,
+                'seconds': 0,
+                'error': traceback.format_exc().strip().splitlines()[-1]}
+
+
+def build_books(jobs, output_directory, processes=None, cache_directory=None,
+                profile_memory=False, verbose=False, work_directory=None,
+                workspace_directory=None, max_workspace_bytes=None):
+    """
+    Builds many epubs concurrently on a process pool. Every worker process
+    fetches pages and images through one on-disk cache, so a url shared by
+    several books is only downloaded once, and caches cleaned chapters next
+    to it, so a page shared by several books is only cleaned once.
+
+    Args:
+        jobs (list): Jobs as returned by load_manifest.
+        output_directory (str): Directory to output the epub files to.
+        processes (Option[int]): Number of worker processes. By default this
+            is the number of CPUs.
+        cache_directory (Option[str]): Directory of the shared fetch and
+            clean caches. By default no cache is used.
+        profile_memory (Option[bool]): Trace the memory allocated building
+            each book, and add a report of it to its result under
+            "memory_report". Tracing is slow, so this is off by default.
+        verbose (Option[bool]): Log the progress of every book, with
+            pypub.progress.log_event.
+        work_directory (Option[str]): Build every book resumably in this
+            directory, so running the same jobs again after a crash continues
+            the books that weren't finished.
+        workspace_directory (Option[str]): Directory books are staged in
+            while they are built. By default the system's temporary
+            directory.
+        max_workspace_bytes (Option[int]): Fail books whose staged files
+            grow past this many bytes.
+
+    Returns:
+        list: One result dict per job, in the order the jobs finished. Failed
+            jobs have their error message under "error".
+    """
+    options = {'profile_memory': profile_memory,
+               'verbose': verbose,
+               'work_directory': work_directory,
+               'workspace_directory': workspace_directory,
+               'max_workspace_bytes': max_workspace_bytes}
+    work = [(job, output_directory, options) for job in jobs]
+    if processes == 1:
+        _init_worker(cache_directory, verbose)
+        results = []
+        for item in work:
+            results.append(_run_job(item))
+            _print_result(results[-1])
+        return results
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (cache_directory, verbose))
+    try:
+        results = []
+        for result in pool.imap_unordered(_run_job, work):
+            results.append(result)
+            _print_result(result)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def _print_result(result):
+    if result['error']:
+        print('FAILED %s: %s' % (result['title'], result['error']))
+    else:
+        print('%s (%d chapters, %.1fs)' % (result['path'], result['chapters'],
+                                           result['seconds']))
+    if result.get('duplicates'):
+        print(result['duplicate_report'])
+    if result.get('memory_report'):
+        print(result['memory_report'])
+
+
+def format_summary(results, seconds):
+    """
+    Returns a throughput summary of a batch build.
+
+    Args:
+        results (list): Results as returned by build_books.
+        seconds (float): Wall clock time of the whole batch.
+    """
+    built = [r for r in results if not r['error']]
+    chapter_count = sum(r['chapters'] for r in built)
+    byte_count = sum(r['bytes'] for r in built)
+    seconds = max(seconds, 1e-6)
+    return '\n'.join([
+        'Books built:    %d of %d' % (len(built), len(results)),
+        'Chapters:       %d' % chapter_count,
+        'Output size:    %.1f MB' % (byte_count / 1048576.0),
+        'Wall time:      %.1f s' % seconds,
+        'Throughput:     %.2f books/min, %.2f chapters/s, %.2f MB/s' % (
+            len(built) * 60 / seconds,
+            chapter_count / seconds,
+            byte_count / 1048576.0 / seconds),
+        ])
+
+
+def main(argv=None):
+    """
+    Entry point of the pypub command. Builds every book of a manifest and
+    prints a throughput summary. Returns 1 if any book failed, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(
+            prog='pypub',
+            description='Build epub files from a JSON or YAML job manifest.')
+    parser.add_argument('manifest', help='JSON or YAML list of books')
+    parser.add_argument('-o', '--output-directory', default='.',
+                        help='directory to write the epub files to')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='fetch and clean cache shared by all jobs, kept between '
+                             'runs (default: a temporary directory)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='report the memory allocated by each stage, the '
+                             'worst chapters and the top call sites of each book')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log every chapter fetched, cleaned and written, '
+                             'with the time left for each book')
+    parser.add_argument('--work-dir', default=None,
+                        help='stage books in this directory with a journal, so a '
+                             'crashed run continues where it stopped when run again')
+    parser.add_argument('--workspace-dir', default=None,
+                        help='stage books in this directory while they are built, '
+                             'such as a tmpfs (default: the temporary directory)')
+    parser.add_argument('--max-workspace-bytes', type=int, default=None,
+                        help='fail books whose staged chapters and images grow '
+                             'past this size')
+    args = parser.parse_args(argv)
+    jobs = load_manifest(args.manifest)
+    if not os.path.isdir(args.output_directory):
+        os.makedirs(args.output_directory)
+    cache_directory = args.cache_dir or tempfile.mkdtemp(prefix='pypub-cache-')
+    start_time = time.time()
+    try:
+        results = build_books(jobs, args.output_directory, args.jobs,
+                              cache_directory, args.profile_memory,
+                              args.verbose, args.work_dir, args.workspace_dir,
+                              args.max_workspace_bytes)
+    finally:
+        if args.cache_dir is None:
+            shutil.rmtree(cache_directory, ignore_errors=True)
+    print(format_summary(results, time.time() - start_time))
+    return 1 if any(r['error'] for r in results) else 0
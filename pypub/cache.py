@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import errno
+import hashlib
+import os
+import tempfile
+
+from six import text_type
+
+
+class FileCache(object):
+    """
+    A directory of cached values keyed by strings. Values are stored as bytes
+    in files named after the sha1 of their key, and every write goes through
+    a temporary file and a rename, so several processes can safely share one
+    cache directory.
+
+    Args:
+        directory (str): The directory to keep cached files in. Created if it
+            doesn't exist.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        _makedirs(self.directory)
+
+    def _get_path(self, key):
+        if isinstance(key, text_type):
+            key = key.encode('utf-8')
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """
+        Returns the bytes cached under key, or None if there are none.
+
+        Args:
+            key (str): The cache key.
+        """
+        try:
+            with open(self._get_path(key), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, value):
+        """
+        Caches value under key, replacing any earlier value.
+
+        Args:
+            key (str): The cache key.
+            value (bytes): The value to cache.
+        """
+        path = self._get_path(key)
+        _makedirs(os.path.dirname(path))
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            _replace(temp_path, path)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(directory):
+            raise
+
+
+def _replace(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # python 2 has no os.replace, rename is atomic on posix
+        os.rename(source, destination)
@@ -2,9 +2,9 @@
 # -*- coding: utf-8 -*-
 import cgi
 import codecs
-import imghdr
+import hashlib
+import json
 import os
-import shutil
 import tempfile
 import uuid
 import mimetypes
@@ -20,16 +20,25 @@ else:
 import bs4
 from bs4 import BeautifulSoup
 from bs4.dammit import EntitySubstitution
-import jinja2
-import requests
-from .constants import CHAPTER_TEMPLATE, CONTENT_TEMPLATE
+from .constants import (CHAPTER_TEMPLATE, CONTENT_TEMPLATE, IMAGE_TARGET_WIDTH,
+                        SUPPORTED_TAGS)
+from . import charset
 from . import clean
+from . import css
+from . import dedup
+from . import profiling
+from . import progress
+from . import fetch
 from . import utils
-
-_DEFAULT_USER_AGENT = r'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.132 Safari/537.36'
-_DEFAULT_HEADERS = {'User-Agent': _DEFAULT_USER_AGENT}
+from .css import CSSErrorException
+from .dedup import DuplicateChapterError
+from .fetch import _DEFAULT_HEADERS
 
 SUPPORTTED_MIME_TYPES = ['image/jpeg', 'image/png', 'image/gif']
+# Tags an oversized chapter is split inside of, with a copy of the tag
+# wrapping the blocks of each part
+_SPLIT_CONTAINER_TAGS = ['article', 'blockquote', 'div', 'dl', 'ol', 'section',
+                         'table', 'tbody', 'ul']
 
 class NoUrlError(Exception):
     def __str__(self):
@@ -43,13 +52,6 @@ class ImageErrorException(Exception):
     def __str__(self):
         return 'Error downloading image from ' + self.image_url
 
-class CSSErrorException(Exception):
-    def __init__(self, css_url):
-        self.css_url = css_url
-
-    def __str__(self):
-        return 'Error downloading css from ' + self.css_url
-
 def is_web_url(url):
     us = urlparse(url)
     return us.scheme and len(us.scheme) > 2
@@ -65,7 +67,7 @@ def fix_file_name(filename):
     valid_chars = ' _().#[]'
     return "".join([c for c in filename if c.isalpha() or c.isdigit() or c in valid_chars]).rstrip()
 
-def save_image(image_url, image_directory, image_name):
+def save_image(image_url, image_directory, image_name, content=None):
     """
     Saves an online image from image_url to image_directory with the name image_name.
     Returns the extension of the image saved, which is determined dynamically.
@@ -74,6 +76,8 @@ def save_image(image_url, image_directory, image_name):
         image_url (str): The url of the image.
         image_directory (str): The directory to save the image in.
         image_name (str): The file name to save the image as.
+        content (Option[bytes]): The content of the image if it has already
+            been downloaded, in which case it isn't fetched again.
 
     Raises:
         ImageErrorException: Raised if unable to save the image at image_url
@@ -83,30 +87,30 @@ def save_image(image_url, image_directory, image_name):
     full_image_file_name = os.path.join(image_directory, image_name)
 
     if is_web_url(image_url):
+        if content is None:
+            try:
+                content = fetch.fetch(image_url, headers={'Referer': image_url}).content
+            except fetch.FetchError:
+                raise ImageErrorException(image_url)
         try:
+            # a local image saved with the same name is linked, not copied,
+            # so it must be replaced rather than written over
+            if os.path.lexists(full_image_file_name):
+                os.remove(full_image_file_name)
             with open(full_image_file_name, 'wb') as f:
-                headers = {}
-                headers.update(_DEFAULT_HEADERS)
-                headers['Referer'] = image_url
-                requests_object = requests.get(image_url, headers=headers)
-                try:
-                    content = requests_object.content
-                    # Check for empty response
-                    f.write(content)
-                except AttributeError:
-                    raise ImageErrorException(image_url)
+                f.write(content)
         except IOError:
             raise ImageErrorException(image_url)
         return full_image_file_name
     else:
-        # If the image is present on the local filesystem just copy it
+        # If the image is present on the local filesystem just link it
         if os.path.exists(image_url):
-            shutil.copy(image_url, full_image_file_name)
+            utils.link_or_copy(image_url, full_image_file_name)
             return full_image_file_name
 
 
 def _replace_image(image_url, image_tag, ebook_folder,
-                   image_name=None):
+                   image_name=None, content=None):
     """
     Replaces the src of an image to link to the local copy in the images folder of the ebook. Tightly coupled with bs4
         package.
@@ -117,6 +121,7 @@ def _replace_image(image_url, image_tag, ebook_folder,
         ebook_folder (str): The directory where the ebook files are being saved. This must contain a subdirectory
             called "images".
         image_name (Option[str]): The short name to save the image as. Should not contain a directory or an extension.
+        content (Option[bytes]): The content of the image if it has already been downloaded.
     """
     # print('_replace_image %s in %s' % (image_url, ebook_folder))
     try:
@@ -125,7 +130,7 @@ def _replace_image(image_url, image_tag, ebook_folder,
         raise TypeError("image_tag cannot be of type " + str(type(image_tag)))
     if image_name is None:
         if is_web_url(image_url):
-            image_name = os.path.basename(urlparse.urlparse(image_url).path)
+            image_name = os.path.basename(urlparse(image_url).path)
         else:
             image_name = os.path.basename(image_url)
     image_name = fix_file_name(image_name)
@@ -134,7 +139,7 @@ def _replace_image(image_url, image_tag, ebook_folder,
         image_full_path = os.path.join(ebook_folder, 'images')
         assert os.path.exists(image_full_path)
         save_image(image_url, image_full_path,
-                                     image_name)
+                   image_name, content)
         image_tag['src'] = 'images' + '/' + image_name
         return image_name
     except ImageErrorException:
@@ -148,6 +153,60 @@ def _replace_image(image_url, image_tag, ebook_folder,
 
 
 
+def get_part_file_name(file_name, part_number):
+    """
+    Returns the file name of part part_number of a chapter split into
+    several files, such as chapter_0001_02.xhtml for part 2 of
+    chapter_0001.xhtml. Part 1 is file_name itself.
+    """
+    if part_number == 1:
+        return file_name
+    base, ext = os.path.splitext(file_name)
+    return '%s_%02d%s' % (base, part_number, ext)
+
+
+def _get_size(node):
+    return len(text_type(node).encode('utf-8'))
+
+
+def _get_blocks(node, max_bytes, wrappers=()):
+    # returns the children of node as (wrappers, child) tuples, descending
+    # into the children of containers bigger than max_bytes
+    blocks = []
+    for child in list(node.children):
+        if isinstance(child, bs4.element.NavigableString):
+            if child.strip():
+                blocks.append((wrappers, child))
+        elif (child.name in _SPLIT_CONTAINER_TAGS and len(child.contents) > 1 and
+                _get_size(child) > max_bytes):
+            blocks.extend(_get_blocks(child, max_bytes, wrappers + (child,)))
+        else:
+            blocks.append((wrappers, child))
+    return blocks
+
+
+def _build_part_body(blocks):
+    # moves blocks into a new body, wrapping consecutive blocks of a
+    # container in one copy of it
+    soup = BeautifulSoup('<body></body>', 'html.parser')
+    stack = []
+    for wrappers, node in blocks:
+        common = 0
+        while (common < len(stack) and common < len(wrappers) and
+               stack[common][0] is wrappers[common]):
+            common += 1
+        del stack[common:]
+        parent = stack[-1][1] if stack else soup.body
+        for wrapper in wrappers[common:]:
+            wrapper_copy = soup.new_tag(wrapper.name)
+            wrapper_copy.attrs = dict(wrapper.attrs)
+            parent.append(wrapper_copy)
+            stack.append((wrapper, wrapper_copy))
+            parent = wrapper_copy
+        parent.append(node.extract())
+    return soup.body.prettify()
+
+
 class ImageItem(object):
     def __init__(self, link, id=None):
         self.link  = link
@@ -179,7 +238,16 @@ class Chapter(object):
             applicable.
         html_title (str): Title string with special characters replaced with
             html-safe sequences
+        stylesheets (list): The stylesheets of the page the chapter is from,
+            filtered with pypub.css.filter_stylesheet, if its ChapterFactory
+            collects them.
+        image_width (int): The width in pixels images are picked from their
+            srcset for, when they are added to an epub.
+        part_count (int): The number of files the chapter was written to.
     """
+    image_width = IMAGE_TARGET_WIDTH
+    part_count = 1
+
     def __init__(self, content, title, url=None):
         self._validate_input_types(content, title)
         self.content = content
@@ -188,6 +256,7 @@ class Chapter(object):
         self.url = url
         self.html_title = cgi.escape(self.title, quote=True)
         self.images = []
+        self.stylesheets = []
         self._insert_title()
         # print('Chapter(title=%s, url=%s, type=%s)' % (title, url, type(content)))
 
@@ -202,12 +271,7 @@ class Chapter(object):
         return self.soup.body.prettify()
 
     def _render_template(self, **variable_value_pairs):
-        def read_template():
-            with codecs.open(CHAPTER_TEMPLATE, 'r', 'utf-8') as f:
-                template = f.read()
-            return jinja2.Template(template)
-        template = read_template()
-        return template.render(variable_value_pairs)
+        return utils.load_template(CHAPTER_TEMPLATE).render(variable_value_pairs)
 
     def _parse_images(self):
         images = []
@@ -220,25 +284,66 @@ class Chapter(object):
     def get_content(self):
         return self._render_template(title=self.html_title, body=self._get_body())
 
-    def write(self, file_name):
+    def _split_body(self, max_bytes, content_bytes):
+        # groups the blocks of the body into parts of at most max_bytes once
+        # rendered, or of a single block bigger than that. Blocks are
+        # measured unindented, so the budget is scaled by how much rendering
+        # the whole chapter, content_bytes long, added to its body.
+        max_bytes = max_bytes * _get_size(self.soup.body) // content_bytes
+        parts = [[]]
+        part_bytes = 0
+        for block in _get_blocks(self.soup.body, max_bytes):
+            block_bytes = _get_size(block[1])
+            if parts[-1] and part_bytes + block_bytes > max_bytes:
+                parts.append([])
+                part_bytes = 0
+            parts[-1].append(block)
+            part_bytes += block_bytes
+        return [_build_part_body(blocks) for blocks in parts]
+
+    def write(self, file_name, max_bytes=None):
         """
-        Writes the chapter object to an xhtml file.
+        Writes the chapter object to an xhtml file. A chapter bigger than
+        max_bytes is split between block tags into parts of about that
+        size, written to file_name and to the files named by
+        get_part_file_name, so that readers don't have to load and paginate
+        it all at once. Only blocks bigger than max_bytes on their own give
+        bigger parts.
 
         Args:
             file_name (str): The full name of the xhtml file to save to.
+            max_bytes (Option[int]): The most bytes of xhtml per file. By
+                default the chapter is never split.
+
+        Returns:
+            list: The full names of the files written.
         """
         try:
             assert file_name[-6:] == '.xhtml'
         except (AssertionError, IndexError):
             raise ValueError('filename must end with .xhtml')
         html_string = self.get_content()
-        utils.validate_xhtml(html_string.encode('utf-8'))
-        with codecs.open(file_name, 'w','utf-8') as f:
-            f.write(html_string)
+        content_bytes = len(html_string.encode('utf-8'))
+        if max_bytes is None or content_bytes <= max_bytes:
+            bodies = None
+            html_strings = [html_string]
+        else:
+            bodies = self._split_body(max_bytes, content_bytes)
+            html_strings = [self._render_template(title=self.html_title, body=body)
+                            for body in bodies]
+        file_names = []
+        for part_number, html_string in enumerate(html_strings, 1):
+            utils.validate_xhtml(html_string.encode('utf-8'))
+            part_file_name = get_part_file_name(file_name, part_number)
+            with codecs.open(part_file_name, 'w','utf-8') as f:
+                f.write(html_string)
+            file_names.append(part_file_name)
+        self.part_count = len(file_names)
         # reduce memory consuming
-        self.content = self.soup.prettify()
+        self.content = self.soup.prettify() if bodies is None else u''.join(bodies)
         self.soup.decompose()
         self.soup = None
+        return file_names
 
     def _validate_input_types(self, content, title):
         try:
@@ -269,13 +374,14 @@ class Chapter(object):
         final_urls = []
         in_web_page = is_web_url(self.url)
         if in_web_page:
-            root_scheme = urlparse.urlparse(self.url).scheme
+            root_scheme = urlparse(self.url).scheme
         else:
             root_scheme = None
         for node in node_list:
+            utils.resolve_image_source(node, self.image_width)
             url = node.get('src')
             if in_web_page:
-                url = urlparse.urljoin(self.url, url)
+                url = urljoin(self.url, url)
             else:
                 folder = os.path.dirname(self.url)
                 url = os.path.abspath(os.path.join(folder, url))
@@ -287,13 +393,30 @@ class Chapter(object):
         node_list = self.soup('img')
         return self._extract_urls(node_list)
 
-    def _replace_images_in_chapter(self, ebook_folder):
+    def _replace_images_in_chapter(self, ebook_folder, image_content=None):
         image_url_list = self._get_image_urls()
         for image_tag, image_url in image_url_list:
-            result = _replace_image(image_url, image_tag, ebook_folder)
+            if image_content is not None and image_url in image_content:
+                content = image_content[image_url]
+                if content is None:
+                    # the image already failed to download
+                    image_tag.decompose()
+                    continue
+                result = _replace_image(image_url, image_tag, ebook_folder,
+                                        content=content)
+            else:
+                result = _replace_image(image_url, image_tag, ebook_folder)
             # print('_replace_images_in_chapter', image_tag)
         self._parse_images()
 
+    def _areplace_images_in_chapter(self, ebook_folder, fetcher=None):
+        """
+        Coroutine version of _replace_images_in_chapter, which downloads the
+        images of the chapter concurrently without blocking the event loop.
+        """
+        from . import aio
+        return aio.replace_images_in_chapter(self, ebook_folder, fetcher)
+
 class ChapterFactory(object):
     """
     Used to create Chapter objects.Chapter objects can be created from urls,
@@ -303,11 +426,93 @@ class ChapterFactory(object):
         clean_function (Option[function]): A function used to sanitize raw
             html to be used in an epub. By default, this is the pypub.clean
             function.
+        tag_dictionary (Option[dict]): Passed to clean_function as its
+            tag_dictionary argument. By default clean_function is called
+            without it.
+        clean_cache (Option[FileCache]): A pypub.cache.FileCache of cleaned
+            chapters. Chapters are looked up by a hash of their raw content,
+            clean_function and tag_dictionary (and title, for text chapters),
+            and cleaning and collecting their stylesheets is skipped on a
+            hit. Set a version attribute on a custom clean_function and
+            change it whenever its output changes, to invalidate its cached
+            chapters.
+        memory_profiler (Option[pypub.profiling.MemoryProfiler]): Records the
+            memory allocated fetching, cleaning and parsing each chapter.
+        collect_css (Option[bool]): Keep the linked and inline stylesheets of
+            html chapters, filtered to the rules which can match cleaned html,
+            so Epub adds them to the book's stylesheet. False by default.
+        progress (Option[pypub.progress.ProgressTracker]): Receives an event
+            as each page is fetched and each chapter is cleaned.
+        image_width (Option[int]): Passed to clean_function as its
+            image_width argument, and set on the chapters created, to pick
+            images from their srcset for screens this many pixels wide. By
+            default clean_function is called without it and
+            IMAGE_TARGET_WIDTH is used.
+        duplicate_detector (Option[pypub.dedup.DuplicateDetector]): Checks
+            the text of every chapter before it is cleaned. A chapter the
+            same as or nearly the same as one created before either raises
+            DuplicateChapterError or becomes a short chapter linking to the
+            original, depending on the detector's mode.
     """
 
-    def __init__(self, clean_function=clean.clean):
+    def __init__(self, clean_function=clean.clean, tag_dictionary=None,
+                 clean_cache=None, memory_profiler=None, collect_css=False,
+                 progress=None, image_width=None, duplicate_detector=None):
         self.clean_function = clean_function
+        self.tag_dictionary = tag_dictionary
+        self.clean_cache = clean_cache
+        self.memory_profiler = memory_profiler
+        self.collect_css = collect_css
+        self.progress = progress
+        self.image_width = image_width
+        self.duplicate_detector = duplicate_detector
         self.request_headers = _DEFAULT_HEADERS
+        self._stylesheet_cache = {}
+
+    def _clean(self, content):
+        kwargs = {}
+        if self.tag_dictionary is not None:
+            kwargs['tag_dictionary'] = self.tag_dictionary
+        if self.image_width is not None:
+            kwargs['image_width'] = self.image_width
+        return self.clean_function(content, **kwargs)
+
+    def _get_clean_cache_key(self, content, title, clean_html, stylesheet_url=None):
+        # stylesheet_url is the url stylesheets are collected against, or
+        # None if they aren't collected
+        clean_function_id = '%s.%s:%s' % (
+                getattr(self.clean_function, '__module__', ''),
+                getattr(self.clean_function, '__name__', repr(self.clean_function)),
+                getattr(self.clean_function, 'version', ''))
+        tag_dictionary = json.dumps(self.tag_dictionary or SUPPORTED_TAGS,
+                                    sort_keys=True)
+        digest = hashlib.sha1()
+        image_width = str(self.image_width or IMAGE_TARGET_WIDTH)
+        for part in (content, title or u'', clean_function_id, tag_dictionary,
+                     image_width, stylesheet_url or u''):
+            if isinstance(part, text_type):
+                part = part.encode('utf-8')
+            digest.update(part)
+            digest.update(b'\0')
+        return 'clean3:%d:%d:%s' % (clean_html, stylesheet_url is not None,
+                                    digest.hexdigest())
+
+    def _create_duplicate_chapter(self, duplicate, content, title, url):
+        if self.duplicate_detector.mode == dedup.DROP:
+            raise dedup.DuplicateChapterError(*duplicate)
+        if not title:
+            title = utils.get_html_title(content)
+        original = cgi.escape(duplicate.original or u'', quote=True)
+        if duplicate.original and is_web_url(duplicate.original):
+            original = u'<a href="%s">%s</a>' % (original, original)
+        with codecs.open(CONTENT_TEMPLATE, 'r', 'utf-8') as f:
+            content_tpl = f.read()
+        html_string = content_tpl % (cgi.escape(title),
+                                     u'<p>Same as %s</p>' % original)
+        c = Chapter(clean.html_validate(html_string), title, url)
+        progress.emit(self.progress, progress.CHAPTER_CLEANED, url or title,
+                      len(c.content.encode('utf-8')))
+        return c
 
     def create_chapter_from_url(self, url, title=None):
         """
@@ -331,15 +536,45 @@ class ChapterFactory(object):
             ValueError: Raised if unable to connect to url supplied
         """
         try:
-            request_object = requests.get(url, headers=self.request_headers, allow_redirects=True)
-            request_object.encoding = 'utf-8'
-        except (requests.exceptions.MissingSchema,
-                requests.exceptions.ConnectionError):
-            raise ValueError("%s is an invalid url or no network connection" % url)
-        except requests.exceptions.SSLError:
-            raise ValueError("Url %s doesn't have valid SSL certificate" % url)
-        unicode_string = request_object.text
-        return self.create_chapter_from_string(unicode_string, title, url, True)
+            with profiling.stage(self.memory_profiler, 'fetch', url):
+                fetch_result = fetch.fetch(url, headers=self.request_headers)
+        except fetch.FetchError as e:
+            raise ValueError(str(e))
+        return self._create_chapter_from_fetch_result(fetch_result, title)
+
+    def acreate_chapter_from_url(self, url, title=None, fetcher=None, executor=None):
+        """
+        Coroutine version of create_chapter_from_url for use with asyncio. The
+        page is downloaded without blocking the event loop and cleaned on
+        executor.
+
+        Args:
+            url (string): The url to pull the content of the created Chapter
+                from
+            title (Option[string]): The title of the created Chapter.
+            fetcher (Option[pypub.aio.AsyncFetcher]): The fetcher to download
+                with, which bounds concurrent downloads. By default this is
+                shared by everything running on the event loop.
+            executor (Option[concurrent.futures.Executor]): The executor to
+                clean the page on. By default this is the loop's default
+                executor.
+
+        Returns:
+            Chapter: A chapter object whose content is the webpage at the given
+                url and whose title is that provided or inferred from the url
+
+        Raises:
+            ValueError: Raised if unable to connect to url supplied
+        """
+        from . import aio
+        return aio.create_chapter_from_url(self, url, title, fetcher, executor)
+
+    def _create_chapter_from_fetch_result(self, fetch_result, title=None):
+        progress.emit(self.progress, progress.CHAPTER_FETCHED, fetch_result.url,
+                      len(fetch_result.content))
+        return self.create_chapter_from_bytes(fetch_result.content, title,
+                                              fetch_result.url, True,
+                                              fetch_result.content_type)
 
     def create_chapter_from_file(self, file_path, title=None):
         """
@@ -362,9 +597,36 @@ class ChapterFactory(object):
         file_path = os.path.abspath(file_path)
         if not title:
             title = os.path.splitext(os.path.basename(file_path))[0]
-        with codecs.open(file_path, 'r', 'utf-8') as f:
-            content_string = f.read()
-        return self.create_chapter_from_string(content_string, title, file_path, False)
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        return self.create_chapter_from_bytes(content, title, file_path, False)
+
+    def create_chapter_from_bytes(self, content, title=None, url=None,
+                                  clean_html=True, content_type=None):
+        """
+        Creates a Chapter object from an html page as it was downloaded or
+        read from disk. The page is decoded once, with the encoding given by
+        its byte order mark, its Content-Type header or its <meta> charset,
+        then handled as by create_chapter_from_string.
+
+        Args:
+            content (bytes): The html content of the created Chapter
+            title (Option[string]): The title of the created Chapter. By
+                default, this is None, in which case the title will try to be
+                inferred from the page.
+            url (Option[string]): The url or file the page is from
+            clean_html (Option[bool]): Sanitize the page with
+                clean_function. True by default.
+            content_type (Option[string]): The Content-Type header of the
+                page, if it was downloaded.
+
+        Returns:
+            Chapter: A chapter object whose content is the given page
+                and whose title is that provided or inferred from the page
+        """
+        unicode_string = charset.decode(content, content_type)
+        return self.create_chapter_from_string(unicode_string, title, url,
+                                               clean_html)
 
     def create_chapter_from_string(self, content, title=None, url=None, clean_html=False):
         """
@@ -383,15 +645,55 @@ class ChapterFactory(object):
         Returns:
             Chapter: A chapter object whose content is the given string
                 and whose title is that provided or inferred from the url
+
+        Raises:
+            DuplicateChapterError: Raised if the duplicate_detector drops
+                duplicates and the string duplicates a chapter created
+                before.
         """
         # print('create_chapter_from_string source:[%s]' % url)
         if title:
             if isinstance(title, binary_type):
                 title = title.decode('utf-8')
-        else:
-            title = utils.get_html_title(content)
-        if utils.is_html_file(content):
-            html_string = self.clean_function(content) if clean_html else content
+        if self.duplicate_detector is not None:
+            duplicate = self.duplicate_detector.check(content, url or title)
+            if duplicate is not None:
+                return self._create_duplicate_chapter(duplicate, content,
+                                                      title, url)
+        is_html = utils.is_html_file(content)
+        collect_css = self.collect_css and is_html
+        cache_key = None
+        if self.clean_cache is not None:
+            # the title is only part of the xhtml of text chapters
+            cache_key = self._get_clean_cache_key(
+                    content, None if is_html else title, clean_html,
+                    (url or u'') if collect_css else None)
+            cached = self.clean_cache.get(cache_key)
+            if cached is not None:
+                cached_chapter = json.loads(cached.decode('utf-8'))
+                xhtml_string = cached_chapter['xhtml']
+                title = title or cached_chapter['title'] or utils.get_html_title(content)
+                with profiling.stage(self.memory_profiler, 'chapter', url or title):
+                    c = Chapter(xhtml_string, title, url)
+                c.stylesheets = cached_chapter['stylesheets']
+                if self.image_width is not None:
+                    c.image_width = self.image_width
+                progress.emit(self.progress, progress.CHAPTER_CLEANED,
+                              url or title, len(cached))
+                return c
+        stylesheets = []
+        if collect_css:
+            stylesheets = css.collect_stylesheets(
+                    content, url, self.tag_dictionary or SUPPORTED_TAGS,
+                    self._stylesheet_cache, self.request_headers)
+        # the title of html chapters isn't part of their cache key, so only
+        # a title inferred from the content is cached with them
+        inferred_title = None
+        if not title:
+            title = inferred_title = utils.get_html_title(content)
+        if is_html:
+            with profiling.stage(self.memory_profiler, 'clean', url or title):
+                html_string = self._clean(content) if clean_html else content
         else:
             content = utils.remove_invalid_xml_chars2(content)
             with codecs.open(CONTENT_TEMPLATE, 'r', 'utf-8') as f:
@@ -399,9 +701,22 @@ class ChapterFactory(object):
             html_lines = ['<p>%s</p>' % line for line in content.split('\n')]
             html_string = content_tpl % (title, '\n'.join(html_lines))
         
-        xhtml_string = clean.html_validate(html_string)
-
-        return Chapter(xhtml_string, title, url)
+        with profiling.stage(self.memory_profiler, 'parse', url or title):
+            xhtml_string = clean.html_validate(html_string)
+        if cache_key is not None:
+            self.clean_cache.set(cache_key, json.dumps(
+                    {'title': inferred_title if is_html else title,
+                     'xhtml': xhtml_string,
+                     'stylesheets': stylesheets}).encode('utf-8'))
+
+        with profiling.stage(self.memory_profiler, 'chapter', url or title):
+            c = Chapter(xhtml_string, title, url)
+        c.stylesheets = stylesheets
+        if self.image_width is not None:
+            c.image_width = self.image_width
+        progress.emit(self.progress, progress.CHAPTER_CLEANED, url or title,
+                      len(xhtml_string.encode('utf-8')))
+        return c
 
 create_chapter_from_url = ChapterFactory().create_chapter_from_url
 create_chapter_from_file = ChapterFactory().create_chapter_from_file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import codecs
+import re
+
+# Number of bytes at the start of a page searched for a <meta> charset
+META_PRESCAN_BYTES = 4096
+
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+    ]
+_CONTENT_TYPE_CHARSET_PATTERN = re.compile(
+        br'''charset\s*=\s*["']?([\w.:-]+)''', re.I)
+_META_CHARSET_PATTERN = re.compile(
+        br'''<meta\s[^>]*?charset\s*=\s*["']?([\w.:-]+)''', re.I)
+_XML_DECLARATION_PATTERN = re.compile(
+        br'''^<\?xml[^>]*\sencoding\s*=\s*["']([\w.:-]+)''')
+# Labels browsers decode with a superset of the named charset, since pages
+# labelled with them often use characters only the superset has
+_SUPERSETS = {
+    'ascii': 'cp1252',
+    'latin_1': 'cp1252',
+    'iso8859_1': 'cp1252',
+    'iso8859_9': 'cp1254',
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'shift_jis': 'cp932',
+    'euc_kr': 'cp949',
+    'big5': 'big5hkscs',
+    }
+_FALLBACK_ENCODING = 'cp1252'
+
+
+def _normalize(label):
+    # returns the python codec name of a charset label, or None if python
+    # has no codec of that name
+    if isinstance(label, bytes):
+        label = label.decode('ascii', 'ignore')
+    try:
+        name = codecs.lookup(label.strip()).name
+    except LookupError:
+        return None
+    name = name.replace('-', '_')
+    # utf-16 and utf-32 labels in the page itself can't be right, the page
+    # would have had a BOM
+    if name.startswith('utf_16') or name.startswith('utf_32'):
+        return 'utf-8'
+    return _SUPERSETS.get(name, name)
+
+
+def _detect_declared_encoding(content, content_type):
+    for bom, encoding in _BOMS:
+        if content.startswith(bom):
+            return encoding
+    if content_type:
+        if not isinstance(content_type, bytes):
+            content_type = content_type.encode('latin-1', 'replace')
+        match = _CONTENT_TYPE_CHARSET_PATTERN.search(content_type)
+        if match and _normalize(match.group(1)):
+            return _normalize(match.group(1))
+    start = content[:META_PRESCAN_BYTES]
+    for pattern in (_XML_DECLARATION_PATTERN, _META_CHARSET_PATTERN):
+        match = pattern.search(start)
+        if match and _normalize(match.group(1)):
+            return _normalize(match.group(1))
+    return None
+
+
+def decode(content, content_type=None):
+    """
+    Decodes an html page with its encoding, as browsers determine it without
+    sniffing its content: from a byte order mark, then the charset of the
+    Content-Type header, then a <meta> charset or xml declaration at the
+    start of the page. Pages without any of these are decoded as utf-8 if
+    they are valid utf-8, otherwise as windows-1252. The byte order mark is
+    dropped, and bytes which aren't valid in the encoding are replaced.
+
+    Args:
+        content (bytes): The page.
+        content_type (Option[str]): The Content-Type header of the page.
+
+    Returns:
+        str: The page as a unicode string.
+    """
+    encoding = _detect_declared_encoding(content, content_type)
+    if encoding is None:
+        # undeclared pages are decoded once if they are valid utf-8
+        try:
+            text = content.decode('utf-8')
+        except UnicodeDecodeError:
+            text = content.decode(_FALLBACK_ENCODING, 'replace')
+    else:
+        text = content.decode(encoding, 'replace')
+    if text.startswith(u'\ufeff'):
+        text = text[1:]
+    return text
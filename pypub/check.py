@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from six.moves.urllib.parse import unquote, urldefrag
+
+MIMETYPE = b'application/epub+zip'
+CONTAINER_FILE = 'META-INF/container.xml'
+
+_CONTAINER_NAMESPACE = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+_OPF_NAMESPACE = '{http://www.idpf.org/2007/opf}'
+_NCX_NAMESPACE = '{http://www.daisy.org/z3986/2005/ncx/}'
+_XHTML_NAMESPACE = '{http://www.w3.org/1999/xhtml}'
+_NCX_MEDIA_TYPE = 'application/x-dtbncx+xml'
+# Media types whose files must be well formed xml
+_XML_MEDIA_TYPES = ['application/xhtml+xml', _NCX_MEDIA_TYPE,
+                    'application/oebps-package+xml', 'image/svg+xml']
+# Leading bytes of the files of each image media type
+_IMAGE_SIGNATURES = {
+    'image/jpeg': [b'\xff\xd8\xff'],
+    'image/png': [b'\x89PNG\r\n\x1a\n'],
+    'image/gif': [b'GIF87a', b'GIF89a'],
+}
+_TOC_PAGE_PATTERN = re.compile(r'(^|/)toc(_\d+)?\.html$')
+
+# A problem found in an epub:
+#   code: the check which failed, such as "missing-file"
+#   path: the archive entry the problem is in, or None
+#   message: what is wrong
+CheckIssue = collections.namedtuple('CheckIssue', ['code', 'path', 'message'])
+
+
+class CheckReport(object):
+    """
+    The problems check_epub found in an epub.
+
+    Attributes:
+        epub_file (str): The epub checked.
+        issues (list): A CheckIssue for each problem, in the order they were
+            found.
+    """
+
+    def __init__(self, epub_file):
+        self.epub_file = epub_file
+        self.issues = []
+
+    @property
+    def ok(self):
+        return not self.issues
+
+    def add(self, code, path, message):
+        self.issues.append(CheckIssue(code, path, message))
+
+    def get_issues(self, code):
+        """
+        Returns the issues found by one check.
+        """
+        return [issue for issue in self.issues if issue.code == code]
+
+    def format_report(self):
+        """
+        Returns a report of the problems found, one per line.
+        """
+        lines = ['%s: %d problems' % (self.epub_file, len(self.issues))]
+        for issue in self.issues:
+            lines.append('  [%s] %s%s' % (issue.code,
+                                          issue.path + ': ' if issue.path else '',
+                                          issue.message))
+        return '\n'.join(lines)
+
+
+class EpubCheckError(Exception):
+    """
+    Raised by Epub.create_epub when a created epub fails check_epub.
+
+    Attributes:
+        report (CheckReport): The problems found.
+    """
+
+    def __init__(self, report):
+        self.report = report
+
+    def __str__(self):
+        issue = self.report.issues[0]
+        return '%s has %d problems, first %s%s' % (
+                self.report.epub_file, len(self.report.issues),
+                issue.path + ': ' if issue.path else '', issue.message)
+
+
+def get_image_type_from_bytes(data):
+    """
+    Returns the media type of an image from its leading bytes: image/jpeg,
+    image/png or image/gif, or None if they match none of these.
+    """
+    for media_type, signatures in _IMAGE_SIGNATURES.items():
+        if any(data.startswith(s) for s in signatures):
+            return media_type
+    return None
+
+
+def _resolve(base_name, href):
+    # returns the archive name of href, linked from the archive entry base_name
+    href = unquote(urldefrag(href)[0])
+    if not href:
+        return base_name
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_name), href))
+
+
+def _parse(zip_file, name, report):
+    try:
+        return ElementTree.fromstring(zip_file.read(name))
+    except ElementTree.ParseError as e:
+        report.add('not-well-formed', name, str(e))
+        return None
+
+
+def _check_mimetype(zip_file, report):
+    infos = zip_file.infolist()
+    if not infos or infos[0].filename != 'mimetype':
+        report.add('mimetype', None, 'mimetype is not the first entry')
+        return
+    if infos[0].compress_type != zipfile.ZIP_STORED:
+        report.add('mimetype', 'mimetype', 'mimetype is compressed')
+    if zip_file.read('mimetype') != MIMETYPE:
+        report.add('mimetype', 'mimetype', 'mimetype is not %s' % MIMETYPE.decode('ascii'))
+
+
+def _find_opf(zip_file, names, report):
+    if CONTAINER_FILE not in names:
+        report.add('container', None, '%s is missing' % CONTAINER_FILE)
+        return None
+    root = _parse(zip_file, CONTAINER_FILE, report)
+    if root is None:
+        return None
+    rootfile = root.find('.//%srootfile' % _CONTAINER_NAMESPACE)
+    opf_name = rootfile.get('full-path') if rootfile is not None else None
+    if not opf_name:
+        report.add('container', CONTAINER_FILE, 'no rootfile is given')
+        return None
+    if opf_name not in names:
+        report.add('missing-file', CONTAINER_FILE, '%s is missing' % opf_name)
+        return None
+    return opf_name
+
+
+def _check_media_type(zip_file, name, media_type, report):
+    if media_type in _XML_MEDIA_TYPES:
+        return _parse(zip_file, name, report)
+    if media_type in _IMAGE_SIGNATURES:
+        with zip_file.open(name) as f:
+            head = f.read(8)
+        if get_image_type_from_bytes(head) != media_type:
+            report.add('media-type', name, 'content is not %s' % media_type)
+    elif media_type == 'text/css':
+        try:
+            zip_file.read(name).decode('utf-8')
+        except UnicodeDecodeError:
+            report.add('media-type', name, 'stylesheet is not utf-8')
+    return None
+
+
+def _get_links(root, tag, attribute):
+    return [node.get(attribute) for node in root.iter(tag) if node.get(attribute)]
+
+
+def _check_targets(source, targets, spine_names, report, code):
+    for name in targets:
+        if name not in spine_names:
+            report.add(code, source, 'links to %s, which is not in the spine' % name)
+
+
+def check_epub(epub_file):
+    """
+    Checks the structure of an epub file, as a quick alternative to running
+    an external epub checker after each build. Each archive entry is read
+    once. The checks are:
+
+    - mimetype is the first entry, stored uncompressed, and says
+      application/epub+zip
+    - container.xml points at an OPF file which exists
+    - every manifest item exists, and every file is in the manifest
+    - manifest ids are unique, and every spine item is in the manifest
+    - every chapter linked from the NCX and the html table of contents is
+      in the spine, and both list the same chapters
+    - images start with the signature of their media type, xml files are
+      well formed and stylesheets are utf-8
+
+    Args:
+        epub_file (str): The epub file to check.
+
+    Returns:
+        CheckReport: The problems found. Its ok attribute is True if there
+            are none.
+    """
+    report = CheckReport(epub_file)
+    try:
+        zip_file = zipfile.ZipFile(epub_file)
+    except (IOError, zipfile.BadZipfile) as e:
+        report.add('archive', None, str(e))
+        return report
+    with zip_file:
+        _check_mimetype(zip_file, report)
+        names = set(n for n in zip_file.namelist() if not n.endswith('/'))
+        opf_name = _find_opf(zip_file, names, report)
+        if opf_name is None:
+            return report
+        opf = _parse(zip_file, opf_name, report)
+        if opf is None:
+            return report
+        items = collections.OrderedDict()
+        listed = set()
+        for item in opf.iter('%sitem' % _OPF_NAMESPACE):
+            item_id = item.get('id')
+            name = _resolve(opf_name, item.get('href', ''))
+            if item_id in items:
+                report.add('duplicate-id', opf_name, 'id %s is used more than once' % item_id)
+                continue
+            items[item_id] = (name, item.get('media-type'))
+            if name in listed:
+                report.add('duplicate-item', opf_name, '%s is listed more than once' % name)
+            listed.add(name)
+            if name not in names:
+                report.add('missing-file', opf_name, '%s is missing' % name)
+        for name in sorted(names - listed - set([opf_name, 'mimetype'])):
+            if not name.startswith('META-INF/'):
+                report.add('unlisted-file', name, 'not in the manifest')
+
+        spine = opf.find('%sspine' % _OPF_NAMESPACE)
+        spine_names = set()
+        for itemref in (spine.iter('%sitemref' % _OPF_NAMESPACE) if spine is not None else []):
+            idref = itemref.get('idref')
+            if idref not in items:
+                report.add('spine', opf_name, 'spine item %s is not in the manifest' % idref)
+            else:
+                spine_names.add(items[idref][0])
+
+        roots = {}
+        for name, media_type in items.values():
+            if name in names:
+                roots[name] = _check_media_type(zip_file, name, media_type, report)
+
+        ncx_targets = None
+        ncx_id = spine.get('toc') if spine is not None else None
+        if ncx_id is not None:
+            if ncx_id not in items or items[ncx_id][1] != _NCX_MEDIA_TYPE:
+                report.add('ncx', opf_name, 'spine toc %s is not an NCX item' % ncx_id)
+            elif roots.get(items[ncx_id][0]) is not None:
+                ncx_name = items[ncx_id][0]
+                ncx_targets = set(_resolve(ncx_name, src) for src in _get_links(
+                        roots[ncx_name], '%scontent' % _NCX_NAMESPACE, 'src'))
+                _check_targets(ncx_name, sorted(ncx_targets), spine_names, report, 'ncx')
+
+        toc_targets = set()
+        toc_names = [name for name, _ in items.values() if _TOC_PAGE_PATTERN.search(name)]
+        for toc_name in toc_names:
+            if roots.get(toc_name) is None:
+                continue
+            targets = set(_resolve(toc_name, href) for href in _get_links(
+                    roots[toc_name], '%sa' % _XHTML_NAMESPACE, 'href'))
+            _check_targets(toc_name, sorted(targets), spine_names, report, 'toc')
+            toc_targets.update(targets)
+        toc_targets.difference_update(toc_names)
+        if ncx_targets is not None and toc_names:
+            for name in sorted(ncx_targets - toc_targets):
+                report.add('toc', toc_names[0], '%s is in the NCX but not the table of contents' % name)
+            for name in sorted(toc_targets - ncx_targets):
+                report.add('ncx', items[ncx_id][0], '%s is in the table of contents but not the NCX' % name)
+    return report
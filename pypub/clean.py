@@ -7,6 +7,7 @@ from bs4.dammit import EntitySubstitution
 from six import binary_type, text_type
 from . import constants
 from . import deep_clean
+from . import utils
 
 
 def create_html_from_fragment(tag):
@@ -34,8 +35,78 @@ def create_html_from_fragment(tag):
     return soup
 
 
+# Attributes and the end of a start tag, allowing ">" inside quoted values
+_START_TAG_REST = r'(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*>'
+# Tags whose content is raw text, which ends at the first matching end tag
+_RAW_TEXT_TAGS = frozenset(['script', 'style', 'iframe', 'noscript'])
+_prefilter_patterns = {}
+
+
+def _get_prefilter_pattern(skip_tags):
+    pattern = _prefilter_patterns.get(skip_tags)
+    if pattern is None:
+        pattern = re.compile(r'<!--|<(%s)%s' % ('|'.join(map(re.escape, skip_tags)),
+                                                 _START_TAG_REST), re.I)
+        _prefilter_patterns[skip_tags] = pattern
+    return pattern
+
+
+def _find_end_of_element(input_string, tag, position):
+    if tag in _RAW_TEXT_TAGS:
+        match = re.compile(r'</%s\s*>' % re.escape(tag), re.I).search(
+                input_string, position)
+        return match.end() if match else len(input_string)
+    depth = 1
+    tag_pattern = re.compile(r'<(/?)%s%s' % (re.escape(tag), _START_TAG_REST), re.I)
+    for match in tag_pattern.finditer(input_string, position):
+        if match.group(1):
+            depth -= 1
+        elif not match.group(0).endswith('/>'):
+            depth += 1
+        if not depth:
+            return match.end()
+    return len(input_string)
+
+
+def prefilter(input_string, skip_tags=constants.PREFILTER_TAGS):
+    """
+    Drops comments and the tags in skip_tags, with everything inside them,
+    from html before it is parsed, so that the tree built from the result is
+    smaller and faster to build. The markup is scanned at the tokenizer level
+    with regular expressions, and everything else is passed through as is.
+
+    Args:
+        input_string (basestring): A (possibly unicode) string representing HTML.
+        skip_tags (Option[list]): Tags to drop. By default these are the
+            script, style, svg and similar tags that never end up in an epub.
+
+    Returns:
+        str: A (possibly unicode) string representing HTML.
+    """
+    pattern = _get_prefilter_pattern(tuple(skip_tags))
+    output = []
+    position = 0
+    while True:
+        match = pattern.search(input_string, position)
+        if match is None:
+            break
+        output.append(input_string[position:match.start()])
+        if match.group(1) is None:
+            comment_end = input_string.find('-->', match.end())
+            position = len(input_string) if comment_end < 0 else comment_end + 3
+            continue
+        tag = match.group(1).lower()
+        position = match.end()
+        if (tag not in constants.SINGLETON_TAG_LIST and
+                not match.group(0).endswith('/>')):
+            position = _find_end_of_element(input_string, tag, position)
+    output.append(input_string[position:])
+    return ''.join(output)
+
+
 def clean(input_string, deep_clean_mode=True,
-          tag_dictionary=constants.SUPPORTED_TAGS):
+          tag_dictionary=constants.SUPPORTED_TAGS, prefilter_mode=True,
+          image_width=constants.IMAGE_TARGET_WIDTH):
     """
     Sanitizes HTML. Tags not contained as keys in the tag_dictionary input are
     removed, and child nodes are recursively moved to parent of removed node.
@@ -49,6 +120,12 @@ def clean(input_string, deep_clean_mode=True,
             isn't contained, it will be removed. By default, this is set to
             use the supported tags and attributes for the Amazon Kindle,
             as found at https://kdp.amazon.com/help?topicId=A1JPUWCSD6F59O
+        prefilter_mode (Option[bool]): Drop script, style and similar tags
+            with the prefilter function before building the tree. True by
+            default.
+        image_width (Option[int]): The src of every img is set to its
+            srcset candidate best fitting a screen this many pixels wide, or
+            to its lazy loading source, with pypub.utils.resolve_image_source.
 
     Returns:
         str: A (possibly unicode) string representing HTML.
@@ -60,7 +137,13 @@ def clean(input_string, deep_clean_mode=True,
         assert isinstance(input_string, basestring)
     except AssertionError:
         raise TypeError
+    if prefilter_mode:
+        input_string = prefilter(input_string)
     root = BeautifulSoup(input_string, 'html.parser')
+    # before deep_clean drops images with a placeholder src, and before
+    # srcset and lazy loading attributes are removed
+    for node in root.find_all('img'):
+        utils.resolve_image_source(node, image_width)
 
     if deep_clean_mode:
         deep_clean.deep_clean(root)
@@ -79,7 +162,7 @@ def clean(input_string, deep_clean_mode=True,
                 parent_node.append(n)
         else:
             attribute_dict = current_node.attrs
-            for attribute in attribute_dict.keys():
+            for attribute in list(attribute_dict.keys()):
                 if attribute not in tag_dictionary[current_node.name]:
                     attribute_dict.pop(attribute)
         stack.extend(child_node_list)
@@ -91,15 +174,17 @@ def clean(input_string, deep_clean_mode=True,
     for node in image_node_list:
         if not node.has_attr('src'):
             node.extract()
-    unicode_string = unicode(root.prettify(encoding='utf-8',
-                                                            formatter=EntitySubstitution.substitute_html),
-                                              encoding='utf-8')
+    unicode_string = root.prettify(formatter=EntitySubstitution.substitute_html)
     # fix <br> tags since not handled well by default by bs4
     unicode_string = unicode_string.replace('<br>', '<br/>')
     # remove &nbsp; and replace with space since not handled well by certain e-readers
     unicode_string = unicode_string.replace('&nbsp;', ' ')
     return unicode_string
 
+# Identifies the output of clean in caches of cleaned chapters. Change it
+# whenever clean's output changes.
+clean.version = 2
+
 
 def condense(input_string):
     """
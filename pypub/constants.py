@@ -60,11 +60,44 @@ SINGLETON_TAG_LIST = [
     'param',
     'source',
     ]
+# Tags dropped with everything inside them before html is parsed into a tree
+PREFILTER_TAGS = [
+    'canvas',
+    'iframe',
+    'link',
+    'meta',
+    'noscript',
+    'script',
+    'style',
+    'svg',
+    'template',
+    ]
 xhtml_doctype_string = '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">'
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 TEST_DIR = os.path.join(BASE_DIR, 'test_files')
 EPUB_TEMPLATES_DIR = os.path.join(BASE_DIR, 'epub_templates')
 DEFAULT_COVER = os.path.join(EPUB_TEMPLATES_DIR, 'default_cover.jpg')
 DEFAULT_CSS = os.path.join(EPUB_TEMPLATES_DIR, 'default_main.css')
+# Date of reproducible epubs without a timestamp, 1980-01-01, the earliest
+# date a zip entry can have
+REPRODUCIBLE_TIMESTAMP = 315532800
+# Width in pixels images are picked for from srcset candidates, the width of
+# large e-reader screens
+IMAGE_TARGET_WIDTH = 1200
+# Attributes lazy loading scripts keep the real source of an img in, while
+# its src is a placeholder
+LAZY_IMAGE_ATTRIBUTES = [
+    'data-src',
+    'data-original',
+    'data-lazy-src',
+    'data-actualsrc',
+    'data-hi-res-src',
+    'data-url',
+    'data-echo',
+    ]
+LAZY_SRCSET_ATTRIBUTES = [
+    'data-srcset',
+    'data-lazy-srcset',
+    ]
 CHAPTER_TEMPLATE = os.path.join(EPUB_TEMPLATES_DIR, 'chapter.xhtml')
 CONTENT_TEMPLATE = os.path.join(EPUB_TEMPLATES_DIR, 'chapter.tpl')
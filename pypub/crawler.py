@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import logging
+import multiprocessing.pool
+import threading
+import time
+
+from six import PY2
+if PY2:
+    from urlparse import urljoin, urldefrag, urlparse
+else:
+    from urllib.parse import urljoin, urldefrag, urlparse
+
+from bs4 import BeautifulSoup
+
+from . import chapter
+from . import charset
+from . import dedup
+from . import fetch
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_FETCHES = 4
+# Most downloads from one host in flight at a time, and the least seconds
+# between the start of two of them
+MAX_HOST_FETCHES = 2
+HOST_DELAY = 0.5
+# Most index pages followed through next page links, in case they loop
+MAX_INDEX_PAGES = 100
+
+# A chapter link of an index page:
+#   url: the absolute url of the chapter, without fragment
+#   title: the text of the link, or None if it has none
+ChapterLink = collections.namedtuple('ChapterLink', ['url', 'title'])
+
+
+class _HostLimiter(object):
+    # bounds the downloads in flight per host, and spaces their starts by
+    # delay seconds
+
+    def __init__(self, max_concurrency, delay):
+        self.max_concurrency = max_concurrency
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_times = {}
+
+    @contextlib.contextmanager
+    def limit(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(
+                        self.max_concurrency)
+        with semaphore:
+            with self._lock:
+                now = time.time()
+                start = max(now, self._next_times.get(host, now))
+                self._next_times[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+class Crawler(object):
+    """
+    Builds a book from an index page linking to its chapters, such as the
+    table of contents of a web serial. Chapter links are found with a CSS
+    selector, on the index page and on the pages reached through its next
+    page links, then the chapters are downloaded and cleaned concurrently and
+    added to an Epub in the order they were linked in.
+
+    Downloads are polite: at most max_host_concurrency of them are in flight
+    per host, and their starts are spaced by host_delay seconds. This
+    includes the images of the chapters, which are downloaded along with
+    them.
+
+    Args:
+        chapter_factory (Option[ChapterFactory]): Creates the chapters. By
+            default this is a new ChapterFactory. Chapters its duplicate
+            detector drops are skipped.
+        max_concurrency (Option[int]): Number of chapters downloaded and
+            cleaned at a time.
+        max_host_concurrency (Option[int]): Most downloads in flight per host.
+        host_delay (Option[float]): Least seconds between the starts of two
+            downloads from a host.
+        skip_errors (Option[bool]): Log and skip chapters that can't be
+            downloaded, instead of raising. False by default.
+
+    Attributes:
+        failed (list): The urls of chapters skipped by skip_errors.
+    """
+
+    def __init__(self, chapter_factory=None, max_concurrency=MAX_CONCURRENT_FETCHES,
+                 max_host_concurrency=MAX_HOST_FETCHES, host_delay=HOST_DELAY,
+                 skip_errors=False):
+        self.chapter_factory = chapter_factory or chapter.ChapterFactory()
+        self.max_concurrency = max_concurrency
+        self.skip_errors = skip_errors
+        self.failed = []
+        self._host_limiter = _HostLimiter(max_host_concurrency, host_delay)
+
+    def _fetch(self, url):
+        with self._host_limiter.limit(url):
+            return fetch.fetch(url, headers=self.chapter_factory.request_headers)
+
+    def _fetch_image(self, url):
+        with self._host_limiter.limit(url):
+            return fetch.fetch(url, headers={'Referer': url}).content
+
+    def find_chapter_links(self, index_url, link_selector='a',
+                           next_page_selector=None, max_index_pages=MAX_INDEX_PAGES):
+        """
+        Returns the chapter links of an index page, in the order they appear.
+        Links are resolved against the page they are on, and links found more
+        than once, or pointing back to an index page, are only kept once.
+
+        Args:
+            index_url (str): The url of the index page.
+            link_selector (Option[str]): CSS selector of the chapter links,
+                such as "#toc li > a". By default every link of the page.
+            next_page_selector (Option[str]): CSS selector of the link to the
+                next index page, such as "a.next". By default the index is a
+                single page.
+            max_index_pages (Option[int]): Most index pages followed.
+
+        Returns:
+            list: A ChapterLink for each chapter.
+
+        Raises:
+            ValueError: Raised if an index page can't be downloaded.
+        """
+        links = []
+        seen = set()
+        index_urls = set()
+        page_url = index_url
+        while page_url and len(index_urls) < max_index_pages:
+            index_urls.add(fetch.normalize_url(page_url))
+            try:
+                fetch_result = self._fetch(page_url)
+            except fetch.FetchError as e:
+                raise ValueError(str(e))
+            root = BeautifulSoup(charset.decode(fetch_result.content,
+                                                fetch_result.content_type),
+                                 'html.parser')
+            for node in root.select(link_selector):
+                url = self._get_link_url(node, page_url)
+                if url is None or fetch.normalize_url(url) in seen:
+                    continue
+                seen.add(fetch.normalize_url(url))
+                links.append(ChapterLink(url, node.get_text().strip() or None))
+            page_url = None
+            if next_page_selector is not None:
+                next_links = root.select(next_page_selector)
+                if next_links:
+                    page_url = self._get_link_url(next_links[0], fetch_result.url)
+                if page_url is not None and fetch.normalize_url(page_url) in index_urls:
+                    page_url = None
+        return [link for link in links
+                if fetch.normalize_url(link.url) not in index_urls]
+
+    def _get_link_url(self, node, page_url):
+        href = node.get('href')
+        if not href:
+            return None
+        url = urldefrag(urljoin(page_url, href.strip()))[0]
+        if urlparse(url).scheme not in ('http', 'https'):
+            return None
+        return url
+
+    def _create_chapter(self, link):
+        try:
+            fetch_result = self._fetch(link.url)
+        except fetch.FetchError as e:
+            if not self.skip_errors:
+                raise ValueError(str(e))
+            logger.warning('Skipped %s: %s', link.url, e)
+            self.failed.append(link.url)
+            return None, None
+        try:
+            c = self.chapter_factory._create_chapter_from_fetch_result(
+                    fetch_result, link.title)
+        except dedup.DuplicateChapterError as e:
+            logger.info('Skipped %s', e)
+            return None, None
+        return c, self._fetch_images(c)
+
+    def _fetch_images(self, c):
+        # the images are downloaded here rather than by Epub.add_chapter, so
+        # they go through the host limiter too
+        image_content = {}
+        for _, image_url in c._get_image_urls():
+            if (image_url in image_content or not chapter.is_web_url(image_url) or
+                    not chapter.get_image_type(image_url)):
+                continue
+            try:
+                image_content[image_url] = self._fetch_image(image_url)
+            except fetch.FetchError:
+                image_content[image_url] = None
+        return image_content
+
+    def add_chapters(self, book, links, use_link_titles=True):
+        """
+        Downloads and cleans chapters concurrently, and adds them to book in
+        the order of links. Chapters book has already added before a restart
+        aren't downloaded again.
+
+        Args:
+            book (Epub): The book to add the chapters to.
+            links (list): ChapterLink or url of each chapter.
+            use_link_titles (Option[bool]): Title chapters with the text of
+                their links. Otherwise titles are inferred from the chapters.
+
+        Returns:
+            int: The number of chapters added.
+
+        Raises:
+            ValueError: Raised if a chapter can't be downloaded, unless
+                skip_errors is set.
+        """
+        links = [link if isinstance(link, ChapterLink) else ChapterLink(link, None)
+                 for link in links]
+        if not use_link_titles:
+            links = [ChapterLink(link.url, None) for link in links]
+        tracker = self.chapter_factory.progress
+        if tracker is not None and tracker.total_chapters is None:
+            tracker.total_chapters = len(links)
+        links = iter([link for link in links if not book.resume_chapter(link.url)])
+        added = 0
+        pending = collections.deque()
+        pool = multiprocessing.pool.ThreadPool(self.max_concurrency)
+        try:
+            while True:
+                # chapters are created up to twice the concurrency ahead of
+                # the one added, so a slow chapter doesn't stall the pool
+                while len(pending) < 2 * self.max_concurrency:
+                    link = next(links, None)
+                    if link is None:
+                        break
+                    pending.append(pool.apply_async(self._create_chapter, (link,)))
+                if not pending:
+                    break
+                c, image_content = pending.popleft().get()
+                if c is not None:
+                    book.add_chapter(c, image_content)
+                    added += 1
+        finally:
+            pool.terminate()
+            pool.join()
+        return added
+
+    def crawl(self, book, index_url, link_selector='a', next_page_selector=None,
+              use_link_titles=True):
+        """
+        Adds every chapter linked from an index page to book, in order. See
+        find_chapter_links and add_chapters.
+
+        Returns:
+            int: The number of chapters added.
+        """
+        links = self.find_chapter_links(index_url, link_selector,
+                                        next_page_selector)
+        logger.info('Found %d chapters linked from %s', len(links), index_url)
+        return self.add_chapters(book, links, use_link_titles)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import hashlib
+import os
+import re
+
+from six import PY2, text_type
+if PY2:
+    from urlparse import urljoin, urlparse
+else:
+    from urllib.parse import urljoin, urlparse
+
+from .constants import SUPPORTED_TAGS
+from . import charset
+from . import fetch
+
+# Number of filtered stylesheets kept by a stylesheet cache before it is
+# emptied
+STYLESHEET_CACHE_SIZE = 1024
+
+_STYLESHEET_PATTERN = re.compile(
+        r'<link\b([^>]*)>|<style\b([^>]*)>(.*?)</style\s*>', re.S | re.I)
+_ATTRIBUTE_PATTERN = re.compile(
+        r'''([\w:-]+)\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+)''')
+_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.S)
+_TOKEN_PATTERN = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|[{};]''')
+_DECLARATION_PATTERN = re.compile(
+        r'''(?:"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|\([^)]*\)|[^;])+''')
+_COMBINATOR_PATTERN = re.compile(r'\s*([>+~])\s*|\s+')
+_COMPOUND_PATTERN = re.compile(
+        r'''(?P<type>^(?:[\w-]+|\*)(?:\|(?:[\w-]+|\*))?)|
+            \.(?P<class>[\w-]+)|
+            \#(?P<id>[\w-]+)|
+            \[\s*(?P<attribute>[\w:-]+)[^\]]*\]|
+            ::?[\w-]+(?:\([^)]*\))?''', re.X)
+_SPACE_PATTERN = re.compile(r'\s+')
+# + and - need their spaces inside calc(), and a space before ( separates
+# "and" from a media feature
+_PUNCTUATION_SPACE_PATTERN = re.compile(r'\s*([,>{}:;!)])\s*|(\()\s*')
+# At-rules whose content is a list of rules, which are filtered in turn.
+# Every other at-rule (@font-face, @import, @keyframes, @page...) is dropped.
+_GROUPING_AT_RULES = ['media', 'supports']
+
+
+class CSSErrorException(Exception):
+    def __init__(self, css_url):
+        self.css_url = css_url
+
+    def __str__(self):
+        return 'Error downloading css from ' + self.css_url
+
+
+def _get_tag_attributes(tag_dictionary):
+    return dict((tag.rstrip(' /'), set(attributes))
+                for tag, attributes in tag_dictionary.items())
+
+
+def _can_match(compound, tag_attributes):
+    # returns whether the compound selector, such as p.note[title], can match
+    # an element of a whitelisted tag with only whitelisted attributes
+    tag = None
+    required = set()
+    position = 0
+    for match in _COMPOUND_PATTERN.finditer(compound):
+        if match.start() != position:
+            # something this doesn't understand, so keep the selector
+            return True
+        position = match.end()
+        if match.group('type'):
+            tag = match.group('type').split('|')[-1].lower()
+        elif match.group('class'):
+            required.add('class')
+        elif match.group('id'):
+            required.add('id')
+        elif match.group('attribute'):
+            required.add(match.group('attribute').split('|')[-1].lower())
+    if position != len(compound):
+        return True
+    if tag is None or tag == '*':
+        return any(required <= attributes for attributes in tag_attributes.values())
+    return tag in tag_attributes and required <= tag_attributes[tag]
+
+
+def _filter_selector(selector, tag_attributes):
+    selector = _COMBINATOR_PATTERN.sub(
+            lambda m: m.group(1) or ' ', selector.strip())
+    compounds = re.split(r'[ >+~]', selector)
+    if all(_can_match(c, tag_attributes) for c in compounds if c):
+        return selector
+    return None
+
+
+def _minify(text):
+    return _PUNCTUATION_SPACE_PATTERN.sub(
+            lambda m: m.group(1) or m.group(2), _SPACE_PATTERN.sub(' ', text)).strip()
+
+
+def _minify_declarations(block):
+    declarations = []
+    for declaration in _DECLARATION_PATTERN.findall(block):
+        name, _, value = declaration.partition(':')
+        name = name.strip().lower()
+        value = _minify(value)
+        # images and fonts referenced by stylesheets aren't added to the epub
+        if not name or not value or 'url(' in value.lower():
+            continue
+        declaration = '%s:%s' % (name, value)
+        if declaration not in declarations:
+            declarations.append(declaration)
+    return ';'.join(declarations)
+
+
+def _split_rules(css_text):
+    # yields (prelude, block) for every top level rule of css_text, with a
+    # block of None for statements such as @import
+    start = 0
+    depth = 0
+    block_start = None
+    for match in _TOKEN_PATTERN.finditer(css_text):
+        token = match.group(0)
+        if token == '{':
+            if depth == 0:
+                block_start = match.end()
+            depth += 1
+        elif token == '}':
+            if depth == 0:
+                start = match.end()
+                continue
+            depth -= 1
+            if depth == 0:
+                yield css_text[start:block_start - 1].strip(), css_text[block_start:match.start()]
+                start = match.end()
+        elif token == ';' and depth == 0:
+            yield css_text[start:match.start()].strip(), None
+            start = match.end()
+
+
+def _filter_rules(css_text, tag_attributes):
+    rules = []
+    for prelude, block in _split_rules(css_text):
+        if block is None or not prelude:
+            continue
+        if prelude.startswith('@'):
+            keyword = re.match(r'@([\w-]*)', prelude).group(1).lower()
+            if keyword in _GROUPING_AT_RULES:
+                inner_rules = _filter_rules(block, tag_attributes)
+                if inner_rules:
+                    rules.append('%s{%s}' % (_minify(prelude), ''.join(inner_rules)))
+            continue
+        selectors = []
+        for selector in prelude.split(','):
+            selector = _filter_selector(selector, tag_attributes)
+            if selector and selector not in selectors:
+                selectors.append(selector)
+        declarations = _minify_declarations(block)
+        if selectors and declarations:
+            rules.append('%s{%s}' % (','.join(selectors), declarations))
+    return rules
+
+
+def filter_stylesheet(css_text, tag_dictionary=SUPPORTED_TAGS):
+    """
+    Keeps only the rules of a stylesheet whose selectors can match html
+    cleaned with tag_dictionary, and minifies them.
+
+    Selectors naming a tag missing from tag_dictionary, or requiring an
+    attribute (class, id...) that the tag can't keep, are removed, along with
+    declarations referencing images or fonts. @media and @supports rules are
+    filtered in turn, and every other at-rule is removed.
+
+    Args:
+        css_text (str): The stylesheet.
+        tag_dictionary (Option[dict]): The tags and attributes kept by
+            pypub.clean. By default these are the tags supported by Kindle.
+
+    Returns:
+        str: The remaining rules, minified, one rule per line.
+    """
+    css_text = _COMMENT_PATTERN.sub('', css_text)
+    return '\n'.join(_filter_rules(css_text, _get_tag_attributes(tag_dictionary)))
+
+
+def merge_stylesheets(stylesheets):
+    """
+    Merges stylesheets returned by filter_stylesheet into one. Rules found
+    more than once are only kept at their last position, which doesn't change
+    what they apply to.
+
+    Args:
+        stylesheets (list): Filtered stylesheets, in the order they apply in.
+
+    Returns:
+        str: The merged stylesheet.
+    """
+    rules = collections.OrderedDict()
+    for stylesheet in stylesheets:
+        for rule in stylesheet.split('\n'):
+            if rule:
+                rules.pop(rule, None)
+                rules[rule] = True
+    return '\n'.join(rules)
+
+
+def fetch_stylesheet(url, headers=None):
+    """
+    Returns the content of the stylesheet at url, a web url or a local file.
+
+    Raises:
+        CSSErrorException: Raised if the stylesheet can't be read.
+    """
+    content_type = None
+    try:
+        if urlparse(url).scheme in ('http', 'https'):
+            fetch_result = fetch.fetch(url, headers)
+            content = fetch_result.content
+            content_type = fetch_result.content_type
+        else:
+            with open(url, 'rb') as f:
+                content = f.read()
+    except (fetch.FetchError, IOError, OSError):
+        raise CSSErrorException(url)
+    return charset.decode(content, content_type)
+
+
+def _get_attributes(attribute_string):
+    return dict((name.lower(), value.strip('"\''))
+                for name, value in _ATTRIBUTE_PATTERN.findall(attribute_string))
+
+
+def _applies_to_screen(attributes):
+    media = attributes.get('media', 'all').lower()
+    return 'all' in media or 'screen' in media
+
+
+def collect_stylesheets(html_string, base_url=None,
+                        tag_dictionary=SUPPORTED_TAGS, cache=None, headers=None):
+    """
+    Returns the linked and inline stylesheets of an html page, filtered and
+    minified with filter_stylesheet, in document order. Must be called on the
+    raw page, since pypub.clean removes link and style tags.
+
+    Linked stylesheets are downloaded with pypub.fetch, so they share the
+    fetch cache, and stylesheets that can't be downloaded are skipped.
+
+    Args:
+        html_string (str): The raw html page.
+        base_url (Option[str]): The url or file the page is from, which
+            relative links are resolved against.
+        tag_dictionary (Option[dict]): Passed to filter_stylesheet.
+        cache (Option[dict]): Filtered stylesheets by hash of their content.
+            Pass the same dict for every page of a site so its stylesheets
+            are only filtered once.
+        headers (Option[dict]): Extra headers for downloading stylesheets.
+
+    Returns:
+        list: The filtered stylesheets.
+    """
+    stylesheets = []
+    for match in _STYLESHEET_PATTERN.finditer(html_string):
+        if match.group(1) is not None:
+            attributes = _get_attributes(match.group(1))
+            rel = attributes.get('rel', '').lower().split()
+            if ('stylesheet' not in rel or 'alternate' in rel or
+                    not attributes.get('href') or not _applies_to_screen(attributes)):
+                continue
+            url = attributes['href']
+            if base_url:
+                if urlparse(base_url).scheme in ('http', 'https'):
+                    url = urljoin(base_url, url)
+                else:
+                    url = os.path.join(os.path.dirname(base_url), url)
+            try:
+                css_text = fetch_stylesheet(url, headers)
+            except CSSErrorException:
+                continue
+        else:
+            if not _applies_to_screen(_get_attributes(match.group(2))):
+                continue
+            css_text = match.group(3)
+        if cache is None:
+            stylesheet = filter_stylesheet(css_text, tag_dictionary)
+        else:
+            key = hashlib.sha1(css_text.encode('utf-8') if isinstance(css_text, text_type)
+                               else css_text).hexdigest()
+            stylesheet = cache.get(key)
+            if stylesheet is None:
+                if len(cache) >= STYLESHEET_CACHE_SIZE:
+                    cache.clear()
+                stylesheet = cache[key] = filter_stylesheet(css_text, tag_dictionary)
+        if stylesheet:
+            stylesheets.append(stylesheet)
+    return stylesheets
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import binascii
+import collections
+import hashlib
+import re
+import threading
+
+from . import clean
+
+FINGERPRINT_BITS = 64
+# Pages with fewer words than this aren't fingerprinted, short pages such as
+# error pages or bare link lists look alike whatever they say
+MIN_TOKENS = 50
+
+# Modes of a DuplicateDetector
+DROP = 'drop'
+LINK = 'link'
+
+# Characters of scripts written without spaces, taken as one token each
+_CJK_RANGES = u'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_PATTERN = re.compile(u'[%s]|[^\\W%s]+' % (_CJK_RANGES, _CJK_RANGES), re.U)
+_BODY_PATTERN = re.compile(r'<body\b', re.I)
+_TAG_PATTERN = re.compile(r'<[^>]*>|&#?\w+;')
+
+# A chapter skipped as a duplicate:
+#   source: the url or title of the skipped chapter
+#   original: the url or title of the chapter it duplicates
+#   distance: the number of bits their fingerprints differ in
+DuplicateRecord = collections.namedtuple('DuplicateRecord',
+                                         ['source', 'original', 'distance'])
+
+
+class DuplicateChapterError(Exception):
+    """
+    Raised by ChapterFactory when a chapter duplicates one it already created
+    and its duplicate detector drops duplicates.
+    """
+
+    def __init__(self, source, original, distance):
+        self.source = source
+        self.original = original
+        self.distance = distance
+
+    def __str__(self):
+        return '%s duplicates %s' % (self.source, self.original)
+
+
+def get_text(html_string):
+    """
+    Returns the words of an html page or text, without its markup, head,
+    scripts and styles. This only scans the page with regular expressions,
+    so it is much cheaper than parsing it.
+    """
+    html_string = clean.prefilter(html_string)
+    match = _BODY_PATTERN.search(html_string)
+    if match is not None:
+        html_string = html_string[match.start():]
+    return _TAG_PATTERN.sub(u' ', html_string)
+
+
+def get_tokens(text):
+    """
+    Returns the lower case words of text. Chinese, Japanese and Korean
+    characters are a word each.
+    """
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def _hash_feature(feature):
+    digest = hashlib.md5(feature.encode('utf-8')).digest()
+    return int(binascii.hexlify(digest[:FINGERPRINT_BITS // 8]), 16)
+
+
+def simhash(tokens, shingle_size=3):
+    """
+    Returns the SimHash fingerprint of a list of tokens, a 64 bit int. The
+    features hashed are the runs of shingle_size consecutive tokens, so
+    texts sharing most of their sentences have fingerprints differing in
+    few bits.
+    """
+    if len(tokens) > shingle_size:
+        features = collections.Counter(
+                u' '.join(tokens[i:i + shingle_size])
+                for i in range(len(tokens) - shingle_size + 1))
+    else:
+        features = collections.Counter([u' '.join(tokens)])
+    weights = [0] * FINGERPRINT_BITS
+    for feature, count in features.items():
+        feature_hash = _hash_feature(feature)
+        for bit in range(FINGERPRINT_BITS):
+            if feature_hash >> bit & 1:
+                weights[bit] += count
+            else:
+                weights[bit] -= count
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class DuplicateDetector(object):
+    """
+    Finds chapters whose text is the same as, or nearly the same as, that of
+    a chapter seen before, by the SimHash fingerprint of their text. Pass it
+    to a ChapterFactory to skip cleaning, downloading the images of and
+    writing duplicate chapters, and use the same detector for every chapter
+    of a book. A detector may be used from several threads.
+
+    Fingerprints are indexed by threshold + 1 bands of their bits, since two
+    fingerprints differing in at most threshold bits are the same in at
+    least one band, so a lookup only compares the fingerprints sharing a
+    band with it.
+
+    Args:
+        threshold (Option[int]): The most bits the fingerprints of near
+            duplicates differ in. 3 by default, 0 only finds chapters with the
+            same words. At most 15.
+        mode (Option[str]): What ChapterFactory does with a duplicate.
+            pypub.dedup.DROP (the default) raises DuplicateChapterError, and
+            pypub.dedup.LINK creates a short chapter linking to the source of
+            the original instead.
+        min_tokens (Option[int]): Chapters with fewer words are never
+            duplicates.
+
+    Attributes:
+        skipped (list): A DuplicateRecord for each duplicate found.
+    """
+
+    def __init__(self, threshold=3, mode=DROP, min_tokens=MIN_TOKENS):
+        try:
+            assert 0 <= threshold < 16
+        except AssertionError:
+            raise ValueError('threshold must be between 0 and 15')
+        try:
+            assert mode in (DROP, LINK)
+        except AssertionError:
+            raise ValueError('mode must be %r or %r' % (DROP, LINK))
+        self.threshold = threshold
+        self.mode = mode
+        self.min_tokens = min_tokens
+        self.skipped = []
+        band_count = threshold + 1
+        self._bands = [(FINGERPRINT_BITS * i // band_count,
+                        FINGERPRINT_BITS * (i + 1) // band_count)
+                       for i in range(band_count)]
+        self._index = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _get_band_keys(self, fingerprint):
+        return [(i, fingerprint >> start & ((1 << (end - start)) - 1))
+                for i, (start, end) in enumerate(self._bands)]
+
+    def _find(self, fingerprint):
+        best = None
+        for key in self._get_band_keys(fingerprint):
+            for other, source in self._index.get(key, ()):
+                distance = hamming_distance(fingerprint, other)
+                if distance <= self.threshold and (best is None or distance < best[1]):
+                    best = (source, distance)
+        return best
+
+    def check(self, html_string, source):
+        """
+        Fingerprints a chapter and looks for a chapter it duplicates. New
+        chapters are added to the index, duplicates are recorded in skipped.
+
+        Args:
+            html_string (str): The raw html or text of the chapter.
+            source (str): The url or title of the chapter.
+
+        Returns:
+            DuplicateRecord: The duplicate found, or None if the chapter is
+                new.
+        """
+        tokens = get_tokens(get_text(html_string))
+        if len(tokens) < self.min_tokens:
+            return None
+        fingerprint = simhash(tokens)
+        with self._lock:
+            found = self._find(fingerprint)
+            if found is None:
+                for key in self._get_band_keys(fingerprint):
+                    self._index[key].append((fingerprint, source))
+                return None
+            record = DuplicateRecord(source, found[0], found[1])
+            self.skipped.append(record)
+            return record
+
+    def format_report(self):
+        """
+        Returns a report of the duplicates found, one per line.
+        """
+        lines = ['Duplicates skipped: %d' % len(self.skipped)]
+        for record in self.skipped:
+            lines.append('  %s (%d bits from %s)' % (record.source, record.distance,
+                                                    record.original))
+        return '\n'.join(lines)
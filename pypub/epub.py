@@ -1,32 +1,44 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import collections
-import imp
+import hashlib
 import random
 import string
 import shutil
 import tempfile
 import time
 import codecs
+import logging
 import uuid
-import jinja2
-import requests
-import requests.packages.urllib3
 from six import text_type, binary_type
 
+# lxml is only imported when a table of contents is parsed
 try:
-    imp.find_module('lxml')
-    lxml_module_exists = True
-    import lxml.etree
-    import lxml.html
-    import lxml.html.builder
+    from importlib.util import find_spec
+    lxml_module_exists = find_spec('lxml') is not None
 except ImportError:
-    lxml_module_exists = False
+    import imp
+    try:
+        imp.find_module('lxml')
+        lxml_module_exists = True
+    except ImportError:
+        lxml_module_exists = False
 
 from .constants import *
+from . import archive
 from . import chapter
+from . import check
+from . import css
+from . import journal
+from . import profiling
+from . import progress
+from . import reader
+from . import utils
 
-requests.packages.urllib3.disable_warnings()
+logger = logging.getLogger(__name__)
+
+# File extensions covers are archived with, by media type
+_COVER_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif'}
 
 class _Mimetype(object):
 
@@ -60,15 +72,11 @@ class _EpubFile(object):
         self.non_chapter_parameters['image_items'] = image_list
 
     def _render_template(self, **variable_value_pairs):
-        def read_template():
-            with codecs.open(self.template_file, 'r', 'utf-8') as f:
-                template = f.read()
-            return jinja2.Template(template)
-        template = read_template()
+        template = utils.load_template(self.template_file)
         rendered_template = template.render(variable_value_pairs)
         self.content = rendered_template
 
-    def add_chapters(self, **parameter_lists):
+    def _get_template_chapters(self, **parameter_lists):
         def check_list_lengths(lists):
             list_length = None
             for value in lists.values():
@@ -80,33 +88,100 @@ class _EpubFile(object):
         check_list_lengths(parameter_lists)
         template_chapter = collections.namedtuple('template_chapter',
                                                   parameter_lists.keys())
-        chapters = [template_chapter(*items) for items in zip(*parameter_lists.values())]
+        return [template_chapter(*items) for items in zip(*parameter_lists.values())]
+
+    def add_chapters(self, **parameter_lists):
+        chapters = self._get_template_chapters(**parameter_lists)
         self._render_template(chapters=chapters, **self.non_chapter_parameters)
 
     def get_content(self):
         return self.content
 
 
+def get_cover_type(cover_file):
+    """
+    Returns the media type of a cover image, from its leading bytes, or from
+    its file extension if they match no supported image type.
+    """
+    with open(cover_file, 'rb') as f:
+        head = f.read(8)
+    return (check.get_image_type_from_bytes(head) or
+            chapter.get_image_type(cover_file) or 'image/jpeg')
+
+
+def get_toc_page_names(page_count):
+    """
+    Returns the file names of the pages of a table of contents split into
+    page_count pages.
+    """
+    return ['toc.html'] + ['toc_%04d.html' % n for n in range(2, page_count + 1)]
+
+
+_template_page = collections.namedtuple('template_page', ['id', 'title', 'link'])
+
+
 class TocHtml(_EpubFile):
+    """
+    The html table of contents. With a page_size, books with more chapters
+    than that get a table of contents split into pages of page_size chapters,
+    linked to each other, and the first page also lists every page.
+    """
 
-    def __init__(self, template_file=os.path.join(EPUB_TEMPLATES_DIR, 'toc.html'), **non_chapter_parameters):
+    def __init__(self, template_file=os.path.join(EPUB_TEMPLATES_DIR, 'toc.html'),
+                 page_size=None, **non_chapter_parameters):
         super(TocHtml, self).__init__(template_file, **non_chapter_parameters)
+        self.page_size = page_size
+        self.page_contents = []
 
     def add_chapters(self, chapter_list):
         chapter_numbers = range(1, len(chapter_list)+1)
         link_list = ['chapter_%04d.xhtml' % n for n in chapter_numbers]
         try:
             for c in chapter_list:
-                assert type(c) == chapter.Chapter
+                assert isinstance(c, chapter.Chapter)
         except AssertionError:
-            raise TypeError('chapter_list items must be Chapter not %s',
-                            str(t))
+            raise TypeError('chapter_list items must be Chapter not %s' %
+                            type(c))
         chapter_titles = [c.html_title for c in chapter_list]
-        super(TocHtml, self).add_chapters(title=chapter_titles,
-                                          link=link_list)
+        if not self.page_size or len(chapter_list) <= self.page_size:
+            super(TocHtml, self).add_chapters(title=chapter_titles,
+                                              link=link_list)
+            self.page_contents = [self.content]
+            return
+        chapters = self._get_template_chapters(title=chapter_titles,
+                                               link=link_list)
+        starts = range(0, len(chapters), self.page_size)
+        page_names = get_toc_page_names(len(starts))
+        pages = [_template_page(os.path.splitext(name)[0],
+                                '%d - %d' % (start + 1, min(start + self.page_size, len(chapters))),
+                                name)
+                 for name, start in zip(page_names, starts)]
+        self.page_contents = []
+        for index, start in enumerate(starts):
+            self._render_template(
+                    chapters=chapters[start:start + self.page_size],
+                    pages=pages if index == 0 else [],
+                    page_number=index + 1,
+                    page_count=len(pages),
+                    previous_page=page_names[index - 1] if index > 0 else None,
+                    next_page=page_names[index + 1] if index + 1 < len(pages) else None,
+                    **self.non_chapter_parameters)
+            self.page_contents.append(self.content)
+        self.content = self.page_contents[0]
+
+    def get_page_names(self):
+        return get_toc_page_names(max(len(self.page_contents), 1))
+
+    def write(self, file_name):
+        super(TocHtml, self).write(file_name)
+        directory = os.path.dirname(file_name)
+        for name, content in zip(self.get_page_names()[1:], self.page_contents[1:]):
+            with codecs.open(os.path.join(directory, name), 'w', 'utf-8') as f:
+                f.write(content)
 
     def get_content_as_element(self):
         if lxml_module_exists:
+            import lxml.html
             root = lxml.html.fromstring(self.content.encode('utf-8'))
             return root
         else:
@@ -114,11 +189,17 @@ class TocHtml(_EpubFile):
 
 
 class TocNcx(_EpubFile):
+    """
+    The NCX table of contents. With a page_size, books with more chapters
+    than that get a two level navMap, with the chapters of each page_size
+    group nested under one entry.
+    """
 
     def __init__(self,
                  template_file=os.path.join(EPUB_TEMPLATES_DIR, 'toc_ncx.xml'),
-                 **non_chapter_parameters):
+                 page_size=None, **non_chapter_parameters):
         super(TocNcx, self).__init__(template_file, **non_chapter_parameters)
+        self.page_size = page_size
 
     def add_chapters(self, chapter_list):
         chapter_numbers = range(1,len(chapter_list)+1)
@@ -126,13 +207,32 @@ class TocNcx(_EpubFile):
         play_order_list = [n for n in chapter_numbers]
         title_list = [c.html_title for c in chapter_list]
         link_list = ['chapter_%04d.xhtml' % n for n in chapter_numbers]
-        super(TocNcx, self).add_chapters(**{'id': id_list,
-                                            'play_order': play_order_list,
-                                            'title': title_list,
-                                            'link': link_list})
+        parameter_lists = {'id': id_list,
+                           'play_order': play_order_list,
+                           'title': title_list,
+                           'link': link_list}
+        if not self.page_size or len(chapter_list) <= self.page_size:
+            super(TocNcx, self).add_chapters(**parameter_lists)
+            return
+        chapters = self._get_template_chapters(**parameter_lists)
+        template_group = collections.namedtuple(
+                'template_group', ['id', 'play_order', 'title', 'link', 'chapters'])
+        groups = []
+        for index, start in enumerate(range(0, len(chapters), self.page_size)):
+            group_chapters = chapters[start:start + self.page_size]
+            # a group points at its first chapter, so it shares its playOrder
+            groups.append(template_group(
+                    'chapter_group_%04d' % (index + 1),
+                    group_chapters[0].play_order,
+                    '%d - %d' % (start + 1, start + len(group_chapters)),
+                    group_chapters[0].link,
+                    group_chapters))
+        self._render_template(chapters=[], groups=groups, depth=2,
+                              **self.non_chapter_parameters)
 
     def get_content_as_element(self):
         if lxml_module_exists:
+            import lxml.etree
             root = lxml.etree.fromstring(self.content.encode('utf-8'))
             return root
         else:
@@ -141,7 +241,9 @@ class TocNcx(_EpubFile):
 
 class ContentOpf(_EpubFile):
 
-    def __init__(self, title, creator='', language='', rights='', publisher='', uid='', date=time.strftime("%Y-%m-%d")):
+    def __init__(self, title, creator='', language='', rights='', publisher='', uid='', date=None,
+                 cover_link='cover.jpg', cover_type='image/jpeg'):
+        date = date or time.strftime("%Y-%m-%d")
         super(ContentOpf, self).__init__(os.path.join(EPUB_TEMPLATES_DIR, 'opf.xml'),
                                          title=title,
                                          creator=creator,
@@ -149,22 +251,49 @@ class ContentOpf(_EpubFile):
                                          rights=rights,
                                          publisher=publisher,
                                          uid=uid,
-                                         date=date)
+                                         date=date,
+                                         cover_link=cover_link,
+                                         cover_type=cover_type)
+
+    def add_toc_pages(self, page_names):
+        self.non_chapter_parameters['toc_pages'] = [
+                _template_page(os.path.splitext(name)[0], None, name)
+                for name in page_names]
 
     def add_chapters(self, chapter_list):
-        chapter_numbers = range(1,len(chapter_list)+1)
-        id_list = ['chapter_%04d' % n for n in chapter_numbers]
-        link_list = ['chapter_%04d.xhtml' % n for n in chapter_numbers]
+        # every part of a split chapter is an item of the manifest and spine
+        link_list = [chapter.get_part_file_name('chapter_%04d.xhtml' % n, part)
+                     for n, c in enumerate(chapter_list, 1)
+                     for part in range(1, c.part_count + 1)]
+        id_list = [os.path.splitext(link)[0] for link in link_list]
         super(ContentOpf, self).add_chapters(**{'id': id_list, 'link': link_list})
 
     def get_content_as_element(self):
         if lxml_module_exists:
+            import lxml.etree
             root = lxml.etree.fromstring(self.content.encode('utf-8'))
             return root
         else:
             raise NotImplementedError()
 
 
+class WorkspaceFullError(Exception):
+    """
+    Raised by Epub.add_chapter when the files staged for a book grow past its
+    max_workspace_bytes. The book's staged files are deleted first, unless
+    the build is resumable.
+    """
+
+    def __init__(self, directory, size, max_size):
+        self.directory = directory
+        self.size = size
+        self.max_size = max_size
+
+    def __str__(self):
+        return '%d bytes staged in %s, over the limit of %d' % (
+                self.size, self.directory, self.max_size)
+
+
 class Epub(object):
     """
     Class representing an epub. Add chapters to this and then output your ebook
@@ -178,13 +307,87 @@ class Epub(object):
         rights (Option[str]): The rights of your epub.
         publisher (Option[str]): The publisher of your epub. By default this
             is pypub.
+        cover_file (Option[str]): The cover image of your epub, a jpeg, png
+            or gif file. It is archived as cover.jpg, cover.png or cover.gif
+            after its content, whatever its file name.
+        css_file (Option[str]): The stylesheet of your epub. Stylesheets kept
+            by a ChapterFactory with collect_css are merged into it, without
+            duplicate rules.
+        max_volume_chapters (Option[int]): Split the book into volumes of at
+            most this many chapters.
+        max_volume_bytes (Option[int]): Split the book into volumes of about
+            this many bytes of chapters and images. A volume is closed as soon
+            as the chapter that reaches the cap is added.
+        volume_directory (Option[str]): Directory to save volumes to. Required
+            if either volume cap is set. Each volume is saved as soon as it
+            is full and its staged files are deleted, so memory and disk use
+            don't grow with the size of the book. Volumes get their own
+            table of contents and a numbered title, and share the cover and
+            css of the book.
+        archive_options (Option[dict]): Default compress_level, store_media
+            and compress_threads for the archives written by this Epub.
+        toc_page_size (Option[int]): Split the html table of contents into
+            pages of this many chapters, and group the NCX entries the same
+            way, so that books with many chapters stay fast to navigate. By
+            default the table of contents is a single page.
+        max_chapter_bytes (Option[int]): Split chapters bigger than this
+            many bytes of xhtml between block tags, into parts written to
+            files numbered after the chapter's (chapter_0001_02.xhtml...).
+            Every part is in the spine, and the tables of contents link to
+            the first. By default chapters are never split.
+        memory_profiler (Option[pypub.profiling.MemoryProfiler]): Records the
+            memory allocated adding the images of each chapter, writing it,
+            and writing the archive.
+        progress (Option[pypub.progress.ProgressTracker]): Receives an event
+            as the images of each chapter are resolved, each chapter is
+            written, each archive entry is written and each epub file is
+            saved.
+        work_dir (Option[str]): Make the build resumable. The files of the
+            book are staged in work_dir, and every chapter added is recorded
+            in a journal next to them. Creating an Epub with the same work_dir
+            and job_id after a crash restores the chapters whose files are
+            intact, drops the rest, and continues from there: chapters already
+            recorded are skipped by add_chapter, or can be checked for with
+            resume_chapter before fetching them. The staged files and the
+            journal are deleted once the epub is created.
+        job_id (Option[str]): Names the build in work_dir. Required with
+            work_dir.
+        reproducible (Option[bool]): Make the epub files depend only on the
+            content of the book, so building the same book twice gives
+            byte-identical files. Unless a uid is given, it is derived from
+            the chapters, images, cover, css and metadata, and every archive
+            entry gets the timestamp's date and the same permissions.
+        timestamp (Option[float]): The date of the book, in seconds since
+            the epoch. By default this is the current time, or with
+            reproducible the SOURCE_DATE_EPOCH environment variable, or else
+            1980-01-01.
+        workspace_dir (Option[str]): Directory the files of the book are
+            staged in, in a temporary directory of their own. By default this
+            is the system's temporary directory. A tmpfs such as /dev/shm
+            makes builds faster, a large volume fits bigger books.
+        max_workspace_bytes (Option[int]): The most bytes of chapters and
+            images staged at a time, per volume if the book has volumes.
+            add_chapter raises WorkspaceFullError past it.
+        check (Option[bool]): Check the structure of every epub file created,
+            with pypub.check.check_epub. create_epub raises
+            pypub.check.EpubCheckError if a file has problems. Reports of the
+            files checked are kept in check_reports.
+
+    Staged files are kept until the Epub is closed, so either call close once
+    the epub is created, or use the Epub as a context manager:
+
+        with pypub.Epub('My First Epub') as my_first_epub:
+            my_first_epub.add_chapter(my_first_chapter)
+            my_first_epub.create_epub(output_directory)
     """
 
     def __init__(self, title, creator='pypub', language='en', rights='', 
         publisher='pypub', cover_file=None, css_file=None,
-        uid=None, epub_dir=None):
-        self._create_directories(epub_dir)
-        self.chapters = []
+        uid=None, epub_dir=None, max_volume_chapters=None,
+        max_volume_bytes=None, volume_directory=None, archive_options=None,
+        toc_page_size=None, max_chapter_bytes=None, memory_profiler=None, progress=None,
+        work_dir=None, job_id=None, reproducible=False, timestamp=None,
+        workspace_dir=None, max_workspace_bytes=None, check=False):
         self.title = title
         try:
             assert title
@@ -195,29 +398,229 @@ class Epub(object):
         self.rights = rights
         self.publisher = publisher
         self.uid = uid or uuid.uuid4().hex
-        self.current_chapter_number = None
-        self._increase_current_chapter_number()
+        self.reproducible = reproducible
+        self._content_uid = reproducible and not uid
+        if timestamp is None and reproducible:
+            timestamp = float(os.environ.get('SOURCE_DATE_EPOCH',
+                                             REPRODUCIBLE_TIMESTAMP))
+        self.timestamp = timestamp
         self.cover = cover_file or DEFAULT_COVER
+        self.cover_type = get_cover_type(self.cover)
+        self.cover_link = 'cover.%s' % _COVER_EXTENSIONS[self.cover_type]
         self.css = css_file or DEFAULT_CSS
-        self.toc_html = TocHtml()
-        self.toc_ncx = TocNcx()
-        self.opf = ContentOpf(self.title, self.creator, self.language, 
-            self.rights, self.publisher, self.uid)
+        self.max_volume_chapters = max_volume_chapters
+        self.max_volume_bytes = max_volume_bytes
+        self.volume_directory = volume_directory
+        self.archive_options = archive_options or {}
+        self.toc_page_size = toc_page_size
+        self.max_chapter_bytes = max_chapter_bytes
+        self.memory_profiler = memory_profiler
+        self.progress = progress
+        self.workspace_dir = workspace_dir
+        self.max_workspace_bytes = max_workspace_bytes
+        self.check = check
+        self.check_reports = []
+        self.volume_files = []
+        if self._has_volumes():
+            try:
+                assert volume_directory is not None
+            except AssertionError:
+                raise ValueError('volume_directory is required when volume size is capped')
+            self.volume_number = 1
+        else:
+            self.volume_number = None
+        self._epub_dir = epub_dir
+        self._journal = None
+        self._finished_sources = collections.Counter()
+        if work_dir is None:
+            self._start_volume()
+        else:
+            self._open_journal(work_dir, job_id)
+
+    def _open_journal(self, work_dir, job_id):
+        try:
+            assert job_id
+        except AssertionError:
+            raise ValueError('job_id is required with work_dir')
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        self._epub_dir = os.path.join(work_dir, job_id)
+        self._journal = journal.Journal(os.path.join(work_dir, job_id + '.journal'))
+        records = self._journal.read()
+        if not records:
+            if os.path.exists(self._epub_dir):
+                shutil.rmtree(self._epub_dir)
+            self._journal.append({'type': 'book', 'uid': self.uid})
+            self._start_volume()
+            return
+        self.uid = records[0]['uid']
+        volume_records = [r for r in records if r['type'] == 'volume']
+        if self.volume_number is not None:
+            self.volume_number = len(volume_records) + 1
+            self.volume_files = [r['file'] for r in volume_records]
+        self._start_volume()
+        kept_records = []
+        restoring = True
+        for record in records:
+            if record['type'] == 'chapter' and record['volume'] == self.volume_number:
+                # chapters of the current volume are only kept up to the
+                # first one whose files didn't survive the crash
+                restoring = (restoring and
+                             record['file'] == self.current_chapter_path and
+                             journal.is_chapter_intact(record, self.OEBPS_DIR))
+                if not restoring:
+                    continue
+                self.chapters.append(journal.JournaledChapter(record))
+                self.volume_bytes += record['size'] + sum(
+                        part['size'] for part in record.get('parts', [])) + sum(
+                        image['size'] for image in record['images'])
+                self._increase_current_chapter_number()
+            if record['type'] == 'chapter':
+                self._finished_sources[record['source']] += 1
+            kept_records.append(record)
+        if len(kept_records) != len(records):
+            self._journal.rewrite(kept_records)
+        self._remove_unjournaled_files()
+
+    def _remove_unjournaled_files(self):
+        chapter_files = set(chapter.get_part_file_name('chapter_%04d.xhtml' % n, part)
+                            for n, c in enumerate(self.chapters, 1)
+                            for part in range(1, c.part_count + 1))
+        image_files = set(os.path.basename(image.link)
+                          for c in self.chapters for image in c.images)
+        for name in os.listdir(self.OEBPS_DIR):
+            if name.startswith('chapter_') and name not in chapter_files:
+                os.remove(os.path.join(self.OEBPS_DIR, name))
+        for name in os.listdir(self.IMAGE_DIR):
+            if name not in image_files:
+                os.remove(os.path.join(self.IMAGE_DIR, name))
+
+    def _close_journal(self):
+        self._journal.remove()
+        if os.path.exists(self._epub_dir):
+            shutil.rmtree(self._epub_dir)
+
+    def resume_chapter(self, source):
+        """
+        Checks if a chapter was added before a resumable build was restarted.
+        Call it before fetching a chapter, to skip chapters that are already
+        in the book.
+
+        Args:
+            source (str): The url of the chapter, or its title if it has no
+                url.
+
+        Returns:
+            bool: True if the chapter was already added. It must not be added
+                again.
+        """
+        if self._finished_sources[source] > 0:
+            self._finished_sources[source] -= 1
+            return True
+        return False
+
+    def _has_volumes(self):
+        return bool(self.max_volume_chapters or self.max_volume_bytes)
+
+    def _start_volume(self):
+        epub_dir = self._epub_dir
+        if epub_dir is not None and self.volume_number is not None:
+            epub_dir = os.path.join(epub_dir, 'volume_%03d' % self.volume_number)
+        self._create_directories(epub_dir)
+        self.chapters = []
+        self.volume_bytes = 0
+        self.current_chapter_number = None
+        self._increase_current_chapter_number()
+        self.toc_html = TocHtml(page_size=self.toc_page_size)
+        self.toc_ncx = TocNcx(page_size=self.toc_page_size)
+        date = None
+        if self.timestamp is not None:
+            date = time.strftime('%Y-%m-%d', time.gmtime(self.timestamp))
+        self.opf = ContentOpf(self._get_volume_title(), self.creator, self.language, 
+            self.rights, self.publisher, self.uid, date, self.cover_link,
+            self.cover_type)
         self.mimetype = _Mimetype(self.EPUB_DIR)
         self.container = _ContainerFile(self.META_INF_DIR)
 
+    def _get_content_uid(self):
+        # hashes what the book is made of, in a fixed order, and none of the
+        # files generated from it
+        digest = hashlib.sha1()
+        for part in (self._get_volume_title(), self.creator, self.language,
+                     self.rights, self.publisher):
+            digest.update(part.encode('utf-8') + b'\0')
+        for c in self.chapters:
+            for stylesheet in c.stylesheets:
+                digest.update(stylesheet.encode('utf-8') + b'\0')
+        file_names = [self.cover, self.css]
+        for name in sorted(os.listdir(self.OEBPS_DIR)):
+            if name.startswith('chapter_'):
+                file_names.append(os.path.join(self.OEBPS_DIR, name))
+        for name in sorted(os.listdir(self.IMAGE_DIR)):
+            file_names.append(os.path.join(self.IMAGE_DIR, name))
+        for file_name in file_names:
+            digest.update(os.path.basename(file_name).encode('utf-8') + b'\0')
+            digest.update(utils.get_file_digest(file_name).encode('ascii'))
+        return uuid.UUID(bytes=digest.digest()[:16], version=5).hex
+
+    def _get_archive_date_time(self):
+        if not self.reproducible:
+            return None
+        return max(time.gmtime(self.timestamp)[:6], (1980, 1, 1, 0, 0, 0))
+
+    def _get_volume_title(self):
+        if self.volume_number is None:
+            return self.title
+        return u'%s - Volume %d' % (self.title, self.volume_number)
+
+    def _is_volume_full(self):
+        if self.max_volume_chapters and len(self.chapters) >= self.max_volume_chapters:
+            return True
+        return bool(self.max_volume_bytes and self.volume_bytes >= self.max_volume_bytes)
+
+    def _finish_volume(self, start_next=True):
+        volume_file = self._write_package(self.volume_directory,
+                                          self._get_volume_title(),
+                                          **self.archive_options)
+        self.volume_files.append(volume_file)
+        if self._journal is not None:
+            self._journal.append({'type': 'volume', 'file': volume_file})
+        shutil.rmtree(self.EPUB_DIR)
+        if start_next:
+            self.volume_number += 1
+            self._start_volume()
+
     def _create_directories(self, epub_dir=None):
+        self._is_temporary_dir = epub_dir is None
         if epub_dir is None:
-            self.EPUB_DIR = tempfile.mkdtemp()
+            if self.workspace_dir is not None and not os.path.isdir(self.workspace_dir):
+                os.makedirs(self.workspace_dir)
+            self.EPUB_DIR = tempfile.mkdtemp(prefix='pypub-', dir=self.workspace_dir)
         else:
             self.EPUB_DIR = epub_dir
         self.OEBPS_DIR = os.path.join(self.EPUB_DIR, 'OEBPS')
         self.META_INF_DIR = os.path.join(self.EPUB_DIR, 'META-INF')
         self.LOCAL_IMAGE_DIR = 'images'
         self.IMAGE_DIR = os.path.join(self.OEBPS_DIR, self.LOCAL_IMAGE_DIR)
-        os.makedirs(self.OEBPS_DIR)
-        os.makedirs(self.META_INF_DIR)
-        os.makedirs(self.IMAGE_DIR)
+        for directory in (self.OEBPS_DIR, self.META_INF_DIR, self.IMAGE_DIR):
+            # a resumed build finds its directories already there
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Deletes the files staged for the book. Files staged in epub_dir or
+        work_dir are left to their owner, and those of a resumable build are
+        deleted by create_epub instead, so a build which failed can resume.
+        """
+        if self._is_temporary_dir and os.path.exists(self.EPUB_DIR):
+            shutil.rmtree(self.EPUB_DIR)
 
     def _increase_current_chapter_number(self):
         if self.current_chapter_number is None:
@@ -227,54 +630,183 @@ class Epub(object):
         self.current_chapter_id = str(self.current_chapter_number)
         self.current_chapter_path = 'chapter_%04d.xhtml' % self.current_chapter_number
 
-    def add_chapter(self, c):
+    def add_chapter(self, c, image_content=None):
         """
         Add a Chapter to your epub.
 
         Args:
             c (Chapter): A Chapter object representing your chapter.
+            image_content (Option[dict]): Images of the chapter which have
+                already been downloaded, mapping image url to content, or to
+                None for images that failed to download.
 
         Raises:
             TypeError: Raised if a Chapter object isn't supplied to this
                 method.
+            WorkspaceFullError: Raised if max_workspace_bytes is set and the
+                staged files grow past it with this chapter.
         """
         try:
-            assert type(c) == chapter.Chapter
+            assert isinstance(c, chapter.Chapter)
         except AssertionError:
             raise TypeError('chapter must be of type Chapter')
+        if self.resume_chapter(c.url or c.title):
+            return
         chapter_file_output = os.path.join(self.OEBPS_DIR, self.current_chapter_path)
-        c._replace_images_in_chapter(self.OEBPS_DIR)
-        c.write(chapter_file_output)
+        with profiling.stage(self.memory_profiler, 'images', c.url or c.title):
+            c._replace_images_in_chapter(self.OEBPS_DIR, image_content)
+        image_bytes = 0
+        if self._has_volumes() or self.progress is not None or self.max_workspace_bytes:
+            for image in c.images:
+                image_file = os.path.join(self.OEBPS_DIR, image.link)
+                if os.path.exists(image_file):
+                    image_bytes += os.path.getsize(image_file)
+        progress.emit(self.progress, progress.IMAGES_RESOLVED,
+                      c.url or c.title, image_bytes)
+        with profiling.stage(self.memory_profiler, 'write', c.url or c.title):
+            if self.max_chapter_bytes:
+                part_files = c.write(chapter_file_output, self.max_chapter_bytes)
+            else:
+                part_files = c.write(chapter_file_output)
+        chapter_bytes = sum(os.path.getsize(f)
+                            for f in part_files or [chapter_file_output])
+        progress.emit(self.progress, progress.CHAPTER_WRITTEN,
+                      c.url or c.title, chapter_bytes)
+        self.volume_bytes += chapter_bytes + image_bytes
+        if self.max_workspace_bytes and self.volume_bytes > self.max_workspace_bytes:
+            self.close()
+            raise WorkspaceFullError(self.EPUB_DIR, self.volume_bytes,
+                                     self.max_workspace_bytes)
+        if self._journal is not None:
+            self._journal.append(journal.get_chapter_record(
+                    c, self.current_chapter_path, self.volume_number,
+                    self.OEBPS_DIR))
         self._increase_current_chapter_number()
         self.chapters.append(c)
+        if self._has_volumes() and self._is_volume_full():
+            self._finish_volume()
 
-    def create_epub(self, output_directory, epub_name=None):
+    def add_epub(self, epub_file):
         """
-        Create an epub file from this object.
+        Add every chapter of an existing epub to your epub. The chapters and
+        their images are copied as they are, with only file names and the
+        manifest rewritten, so nothing is cleaned or parsed again.
+
+        Args:
+            epub_file (str or EpubReader): The epub file to add, or a
+                pypub.reader.EpubReader reading it.
+        """
+        if not isinstance(epub_file, reader.EpubReader):
+            with reader.EpubReader(epub_file) as epub_reader:
+                return self.add_epub(epub_reader)
+        for c in epub_file.chapters:
+            self.add_chapter(c)
+
+    def aadd_chapters(self, chapters, fetcher=None, executor=None):
+        """
+        Coroutine which adds Chapters to your epub without blocking the event
+        loop. Images of the upcoming chapters are downloaded concurrently
+        while each chapter is written, in order, on executor.
+
+        Args:
+            chapters (list): Chapter objects to add.
+            fetcher (Option[pypub.aio.AsyncFetcher]): The fetcher to download
+                images with. By default this is shared by everything running
+                on the event loop, and closed by pypub.aio.close_default_fetcher.
+            executor (Option[concurrent.futures.Executor]): The executor to
+                write chapters on. By default this is the loop's default
+                executor.
+        """
+        from . import aio
+        return aio.add_chapters(self, chapters, fetcher, executor)
+
+    def create_epub(self, output_directory, epub_name=None, compress_level=None,
+                    store_media=None, compress_threads=None):
+        """
+        Create an epub file from this object. Archive options that aren't given
+        default to the archive_options the Epub was created with.
 
         Args:
             output_directory (str): Directory to output the epub file to
             epub_name (Option[str]): The file name of your epub. This should not contain
                 .epub at the end. If this argument is not provided, defaults to the title of the epub.
+            compress_level (Option[int]): The deflate level of the archive, 0 to 9. 0 stores
+                every file uncompressed. By default zlib's default level is used.
+            store_media (Option[bool]): Store images and other already compressed files
+                without deflate. True by default.
+            compress_threads (Option[int]): Number of threads compressing text files. By
+                default this is the number of CPUs.
+
+        Returns:
+            str: The full name of the epub file. If volume size is capped this
+                is instead the list of all volume files, which are saved in
+                volume_directory and named after their volume titles, and
+                output_directory and epub_name are ignored.
+
+        Raises:
+            pypub.check.EpubCheckError: Raised if check is set and an epub
+                file has problems. The file is kept, to be looked into.
         """
+        archive_options = dict(self.archive_options)
+        for name, value in (('compress_level', compress_level),
+                            ('store_media', store_media),
+                            ('compress_threads', compress_threads)):
+            if value is not None:
+                archive_options[name] = value
+        if self._has_volumes():
+            if self.chapters:
+                self.archive_options = archive_options
+                self._finish_volume(start_next=False)
+            else:
+                shutil.rmtree(self.EPUB_DIR)
+            if self._journal is not None:
+                self._close_journal()
+            return list(self.volume_files)
+        epub_file = self._write_package(output_directory, epub_name, **archive_options)
+        if self._journal is not None:
+            self._close_journal()
+        return epub_file
+
+    def _write_package(self, output_directory, epub_name=None, compress_level=None,
+                       store_media=True, compress_threads=None):
         def createTOCs_and_ContentOPF():
-            image_items = []
-            for c in self.chapters:
-                image_items.extend(c.images)
+            # chapters sharing an image share its file, which is listed once
+            image_items = list(collections.OrderedDict(
+                    (image.link, image) for c in self.chapters
+                    for image in c.images).values())
                 
             self.opf.add_image_items(image_items)
+            if self._content_uid:
+                self.opf.non_chapter_parameters['uid'] = self._get_content_uid()
+            self.toc_html.add_chapters(self.chapters)
+            self.toc_ncx.add_chapters(self.chapters)
+            self.opf.add_toc_pages(self.toc_html.get_page_names()[1:])
+            self.opf.add_chapters(self.chapters)
             for epub_file, name in ((self.toc_html, 'toc.html'), (self.toc_ncx, 'toc.ncx'), (self.opf, 'content.opf'),):
-                epub_file.add_chapters(self.chapters)
                 epub_file.write(os.path.join(self.OEBPS_DIR, name))
+            cover_page = _EpubFile(os.path.join(EPUB_TEMPLATES_DIR, 'cover.xhtml'),
+                                   cover_link=self.cover_link)
+            cover_page.add_chapters()
+            cover_page.write(os.path.join(self.OEBPS_DIR, 'cover.xhtml'))
 
         def copy_resources():
-            cover_image_output = os.path.join(self.OEBPS_DIR, 'cover.jpg')
-            shutil.copy(self.cover, cover_image_output)
-            cover_html_input = os.path.join(EPUB_TEMPLATES_DIR, 'cover.xhtml')
-            cover_html_output = os.path.join(self.OEBPS_DIR, 'cover.xhtml')
-            shutil.copy(cover_html_input, cover_html_output)
+            # the cover and the stylesheet are archived straight from their
+            # files instead of being copied into OEBPS_DIR, so large covers
+            # aren't copied and read back for every volume
+            resources = {
+                'OEBPS/' + self.cover_link: self.cover,
+                'OEBPS/main.css': self.css,
+            }
+            stylesheets = [s for c in self.chapters for s in c.stylesheets]
+            if not stylesheets:
+                return resources
             css_output = os.path.join(self.OEBPS_DIR, 'main.css')
-            shutil.copy(self.css, css_output)
+            with codecs.open(self.css, 'r', 'utf-8') as f:
+                base_css = f.read()
+            with codecs.open(css_output, 'w', 'utf-8') as f:
+                f.write(base_css.rstrip() + u'\n' + css.merge_stylesheets(stylesheets) + u'\n')
+            del resources['OEBPS/main.css']
+            return resources
 
         def clean_emtpy_dirs():
             for name in os.listdir(self.OEBPS_DIR):
@@ -283,19 +815,24 @@ class Epub(object):
                     if not os.listdir(f):
                         os.rmdir(f)
 
-        def create_zip_archive(epub_name):
+        def archive_progress(arcname, size):
+            progress.emit(self.progress, progress.ARCHIVE_WRITTEN, arcname, size)
+
+        def create_zip_archive(epub_name, resources):
             try:
                 assert isinstance(epub_name, text_type) or epub_name is None
             except AssertionError:
                 raise TypeError('epub_name must be string or None')
             if epub_name is None:
                 epub_name = self.title
-            epub_name_with_path = os.path.join(output_directory, epub_name)
             epub_name_with_path_ext = os.path.join(output_directory, '%s.zip' % epub_name)
             if os.path.exists(epub_name_with_path_ext):
                 os.remove(epub_name_with_path_ext)
             clean_emtpy_dirs()
-            shutil.make_archive(epub_name_with_path, 'zip', self.EPUB_DIR)
+            archive.write_epub_archive(self.EPUB_DIR, epub_name_with_path_ext,
+                                       compress_level, store_media,
+                                       compress_threads, archive_progress,
+                                       self._get_archive_date_time(), resources)
             return epub_name_with_path_ext
 
         def turn_zip_into_epub(zip_archive_file):
@@ -307,9 +844,22 @@ class Epub(object):
                 os.remove(epub_full_name)
             # shutil.copy(zip_archive_file, epub_full_name)
             os.rename(zip_archive_file, epub_full_name)
-            print('ePub file saved to %s' % epub_full_name)
+            logger.info('ePub file saved to %s', epub_full_name)
+            progress.emit(self.progress, progress.EPUB_WRITTEN, epub_full_name,
+                          os.path.getsize(epub_full_name))
             return epub_full_name
-        print('Collecting resources in %s' % self.EPUB_DIR)
-        createTOCs_and_ContentOPF()
-        copy_resources()
-        return turn_zip_into_epub(create_zip_archive(epub_name))
+
+        logger.info('Collecting resources in %s', self.EPUB_DIR)
+        with profiling.stage(self.memory_profiler, 'archive'):
+            createTOCs_and_ContentOPF()
+            resources = copy_resources()
+            epub_file = turn_zip_into_epub(create_zip_archive(epub_name, resources))
+        if self.check:
+            self._check_package(epub_file)
+        return epub_file
+
+    def _check_package(self, epub_file):
+        report = check.check_epub(epub_file)
+        self.check_reports.append(report)
+        if not report.ok:
+            raise check.EpubCheckError(report)
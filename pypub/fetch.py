@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import threading
+import time
+
+from six import PY2
+if PY2:
+    from urlparse import urlsplit, urlunsplit
+else:
+    from urllib.parse import urlsplit, urlunsplit
+
+_DEFAULT_USER_AGENT = r'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.132 Safari/537.36'
+_DEFAULT_HEADERS = {'User-Agent': _DEFAULT_USER_AGENT}
+
+FetchResult = collections.namedtuple('FetchResult', ['url', 'content', 'content_type'])
+
+_default_cache = None
+_requests = None
+_sessions = threading.local()
+
+# Bounds of the in-memory cache of recent fetch results
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_SECONDS = 60
+
+
+class FetchError(Exception):
+    def __init__(self, url, reason):
+        self.url = url
+        self.reason = reason
+
+    def __str__(self):
+        return self.reason
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SingleFlight(object):
+    """
+    Runs at most one call per key at a time. Callers asking for a key that is
+    already being computed wait for that call and share its result or error.
+    Calls return a (result, keep) tuple, and results they say to keep are
+    then kept for max_age seconds in an LRU bounded by count and total size.
+    """
+
+    def __init__(self, max_results, max_bytes, max_age):
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._results = collections.OrderedDict()
+        self._result_bytes = 0
+
+    def _get_result(self, key):
+        entry = self._results.pop(key, None)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.max_age:
+            self._result_bytes -= len(entry[1].content)
+            return None
+        # reinsert to mark as most recently used
+        self._results[key] = entry
+        return entry[1]
+
+    def _put_result(self, key, result):
+        size = len(result.content)
+        if size > self.max_bytes // 4:
+            return
+        old_entry = self._results.pop(key, None)
+        if old_entry is not None:
+            self._result_bytes -= len(old_entry[1].content)
+        self._results[key] = (time.time(), result)
+        self._result_bytes += size
+        while (len(self._results) > self.max_results or
+               self._result_bytes > self.max_bytes):
+            _, (_, evicted) = self._results.popitem(last=False)
+            self._result_bytes -= len(evicted.content)
+
+    def do(self, key, function):
+        with self._lock:
+            result = self._get_result(key)
+            if result is not None:
+                return result
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        keep = False
+        try:
+            call.result, keep = function()
+        except BaseException as e:
+            # interrupts are shared too, so waiters don't take the missing
+            # result for a successful one
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and keep:
+                    self._put_result(key, call.result)
+            call.done.set()
+        return call.result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._result_bytes = 0
+
+
+_single_flight = _SingleFlight(RESULT_CACHE_SIZE, RESULT_CACHE_BYTES,
+                               RESULT_CACHE_SECONDS)
+
+
+def normalize_url(url):
+    """
+    Returns url with a lower case scheme and host, without the default port
+    or a fragment, and with an empty path replaced by /. Urls that normalize
+    to the same string are fetched once.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if ((scheme == 'http' and netloc.endswith(':80')) or
+            (scheme == 'https' and netloc.endswith(':443'))):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parts.path or '/'
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+def get_request_key(url, headers=None):
+    """
+    Returns the key requests are shared by: their normalized url, and their
+    extra headers with lower case names.
+    """
+    return (normalize_url(url),
+            tuple(sorted((k.lower(), v) for k, v in (headers or {}).items())))
+
+
+def clear_result_cache():
+    """
+    Drops the in-memory cache of recent fetch results.
+    """
+    _single_flight.clear()
+
+
+def _get_requests():
+    # requests and urllib3 are slow to import, so load them on the first fetch
+    global _requests
+    if _requests is None:
+        import requests
+        requests.packages.urllib3.disable_warnings()
+        _requests = requests
+    return _requests
+
+
+def _get_session():
+    # a session per thread keeps the connections to each host open from one
+    # fetch to the next, and sessions aren't safe to share between threads
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = _get_requests().Session()
+    return session
+
+
+def set_default_cache(cache):
+    """
+    Sets the cache used by fetch when no cache is passed to it. Every page and
+    image pypub downloads goes through fetch, so this shares one cache between
+    all chapters and books built in the process.
+
+    Args:
+        cache (Option[FileCache]): A pypub.cache.FileCache, or None to turn
+            caching off.
+    """
+    global _default_cache
+    _default_cache = cache
+
+
+def get_default_cache():
+    return _default_cache
+
+
+def fetch(url, headers=None, cache=None):
+    """
+    Downloads url and returns its content. Successful responses are stored in
+    the cache, and later calls for the same url are served from it.
+
+    Concurrent calls for the same url and headers (see get_request_key) and
+    the same cache share one download, and successful results are kept in
+    memory for RESULT_CACHE_SECONDS, so pages and images referenced by
+    several chapters are only fetched once.
+
+    Args:
+        url (str): The url to download.
+        headers (Option[dict]): Extra request headers, added to the default
+            User-Agent header.
+        cache (Option[FileCache]): The cache to use. By default this is the
+            cache set with set_default_cache.
+
+    Returns:
+        FetchResult: The url, the content as bytes and the content type.
+
+    Raises:
+        FetchError: Raised if the url is invalid or can't be reached.
+    """
+    if cache is None:
+        cache = _default_cache
+    key = get_request_key(url, headers) + (cache,)
+    return _single_flight.do(key, lambda: _fetch(url, headers, cache))
+
+
+def _get_cached(cache, url):
+    cached = cache.get(url)
+    if cached is None:
+        return None
+    content_type, _, content = cached.partition(b'\n')
+    return FetchResult(url, content, content_type.decode('latin-1'))
+
+
+def _set_cached(cache, result):
+    cache.set(result.url, result.content_type.encode('latin-1', 'replace') +
+              b'\n' + result.content)
+
+
+def _fetch(url, headers, cache):
+    # returns the result, and whether it is a successful one worth keeping
+    if cache is not None:
+        cached = _get_cached(cache, url)
+        if cached is not None:
+            return cached, True
+    request_headers = dict(_DEFAULT_HEADERS)
+    request_headers.update(headers or {})
+    requests = _get_requests()
+    try:
+        response = _get_session().get(url, headers=request_headers,
+                                      allow_redirects=True)
+    except requests.exceptions.SSLError:
+        raise FetchError(url, "Url %s doesn't have valid SSL certificate" % url)
+    except requests.exceptions.RequestException:
+        raise FetchError(url, "%s is an invalid url or no network connection" % url)
+    result = FetchResult(url, response.content,
+                         response.headers.get('Content-Type', ''))
+    if cache is not None and response.ok:
+        _set_cached(cache, result)
+    return result, response.ok
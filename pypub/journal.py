@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import cgi
+import json
+import os
+
+from . import chapter
+from . import utils
+
+
+class Journal(object):
+    """
+    An append only file of JSON records, one per line, used by Epub to
+    resume a build. Every record is flushed and synced to disk before append
+    returns, and a record cut short by a crash is dropped when the journal is
+    read.
+
+    Args:
+        file_name (str): The journal file. It is created if it doesn't
+            exist.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = None
+
+    def read(self):
+        """
+        Returns the records of the journal, and truncates it after the last
+        complete record.
+        """
+        records = []
+        if not os.path.exists(self.file_name):
+            return records
+        good_length = 0
+        with open(self.file_name, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    break
+                good_length += len(line)
+        if good_length != os.path.getsize(self.file_name):
+            with open(self.file_name, 'r+b') as f:
+                f.truncate(good_length)
+        return records
+
+    def append(self, record):
+        if self._file is None:
+            self._file = open(self.file_name, 'ab')
+        self._file.write(json.dumps(record, sort_keys=True).encode('utf-8') + b'\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def rewrite(self, records):
+        """
+        Replaces the records of the journal with records.
+        """
+        self.close()
+        temp_file_name = self.file_name + '.tmp'
+        with open(temp_file_name, 'wb') as f:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+        os.rename(temp_file_name, self.file_name)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+
+class JournaledChapter(chapter.Chapter):
+    """
+    A chapter written before a build was restarted, restored from its
+    journal record. It only holds what the table of contents and package
+    need, its content stays in the file written before the restart.
+    """
+
+    def __init__(self, record):
+        self.title = record['title']
+        self.html_title = cgi.escape(self.title, quote=True)
+        self.url = record.get('url')
+        self.content = None
+        self.soup = None
+        self.images = []
+        for image_record in record['images']:
+            image = chapter.ImageItem(image_record['link'])
+            image.id = image_record['id']
+            image.type = image_record['type']
+            self.images.append(image)
+        self.stylesheets = record.get('stylesheets', [])
+        self.part_count = 1 + len(record.get('parts', []))
+
+
+def get_chapter_record(c, file_name, volume_number, ebook_folder):
+    """
+    Returns the journal record of Chapter c, written to file_name in
+    ebook_folder.
+    """
+    images = []
+    for image in c.images:
+        image_file = os.path.join(ebook_folder, image.link)
+        if os.path.exists(image_file):
+            images.append({'link': image.link, 'id': image.id, 'type': image.type,
+                           'size': os.path.getsize(image_file)})
+    path = os.path.join(ebook_folder, file_name)
+    parts = []
+    for part_number in range(2, c.part_count + 1):
+        part_path = chapter.get_part_file_name(path, part_number)
+        parts.append({'size': os.path.getsize(part_path),
+                      'sha1': utils.get_file_digest(part_path)})
+    return {'type': 'chapter',
+            'source': c.url or c.title,
+            'title': c.title,
+            'url': c.url,
+            'file': file_name,
+            'volume': volume_number,
+            'size': os.path.getsize(path),
+            'sha1': utils.get_file_digest(path),
+            'images': images,
+            'parts': parts,
+            'stylesheets': getattr(c, 'stylesheets', [])}
+
+
+def is_chapter_intact(record, ebook_folder):
+    """
+    Returns whether the files of a chapter record are on disk as they were
+    when it was recorded.
+    """
+    path = os.path.join(ebook_folder, record['file'])
+    if not os.path.exists(path) or os.path.getsize(path) != record['size']:
+        return False
+    for image in record['images']:
+        image_file = os.path.join(ebook_folder, image['link'])
+        if (not os.path.exists(image_file) or
+                os.path.getsize(image_file) != image['size']):
+            return False
+    for part_number, part in enumerate(record.get('parts', []), 2):
+        part_path = chapter.get_part_file_name(path, part_number)
+        if (not os.path.exists(part_path) or
+                os.path.getsize(part_path) != part['size'] or
+                utils.get_file_digest(part_path) != part['sha1']):
+            return False
+    return utils.get_file_digest(path) == record['sha1']
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import os
+import sys
+import threading
+import time
+
+import six
+from six.moves import queue
+
+from . import chapter
+from . import dedup
+from . import fetch
+
+FETCH_WORKERS = 4
+CLEAN_WORKERS = 2
+IMAGE_WORKERS = 4
+# Most chapters between being fed to the pipeline and being written
+MAX_IN_FLIGHT = 16
+
+STAGES = ['fetch', 'clean', 'images']
+
+_STOP = object()
+
+
+class _Item(object):
+    # a chapter moving through the pipeline
+
+    def __init__(self, sequence, source, title):
+        self.sequence = sequence
+        self.source = source
+        self.title = title
+        self.fetch_result = None
+        self.chapter = None
+        self.image_content = None
+        self.error = None
+
+
+class _FeedDone(object):
+    def __init__(self, count):
+        self.count = count
+
+
+def _get_source(source):
+    # returns the url or file of a source, and its title
+    if isinstance(source, dict):
+        return source.get('url') or os.path.abspath(source['file']), source.get('title')
+    if isinstance(source, chapter.Chapter):
+        return source, None
+    if chapter.is_web_url(source):
+        return source, None
+    return os.path.abspath(source), None
+
+
+class PipelinedBuilder(object):
+    """
+    Adds chapters to an Epub with their stages overlapping: while chapter N
+    is written, chapter N + 1 can be downloading its images, chapter N + 2
+    being cleaned and chapter N + 3 being fetched. Each stage runs on its own
+    worker threads and passes chapters on through a queue, and chapters are
+    written in the order they were given in.
+
+    At most max_in_flight chapters are between being fed to the pipeline and
+    being written, which bounds every queue and the chapters waiting for an
+    earlier one to be written, so memory stays capped however many chapters
+    there are.
+
+    Cleaning is CPU bound and holds the GIL for most of its time, so clean
+    workers mostly overlap with the downloads and the writing, and more than
+    a couple of them rarely makes cleaning faster.
+
+    Args:
+        chapter_factory (Option[ChapterFactory]): Creates the chapters. By
+            default this is a new ChapterFactory. Chapters its duplicate
+            detector drops are skipped.
+        fetch_workers (Option[int]): Number of pages downloaded at a time.
+        clean_workers (Option[int]): Number of threads cleaning pages.
+        image_workers (Option[int]): Number of chapters downloading their
+            images at a time.
+        max_in_flight (Option[int]): Most chapters in the pipeline.
+
+    Attributes:
+        busy_seconds (collections.Counter): Seconds spent by the workers of
+            each stage (fetch, clean, images and write), to tune the number
+            of workers.
+    """
+
+    def __init__(self, chapter_factory=None, fetch_workers=FETCH_WORKERS,
+                 clean_workers=CLEAN_WORKERS, image_workers=IMAGE_WORKERS,
+                 max_in_flight=MAX_IN_FLIGHT):
+        try:
+            assert min(fetch_workers, clean_workers, image_workers, max_in_flight) > 0
+        except AssertionError:
+            raise ValueError('worker counts and max_in_flight must be positive')
+        self.chapter_factory = chapter_factory or chapter.ChapterFactory()
+        self.workers = {'fetch': fetch_workers,
+                        'clean': clean_workers,
+                        'images': image_workers}
+        self.max_in_flight = max_in_flight
+        self.busy_seconds = collections.Counter()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._in_flight = None
+
+    def _fetch(self, item):
+        if isinstance(item.source, chapter.Chapter) or not chapter.is_web_url(item.source):
+            return
+        try:
+            item.fetch_result = fetch.fetch(
+                    item.source, headers=self.chapter_factory.request_headers)
+        except fetch.FetchError as e:
+            raise ValueError(str(e))
+
+    def _clean(self, item):
+        try:
+            if isinstance(item.source, chapter.Chapter):
+                item.chapter = item.source
+            elif item.fetch_result is not None:
+                item.chapter = self.chapter_factory._create_chapter_from_fetch_result(
+                        item.fetch_result, item.title)
+            else:
+                item.chapter = self.chapter_factory.create_chapter_from_file(
+                        item.source, item.title)
+        except dedup.DuplicateChapterError:
+            item.chapter = None
+        item.fetch_result = None
+
+    def _fetch_images(self, item):
+        if item.chapter is None:
+            return
+        image_content = {}
+        for _, image_url in item.chapter._get_image_urls():
+            if (image_url in image_content or not chapter.is_web_url(image_url) or
+                    not chapter.get_image_type(image_url)):
+                continue
+            try:
+                image_content[image_url] = fetch.fetch(
+                        image_url, headers={'Referer': image_url}).content
+            except fetch.FetchError:
+                image_content[image_url] = None
+        item.image_content = image_content
+
+    def _run_worker(self, name, function, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                return
+            if item.error is None and not self._stopped:
+                start_time = time.time()
+                try:
+                    function(item)
+                except Exception:
+                    item.error = sys.exc_info()
+                with self._lock:
+                    self.busy_seconds[name] += time.time() - start_time
+            out_queue.put(item)
+
+    def _feed(self, sources, in_queue, out_queue):
+        count = 0
+        for source, title in sources:
+            self._in_flight.acquire()
+            if self._stopped:
+                break
+            in_queue.put(_Item(count, source, title))
+            count += 1
+        out_queue.put(_FeedDone(count))
+
+    def add_chapters(self, book, sources):
+        """
+        Creates chapters and adds them to book, in order, with the stages of
+        consecutive chapters overlapping. Chapters book has already added
+        before a restart aren't created again.
+
+        Args:
+            book (Epub): The book to add the chapters to.
+            sources (list): The chapters to add. Each is a url, an html file,
+                a dict with a url or file and an optional title, as in batch
+                manifests, or a Chapter, which only has its images downloaded
+                ahead.
+
+        Returns:
+            int: The number of chapters added.
+
+        Raises:
+            ValueError: Raised if a page can't be downloaded. Chapters before
+                it are added first.
+        """
+        sources = [_get_source(s) for s in sources]
+        tracker = self.chapter_factory.progress
+        if tracker is not None and tracker.total_chapters is None:
+            tracker.total_chapters = len(sources)
+        sources = [(source, title) for source, title in sources
+                   if isinstance(source, chapter.Chapter) or
+                   not book.resume_chapter(source)]
+        self._stopped = False
+        self._in_flight = threading.Semaphore(self.max_in_flight)
+        queues = [queue.Queue() for _ in range(len(STAGES) + 1)]
+        functions = {'fetch': self._fetch, 'clean': self._clean,
+                     'images': self._fetch_images}
+        threads = [threading.Thread(target=self._feed,
+                                    args=(sources, queues[0], queues[-1]))]
+        for i, name in enumerate(STAGES):
+            for _ in range(self.workers[name]):
+                threads.append(threading.Thread(
+                        target=self._run_worker,
+                        args=(name, functions[name], queues[i], queues[i + 1])))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        added = 0
+        waiting = {}
+        next_sequence = 0
+        count = None
+        try:
+            while count is None or next_sequence < count:
+                item = queues[-1].get()
+                if isinstance(item, _FeedDone):
+                    count = item.count
+                    continue
+                waiting[item.sequence] = item
+                while next_sequence in waiting:
+                    item = waiting.pop(next_sequence)
+                    next_sequence += 1
+                    if item.error is not None:
+                        six.reraise(*item.error)
+                    if item.chapter is not None:
+                        start_time = time.time()
+                        book.add_chapter(item.chapter, item.image_content)
+                        self.busy_seconds['write'] += time.time() - start_time
+                        added += 1
+                    self._in_flight.release()
+        finally:
+            self._stopped = True
+            for _ in range(self.max_in_flight):
+                self._in_flight.release()
+            for i, name in enumerate(STAGES):
+                for _ in range(self.workers[name]):
+                    queues[i].put(_STOP)
+        return added
@@ -0,0 +1,34 @@
+from __future__ import print_function
+import os
+import subprocess
+import sys
+
+# Measures how long `import pypub` takes in a fresh interpreter and which
+# heavy dependencies it pulls in. Run as `python pypub/profile_import.py`.
+
+RUNS = 10
+HEAVY_MODULES = ['requests', 'urllib3', 'jinja2', 'lxml', 'bs4', 'imp']
+PACKAGE_PARENT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+IMPORT_CODE = '''
+import sys, time
+start = time.time()
+import pypub
+print(time.time() - start)
+print(' '.join(m for m in %r if m in sys.modules))
+''' % HEAVY_MODULES
+
+
+def time_import():
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_CODE],
+                                     cwd=PACKAGE_PARENT_DIR)
+    lines = output.decode('utf-8').splitlines()
+    return float(lines[0]), lines[1].split() if len(lines) > 1 else []
+
+times = []
+for _ in range(RUNS):
+    seconds, loaded_modules = time_import()
+    times.append(seconds)
+times.sort()
+print('import pypub: median %.1f ms, best %.1f ms over %d runs' % (
+    times[len(times) // 2] * 1000, times[0] * 1000, RUNS))
+print('heavy modules loaded: %s' % (', '.join(loaded_modules) or 'none'))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import linecache
+import os
+import threading
+
+try:
+    import tracemalloc
+    tracemalloc_module_exists = True
+except ImportError:
+    tracemalloc_module_exists = False
+
+# Stages recorded by ChapterFactory and Epub
+STAGES = ['fetch', 'clean', 'parse', 'chapter', 'images', 'write', 'archive']
+
+StageRecord = collections.namedtuple(
+        'StageRecord', ['stage', 'chapter', 'peak', 'retained'])
+
+
+class MemoryProfiler(object):
+    """
+    Records memory allocated by the stages of building an epub with
+    tracemalloc. Pass the same profiler to a ChapterFactory and an Epub, then
+    call format_report for the chapters and stages with the highest peak
+    allocation, and the call sites which allocated the most.
+
+    Tracing makes pypub several times slower, so only use it to investigate
+    sources which use too much memory.
+
+    Stages may run on several threads at once, as with PipelinedBuilder.
+    tracemalloc traces the whole process though, so the peak and retained
+    memory of a stage then include what other threads allocated while it
+    ran.
+
+    Args:
+        frames (Option[int]): Number of frames stored for each allocation.
+        record_sites (Option[bool]): Also record the call sites allocating
+            memory retained by each stage. This takes a tracemalloc snapshot
+            before and after every stage, which is slow on large books.
+
+    Raises:
+        RuntimeError: Raised if tracemalloc isn't available.
+    """
+
+    def __init__(self, frames=1, record_sites=True):
+        if not tracemalloc_module_exists:
+            raise RuntimeError('memory profiling requires tracemalloc')
+        self.frames = frames
+        self.record_sites = record_sites
+        self.records = []
+        self.sites = collections.defaultdict(collections.Counter)
+        # the stages running on every thread
+        self._frames = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _get_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, linecache.__file__)))
+
+    @contextlib.contextmanager
+    def stage(self, name, chapter=None):
+        """
+        Context manager recording the memory allocated while it runs as stage
+        name of chapter. Stages may be nested, the peak of a stage includes
+        the stages run inside it. Nothing is recorded while the profiler isn't
+        started.
+
+        Args:
+            name (str): The stage, one of STAGES for the stages pypub records.
+            chapter (Option[str]): The url or title of the chapter, or None
+                for stages of the whole book.
+        """
+        if not tracemalloc.is_tracing():
+            yield
+            return
+        snapshot = self._get_snapshot() if self.record_sites else None
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak of running stages is kept before resetting it for
+            # this one
+            for other in self._frames:
+                other['peak'] = max(other['peak'], peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            frame = {'start': current, 'peak': current}
+            self._frames.append(frame)
+        try:
+            yield
+        finally:
+            with self._lock:
+                # stages of other threads may have started since, so this
+                # stage's own frame is removed, not the last one
+                self._frames = [f for f in self._frames if f is not frame]
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame['peak'], peak, current)
+                for other in self._frames:
+                    other['peak'] = max(other['peak'], peak)
+                self.records.append(StageRecord(name, chapter,
+                                                peak - frame['start'],
+                                                current - frame['start']))
+            if snapshot is not None:
+                statistics = self._get_snapshot().compare_to(snapshot, 'lineno')
+                with self._lock:
+                    for statistic in statistics:
+                        if statistic.size_diff > 0:
+                            location = statistic.traceback[0]
+                            site = '%s:%d' % (location.filename, location.lineno)
+                            self.sites[name][site] += statistic.size_diff
+
+    def get_stage_totals(self):
+        """
+        Returns:
+            dict: For each stage, the highest peak, the total retained bytes
+                and the number of times it ran.
+        """
+        totals = collections.OrderedDict()
+        for record in self.records:
+            total = totals.setdefault(record.stage, {'peak': 0, 'retained': 0, 'count': 0})
+            total['peak'] = max(total['peak'], record.peak)
+            total['retained'] += record.retained
+            total['count'] += 1
+        return totals
+
+    def get_worst_chapters(self, count=10):
+        """
+        Returns:
+            list: (chapter, peak, retained, worst stage) for the count
+                chapters with the highest peak allocation of any stage.
+        """
+        chapters = collections.OrderedDict()
+        for record in self.records:
+            if record.chapter is None:
+                continue
+            entry = chapters.get(record.chapter)
+            if entry is None:
+                entry = chapters[record.chapter] = [record.chapter, 0, 0, None]
+            if record.peak > entry[1]:
+                entry[1] = record.peak
+                entry[3] = record.stage
+            entry[2] += record.retained
+        return sorted((tuple(e) for e in chapters.values()),
+                      key=lambda e: e[1], reverse=True)[:count]
+
+    def get_top_sites(self, count=10):
+        """
+        Returns:
+            list: (stage, call site, bytes) for the count call sites which
+                allocated the most memory retained at the end of a stage.
+        """
+        sites = [(stage, site, size)
+                 for stage, counter in self.sites.items()
+                 for site, size in counter.items()]
+        return sorted(sites, key=lambda s: s[2], reverse=True)[:count]
+
+    def format_report(self, count=10):
+        """
+        Returns a text report of the stage totals, the count worst chapters
+        and the count call sites allocating the most.
+        """
+        lines = ['%-10s %12s %12s %6s' % ('stage', 'peak', 'retained', 'runs')]
+        for stage, total in self.get_stage_totals().items():
+            lines.append('%-10s %12s %12s %6d' % (
+                    stage, format_size(total['peak']),
+                    format_size(total['retained']), total['count']))
+        worst_chapters = self.get_worst_chapters(count)
+        if worst_chapters:
+            lines.append('')
+            lines.append('worst chapters:')
+            for chapter, peak, retained, stage in worst_chapters:
+                lines.append('  %12s peak in %-8s %12s retained  %s' % (
+                        format_size(peak), stage, format_size(retained), chapter))
+        top_sites = self.get_top_sites(count)
+        if top_sites:
+            lines.append('')
+            lines.append('top allocating call sites:')
+            for stage, site, size in top_sites:
+                lines.append('  %12s %-8s %s' % (format_size(size), stage,
+                                                 _shorten_path(site)))
+        return '\n'.join(lines)
+
+
+def format_size(size):
+    if abs(size) < 1024:
+        return '%d B' % size
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024.0
+        if abs(size) < 1024 or unit == 'GB':
+            return '%.1f %s' % (size, unit)
+
+
+def _shorten_path(site):
+    for directory in (os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      os.getcwd()):
+        if site.startswith(directory + os.sep):
+            return site[len(directory) + 1:]
+    return site
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+def stage(profiler, name, chapter=None):
+    """
+    Returns profiler.stage(name, chapter), or a context manager doing nothing
+    if profiler is None.
+    """
+    if profiler is None:
+        return _null_stage
+    return profiler.stage(name, chapter)
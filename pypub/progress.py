@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Kinds of progress events
+CHAPTER_FETCHED = 'chapter_fetched'
+CHAPTER_CLEANED = 'chapter_cleaned'
+IMAGES_RESOLVED = 'images_resolved'
+CHAPTER_WRITTEN = 'chapter_written'
+ARCHIVE_WRITTEN = 'archive_written'
+EPUB_WRITTEN = 'epub_written'
+
+# An event of a build:
+#   kind: one of the event kinds above
+#   chapter: the url or title of the chapter, or the name of the archive entry
+#       or epub file, the event is about
+#   bytes: the bytes fetched, cleaned, of images resolved or written
+#   count, total_bytes: the number and bytes of events of this kind so far
+#   chapters_written: the number of chapters written so far
+#   total_chapters: the number of chapters of the build, if known
+#   elapsed: seconds since the tracker was created
+#   eta: estimated seconds until every chapter is written, if total_chapters
+#       is known and a chapter was written
+#   time: the time of the event, as returned by time.time()
+ProgressEvent = collections.namedtuple('ProgressEvent', [
+        'kind', 'chapter', 'bytes', 'count', 'total_bytes', 'chapters_written',
+        'total_chapters', 'elapsed', 'eta', 'time'])
+
+
+class ProgressTracker(object):
+    """
+    Counts the events of a build and passes each of them to a callback as a
+    ProgressEvent. Pass the same tracker to a ChapterFactory and an Epub.
+    Events may be emitted from several threads, and the callback is called
+    on the thread of the event.
+
+    Args:
+        callback (Option[function]): Called with each ProgressEvent. By
+            default events are only counted.
+        total_chapters (Option[int]): The number of chapters of the build,
+            used to estimate the time left. Can also be set later.
+
+    Attributes:
+        last_event_time (float): The time of the last event, to detect
+            stalled builds.
+    """
+
+    def __init__(self, callback=None, total_chapters=None):
+        self.callback = callback
+        self.total_chapters = total_chapters
+        self.start_time = time.time()
+        self.last_event_time = self.start_time
+        self.counts = collections.Counter()
+        self.bytes = collections.Counter()
+        self._lock = threading.Lock()
+
+    def get_eta(self, now=None):
+        """
+        Returns the estimated seconds until every chapter is written, or None
+        if it can't be estimated yet.
+        """
+        written = self.counts[CHAPTER_WRITTEN]
+        if not self.total_chapters or not written:
+            return None
+        elapsed = (now or time.time()) - self.start_time
+        return max(elapsed / written * (self.total_chapters - written), 0.0)
+
+    def emit(self, kind, chapter=None, size=0):
+        """
+        Records an event and passes it to the callback.
+
+        Args:
+            kind (str): One of the event kinds of pypub.progress.
+            chapter (Option[str]): What the event is about.
+            size (Option[int]): The bytes the event is about.
+
+        Returns:
+            ProgressEvent: The event.
+        """
+        with self._lock:
+            now = time.time()
+            self.counts[kind] += 1
+            self.bytes[kind] += size
+            self.last_event_time = now
+            event = ProgressEvent(kind, chapter, size, self.counts[kind],
+                                  self.bytes[kind], self.counts[CHAPTER_WRITTEN],
+                                  self.total_chapters, now - self.start_time,
+                                  self.get_eta(now), now)
+        if self.callback is not None:
+            self.callback(event)
+        return event
+
+
+def emit(tracker, kind, chapter=None, size=0):
+    """
+    Calls tracker.emit, unless tracker is None.
+    """
+    if tracker is not None:
+        return tracker.emit(kind, chapter, size)
+
+
+def log_event(event):
+    """
+    A ProgressTracker callback logging each event to the pypub.progress
+    logger at INFO level.
+    """
+    if event.total_chapters:
+        position = '%d/%d' % (event.chapters_written, event.total_chapters)
+    else:
+        position = '%d' % event.chapters_written
+    eta = ', eta %ds' % event.eta if event.eta is not None else ''
+    logger.info('[%s%s] %s %s (%d bytes)', position, eta, event.kind,
+                event.chapter, event.bytes)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import cgi
+import hashlib
+import os
+import posixpath
+import re
+import xml.etree.ElementTree as ElementTree
+import zipfile
+from xml.sax.saxutils import unescape
+
+from six import PY2
+if PY2:
+    from urllib import unquote
+else:
+    from urllib.parse import unquote
+
+from . import chapter
+
+_CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+_OPF_NS = '{http://www.idpf.org/2007/opf}'
+_DC_NS = '{http://purl.org/dc/elements/1.1/}'
+_NCX_NS = '{http://www.daisy.org/z3986/2005/ncx/}'
+# Spine items which are the front matter pypub adds to every epub
+_SKIPPED_SPINE_ID_PATTERN = re.compile(r'^(cover|toc|toc_\d+)$')
+# Spine items which are the second and later parts of a chapter pypub split
+_PART_SPINE_ID_PATTERN = re.compile(r'^chapter_\d+_\d+$')
+_REFERENCE_PATTERN = re.compile(
+        br'''(\s(?:src|href|xlink:href)\s*=\s*)(["'])([^"'#]+)\2''')
+_TITLE_PATTERN = re.compile(br'<title[^>]*>(.*?)</title>', re.S | re.I)
+
+
+class EpubChapter(chapter.Chapter):
+    """
+    A chapter of an existing epub, created by EpubReader. Its xhtml is copied
+    into the new epub as is, with only the names of its images rewritten, and
+    is never parsed. Links to other chapters of the source epub are left
+    unchanged. The parts of a chapter pypub split into several files are
+    copied together, and split the same way.
+
+    Attributes:
+        name (str): The name of the chapter's file inside the source epub.
+        part_names (list): The names of the files of the chapter's parts
+            after the first, inside the source epub.
+        title (str): The title of the chapter.
+        html_title (str): Title string with special characters replaced with
+            html-safe sequences
+    """
+
+    def __init__(self, reader, name, title):
+        self.reader = reader
+        self.name = name
+        self.title = title
+        self.html_title = cgi.escape(title, quote=True)
+        self.url = None
+        self.content = None
+        self.soup = None
+        self.images = []
+        self.stylesheets = []
+        self.part_names = []
+        self._data = None
+
+    @property
+    def part_count(self):
+        return 1 + len(self.part_names)
+
+    def _replace_images_in_chapter(self, ebook_folder, image_content=None):
+        chapter_directory = posixpath.dirname(self.name)
+        images = []
+
+        def replace_reference(match):
+            target = unquote(match.group(3).decode('utf-8'))
+            target = posixpath.normpath(posixpath.join(chapter_directory, target))
+            media_type = self.reader.image_types.get(target)
+            if media_type is None:
+                return match.group(0)
+            image_name = self.reader._get_image_name(target)
+            link = 'images/' + image_name
+            image_file = os.path.join(ebook_folder, 'images', image_name)
+            if not os.path.exists(image_file):
+                with open(image_file, 'wb') as f:
+                    f.write(self.reader.read(target))
+            if link not in [image.link for image in images]:
+                image = chapter.ImageItem(link)
+                image.type = media_type
+                images.append(image)
+            return (match.group(1) + match.group(2) + link.encode('utf-8') +
+                    match.group(2))
+        self._data = [_REFERENCE_PATTERN.sub(replace_reference, self.reader.read(name))
+                      for name in [self.name] + self.part_names]
+        self.images = images
+
+    def write(self, file_name, max_bytes=None):
+        """
+        Writes the chapter to an xhtml file, and its other parts to the
+        files named by pypub.chapter.get_part_file_name. Chapters are copied
+        as they are, so max_bytes is ignored.
+
+        Args:
+            file_name (str): The full name of the xhtml file to save to.
+
+        Returns:
+            list: The full names of the files written.
+        """
+        try:
+            assert file_name[-6:] == '.xhtml'
+        except (AssertionError, IndexError):
+            raise ValueError('filename must end with .xhtml')
+        data = self._data
+        if data is None:
+            data = [self.reader.read(name) for name in [self.name] + self.part_names]
+        file_names = []
+        for part_number, part_data in enumerate(data, 1):
+            part_file_name = chapter.get_part_file_name(file_name, part_number)
+            with open(part_file_name, 'wb') as f:
+                f.write(part_data)
+            file_names.append(part_file_name)
+        self._data = None
+        return file_names
+
+
+class EpubReader(object):
+    """
+    Reads an existing epub lazily. The archive is opened, and its package
+    files are parsed, on first use, and the content of a chapter or image is
+    only read when it is copied into a new epub. Meant for epubs generated by
+    pypub and other valid epub 2 packages.
+
+    Args:
+        file_name (str): The epub file to read.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.image_prefix = hashlib.sha1(
+                os.path.abspath(file_name).encode('utf-8')).hexdigest()[:6]
+        self._zip_file = None
+        self._title = None
+        self._chapters = None
+        self._image_types = None
+        self._image_names = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._zip_file is not None:
+            self._zip_file.close()
+            self._zip_file = None
+
+    def read(self, name):
+        """
+        Returns the content of the file name inside the epub as bytes.
+        """
+        return self._get_zip_file().read(name)
+
+    def _get_zip_file(self):
+        if self._zip_file is None:
+            self._zip_file = zipfile.ZipFile(self.file_name)
+        return self._zip_file
+
+    @property
+    def title(self):
+        if self._chapters is None:
+            self._read_package()
+        return self._title
+
+    @property
+    def chapters(self):
+        """
+        The chapters of the epub in spine order, as EpubChapter objects which
+        can be added to an Epub.
+        """
+        if self._chapters is None:
+            self._read_package()
+        return self._chapters
+
+    @property
+    def image_types(self):
+        """
+        The media type of every image of the epub by file name. Images
+        listed in the manifest but missing from the archive are left out, so
+        references to them are kept as they are.
+        """
+        if self._chapters is None:
+            self._read_package()
+        return self._image_types
+
+    def _get_image_name(self, name):
+        image_name = self._image_names.get(name)
+        if image_name is None:
+            base, ext = posixpath.splitext(posixpath.basename(name))
+            image_name = '%s_%s%s' % (self.image_prefix,
+                                      chapter.fix_file_name(base), ext)
+            used_names = set(self._image_names.values())
+            number = 1
+            while image_name in used_names:
+                number += 1
+                image_name = '%s_%s_%d%s' % (self.image_prefix,
+                                             chapter.fix_file_name(base),
+                                             number, ext)
+            self._image_names[name] = image_name
+        return image_name
+
+    def _read_package(self):
+        container = ElementTree.fromstring(self.read('META-INF/container.xml'))
+        opf_name = container.find('.//%srootfile' % _CONTAINER_NS).get('full-path')
+        opf_directory = posixpath.dirname(opf_name)
+        opf = ElementTree.fromstring(self.read(opf_name))
+
+        def full_name(href):
+            return posixpath.normpath(posixpath.join(opf_directory, unquote(href)))
+        self._title = opf.findtext('.//%stitle' % _DC_NS) or u''
+        items = {}
+        self._image_types = {}
+        archive_names = set(self._get_zip_file().namelist())
+        for item in opf.find('%smanifest' % _OPF_NS):
+            name = full_name(item.get('href'))
+            items[item.get('id')] = (name, item.get('media-type'))
+            if (item.get('media-type') or '').startswith('image/') and name in archive_names:
+                self._image_types[name] = item.get('media-type')
+        spine = opf.find('%sspine' % _OPF_NS)
+        titles = self._read_ncx_titles(items.get(spine.get('toc')), opf_directory)
+        self._chapters = []
+        for itemref in spine:
+            if (_SKIPPED_SPINE_ID_PATTERN.match(itemref.get('idref')) or
+                    itemref.get('linear') == 'no'):
+                continue
+            name, media_type = items[itemref.get('idref')]
+            if _PART_SPINE_ID_PATTERN.match(itemref.get('idref')) and self._chapters:
+                self._chapters[-1].part_names.append(name)
+                continue
+            title = titles.get(name) or self._read_title(name)
+            self._chapters.append(EpubChapter(self, name, title))
+
+    def _read_ncx_titles(self, ncx_item, opf_directory):
+        titles = {}
+        if ncx_item is None:
+            return titles
+        ncx_directory = posixpath.dirname(ncx_item[0])
+        ncx = ElementTree.fromstring(self.read(ncx_item[0]))
+        group_titles = {}
+        for nav_point in ncx.iter('%snavPoint' % _NCX_NS):
+            src = nav_point.find('%scontent' % _NCX_NS).get('src').split('#')[0]
+            name = posixpath.normpath(posixpath.join(ncx_directory, unquote(src)))
+            title = nav_point.findtext('%snavLabel/%stext' % (_NCX_NS, _NCX_NS))
+            # entries grouping other entries point at the first chapter of
+            # their group, whose own entry has the better title
+            is_group = nav_point.find('%snavPoint' % _NCX_NS) is not None
+            found_titles = group_titles if is_group else titles
+            if title and name not in found_titles:
+                found_titles[name] = title.strip()
+        for name, title in group_titles.items():
+            titles.setdefault(name, title)
+        return titles
+
+    def _read_title(self, name):
+        match = _TITLE_PATTERN.search(self.read(name))
+        if match and match.group(1).strip():
+            return unescape(match.group(1).strip().decode('utf-8'))
+        return posixpath.splitext(posixpath.basename(name))[0]
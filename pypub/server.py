@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from wsgiref import simple_server
+
+from bs4 import BeautifulSoup
+from six import text_type
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs
+
+from .constants import CHAPTER_TEMPLATE, EPUB_TEMPLATES_DIR
+from . import batch
+from . import chapter
+from . import fetch
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Jobs accepted while every worker is busy, on top of the ones being built
+MAX_QUEUED_JOBS = 32
+# Largest job accepted, in bytes of JSON
+MAX_JOB_BYTES = 1024 * 1024
+EPUB_TEMPLATES = [CHAPTER_TEMPLATE] + [
+        os.path.join(EPUB_TEMPLATES_DIR, name)
+        for name in ('toc.html', 'toc_ncx.xml', 'opf.xml', 'cover.xhtml')]
+
+
+class ServerBusyError(Exception):
+    """
+    Raised by BuildServer.build when its job queue is full.
+    """
+
+    def __str__(self):
+        return 'too many jobs queued'
+
+
+def _init_worker(cache_directory, verbose):
+    batch._init_worker(cache_directory, verbose)
+    # import and compile everything a build needs once per worker, instead
+    # of in the first book each worker builds
+    BeautifulSoup('<p></p>', 'html.parser')
+    fetch._get_session()
+    for template_file in EPUB_TEMPLATES:
+        utils.load_template(template_file)
+
+
+def _resolve_local_file(path, base_directory):
+    # returns the real path of a file sent in a job, which must be relative
+    # and stay inside base_directory, links included
+    if os.path.isabs(path) or '..' in re.split(r'[\\/]', path):
+        raise ValueError('file paths must be relative and without ..: %s' % path)
+    real_base_directory = os.path.realpath(base_directory)
+    full_path = os.path.realpath(os.path.join(real_base_directory, path))
+    if not full_path.startswith(real_base_directory + os.sep):
+        raise ValueError('%s is outside the base directory' % path)
+    return full_path
+
+
+def _get_epub_name(job):
+    # a file name of its own for every job, so jobs can't write outside the
+    # output directory, or over each other's books
+    name = chapter.fix_file_name(text_type(job.get('epub_name') or job['title']))
+    return u'%s-%s' % (name.strip() or u'book', uuid.uuid4().hex[:12])
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    # a thread per request, so requests wait for their builds concurrently
+    daemon_threads = True
+
+
+class BuildServer(object):
+    """
+    Builds books sent to it as jobs on a pool of worker processes which are
+    started once and kept warm, with bs4, requests and the templates loaded,
+    an open session per worker and the shared fetch and clean caches, so
+    small books aren't slowed down by starting a process for each.
+
+    A BuildServer is also a WSGI application:
+
+        POST /build    Builds the job in the request body, a JSON object as
+                       in batch manifests, and responds with its result as
+                       JSON, or with the epub itself if the query has
+                       download=1. File paths of the job must be relative,
+                       and are resolved against base_directory, outside of
+                       which files can't be read. Every epub gets a unique
+                       name made from its epub_name or title.
+        GET /status    Responds with the jobs pending and the builds done,
+                       as JSON.
+
+    Responses are 400 for malformed jobs, 503 when the job queue is full and
+    500 for failed builds, whose result has the error message.
+
+    Args:
+        output_directory (str): Directory to output the epub files to.
+        processes (Option[int]): Number of worker processes, which is the
+            number of books built at a time. By default this is the number
+            of CPUs.
+        max_queued_jobs (Option[int]): Most jobs waiting for a worker. Jobs
+            past it are refused rather than queued.
+        cache_directory (Option[str]): Directory of the shared fetch and
+            clean caches. By default no cache is used.
+        base_directory (Option[str]): Directory relative file paths of jobs
+            are resolved against. By default the current directory.
+        verbose (Option[bool]): Log the progress of every book.
+        work_directory (Option[str]): Build every book resumably in this
+            directory, see batch.build_books.
+        workspace_directory (Option[str]): Directory books are staged in.
+        max_workspace_bytes (Option[int]): Fail books whose staged files
+            grow past this many bytes.
+    """
+
+    def __init__(self, output_directory, processes=None,
+                 max_queued_jobs=MAX_QUEUED_JOBS, cache_directory=None,
+                 base_directory=None, verbose=False, work_directory=None,
+                 workspace_directory=None, max_workspace_bytes=None):
+        self.output_directory = output_directory
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_queued_jobs = max_queued_jobs
+        self.base_directory = base_directory or os.getcwd()
+        self.built = 0
+        self.failed = 0
+        self._options = {'profile_memory': False,
+                         'verbose': verbose,
+                         'work_directory': work_directory,
+                         'workspace_directory': workspace_directory,
+                         'max_workspace_bytes': max_workspace_bytes}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = multiprocessing.Pool(self.processes, _init_worker,
+                                          (cache_directory, verbose))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stops the worker processes once the jobs already accepted are built.
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def get_status(self):
+        """
+        Returns the worker count, the jobs pending (being built or queued),
+        the queue limit and the books built and failed so far, as a dict.
+        """
+        with self._lock:
+            return {'processes': self.processes,
+                    'pending': self._pending,
+                    'max_pending': self.processes + self.max_queued_jobs,
+                    'built': self.built,
+                    'failed': self.failed}
+
+    def build(self, job):
+        """
+        Builds a job on a worker, waiting for one to be free.
+
+        Args:
+            job (dict): A job as in batch manifests.
+
+        Returns:
+            dict: The result of the job, see batch.build_book. Failed jobs
+                have their error message under "error".
+
+        Raises:
+            ValueError: Raised if the job is malformed, or one of its files
+                is outside base_directory.
+            ServerBusyError: Raised if the job queue is full.
+        """
+        # normalized against no directory first, so paths are checked as sent
+        job = batch.normalize_job(job, '')
+        for source in job['chapters']:
+            if 'file' in source:
+                source['file'] = _resolve_local_file(source['file'], self.base_directory)
+        for option in ('cover_file', 'css_file'):
+            if job.get(option):
+                job[option] = _resolve_local_file(job[option], self.base_directory)
+        # the id of a resumable build is taken from the job as it was sent,
+        # so a job sent again after a crash resumes whatever its unique name
+        options = dict(self._options, job_id=batch.get_job_id(job))
+        job['epub_name'] = _get_epub_name(job)
+        with self._lock:
+            if self._pending >= self.processes + self.max_queued_jobs:
+                raise ServerBusyError()
+            self._pending += 1
+        try:
+            result = self._pool.apply_async(
+                    batch._run_job,
+                    ((job, self.output_directory, options),)).get()
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            if result['error']:
+                self.failed += 1
+            else:
+                self.built += 1
+        return result
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '/')
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if path == '/status' and method == 'GET':
+            return _respond_json(start_response, '200 OK', self.get_status())
+        if path != '/build':
+            return _respond_json(start_response, '404 Not Found',
+                                 {'error': 'no such endpoint'})
+        if method != 'POST':
+            return _respond_json(start_response, '405 Method Not Allowed',
+                                 {'error': 'jobs must be POSTed'})
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            assert 0 < length <= MAX_JOB_BYTES
+            job = json.loads(environ['wsgi.input'].read(length).decode('utf-8'))
+            result = self.build(job)
+        except (AssertionError, ValueError) as e:
+            return _respond_json(start_response, '400 Bad Request',
+                                 {'error': str(e) or 'missing or oversized job'})
+        except ServerBusyError as e:
+            return _respond_json(start_response, '503 Service Unavailable',
+                                 {'error': str(e)})
+        if result['error']:
+            return _respond_json(start_response, '500 Internal Server Error', result)
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        if query.get('download') != ['1']:
+            return _respond_json(start_response, '200 OK', result)
+        file_name = os.path.basename(result['path'])
+        file_name = file_name.encode('ascii', 'replace').decode('ascii').replace('"', '')
+        start_response('200 OK', [
+                ('Content-Type', 'application/epub+zip'),
+                ('Content-Length', str(os.path.getsize(result['path']))),
+                ('Content-Disposition', 'attachment; filename="%s"' % file_name)])
+        f = open(result['path'], 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, 65536)
+        return _read_chunks(f)
+
+
+def _read_chunks(f):
+    with f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            yield chunk
+
+
+def _respond_json(start_response, status, value):
+    body = json.dumps(value).encode('utf-8')
+    start_response(status, [('Content-Type', 'application/json'),
+                            ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def serve(build_server, host='127.0.0.1', port=8080):
+    """
+    Serves a BuildServer over HTTP until interrupted.
+    """
+    httpd = simple_server.make_server(host, port, build_server,
+                                      server_class=_ThreadingWSGIServer)
+    logger.info('Serving builds on http://%s:%d', host, port)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+
+def main(argv=None):
+    """
+    Entry point of the pypub-server command, which builds jobs POSTed to it
+    until interrupted.
+    """
+    parser = argparse.ArgumentParser(
+            prog='pypub-server',
+            description='Build epub files from jobs sent over HTTP, on warm '
+                        'worker processes.')
+    parser.add_argument('-o', '--output-directory', default='.',
+                        help='directory to write the epub files to')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8080,
+                        help='port to listen on (default: 8080)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED_JOBS,
+                        help='jobs queued while every worker is busy before new '
+                             'ones are refused (default: %d)' % MAX_QUEUED_JOBS)
+    parser.add_argument('--cache-dir', default=None,
+                        help='fetch and clean cache shared by all jobs, kept between '
+                             'runs (default: a temporary directory)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log every chapter fetched, cleaned and written')
+    parser.add_argument('--work-dir', default=None,
+                        help='stage books in this directory with a journal, so a '
+                             'crashed build continues where it stopped when sent again')
+    parser.add_argument('--workspace-dir', default=None,
+                        help='stage books in this directory while they are built')
+    parser.add_argument('--max-workspace-bytes', type=int, default=None,
+                        help='fail books whose staged chapters and images grow '
+                             'past this size')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not os.path.isdir(args.output_directory):
+        os.makedirs(args.output_directory)
+    cache_directory = args.cache_dir or tempfile.mkdtemp(prefix='pypub-cache-')
+    with BuildServer(args.output_directory, args.jobs, args.max_queued,
+                     cache_directory, verbose=args.verbose,
+                     work_directory=args.work_dir,
+                     workspace_directory=args.workspace_dir,
+                     max_workspace_bytes=args.max_workspace_bytes) as build_server:
+        try:
+            serve(build_server, args.host, args.port)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if args.cache_dir is None:
+                shutil.rmtree(cache_directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+import unittest
+
+import aio
+import chapter
+import fetch
+
+
+class _FakeFetch(object):
+    # stands in for pypub.fetch.fetch, counting calls and downloads in flight
+
+    def __init__(self, delays=None, failing=()):
+        self.delays = delays or {}
+        self.failing = failing
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, url, headers=None, cache=None):
+        with self._lock:
+            self.calls.append(url)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delays.get(url, 0.05))
+            if url in self.failing:
+                raise fetch.FetchError(url, 'failed %s' % url)
+            return fetch.FetchResult(url, url.encode('utf-8'), 'image/jpeg')
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class _Book(object):
+    def __init__(self, failing_title=None):
+        self.added = []
+        self.failing_title = failing_title
+
+    def add_chapter(self, c, image_content=None):
+        if c.title == self.failing_title:
+            raise ValueError('cannot add %s' % c.title)
+        self.added.append((c.title, image_content))
+
+
+def _create_chapter(title, image_urls):
+    images = u''.join(u'<img src="%s"/>' % url for url in image_urls)
+    return chapter.create_chapter_from_string(
+            u'<html><body><p>%s</p>%s</body></html>' % (title, images), title,
+            url='http://example.com/%s.html' % title)
+
+
+class AioTests(unittest.TestCase):
+
+    def setUp(self):
+        # without aiohttp, downloads run pypub.fetch.fetch on the executor
+        self.aiohttp_module_exists = aio.aiohttp_module_exists
+        aio.aiohttp_module_exists = False
+        self.fetch = fetch.fetch
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        aio.aiohttp_module_exists = self.aiohttp_module_exists
+        fetch.fetch = self.fetch
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_concurrency_bound(self):
+        fake = fetch.fetch = _FakeFetch()
+        fetcher = aio.AsyncFetcher(max_concurrency=2)
+        urls = ['http://example.com/%d.jpg' % n for n in range(6)]
+        results = self.run_coroutine(asyncio.gather(*[fetcher.fetch(u) for u in urls]))
+        self.assertEqual([r.url for r in results], urls)
+        self.assertEqual(fake.max_in_flight, 2)
+
+    def test_single_flight(self):
+        fake = fetch.fetch = _FakeFetch()
+        fetcher = aio.AsyncFetcher()
+        results = self.run_coroutine(asyncio.gather(
+                fetcher.fetch('http://example.com/a.jpg'),
+                fetcher.fetch('HTTP://Example.com/a.jpg'),
+                fetcher.fetch('http://example.com:80/a.jpg#top')))
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(len(set(id(r) for r in results)), 1)
+        # other headers make another request
+        self.run_coroutine(asyncio.gather(
+                fetcher.fetch('http://example.com/b.jpg'),
+                fetcher.fetch('http://example.com/b.jpg',
+                              {'Referer': 'http://example.com/'}),
+                fetcher.fetch('http://example.com/b.jpg',
+                              {'referer': 'http://example.com/'})))
+        self.assertEqual(len(fake.calls), 3)
+        # finished downloads aren't shared with later calls
+        self.run_coroutine(fetcher.fetch('http://example.com/a.jpg'))
+        self.assertEqual(len(fake.calls), 4)
+
+    def test_add_chapters_order(self):
+        slow = 'http://example.com/slow.jpg'
+        fetch.fetch = _FakeFetch(delays={slow: 0.3},
+                                 failing=['http://example.com/missing.jpg'])
+        chapters = [_create_chapter(u'One', [slow]),
+                    _create_chapter(u'Two', ['http://example.com/missing.jpg']),
+                    _create_chapter(u'Three', [])]
+        book = _Book()
+        self.run_coroutine(aio.add_chapters(book, chapters))
+        self.assertEqual([title for title, _ in book.added], [u'One', u'Two', u'Three'])
+        self.assertEqual(book.added[0][1], {slow: slow.encode('utf-8')})
+        self.assertEqual(book.added[1][1], {'http://example.com/missing.jpg': None})
+
+    def test_errors(self):
+        fetch.fetch = _FakeFetch(failing=['http://example.com/page'])
+        self.assertRaises(ValueError, self.run_coroutine, aio.create_chapter_from_url(
+                chapter.ChapterFactory(), 'http://example.com/page'))
+        book = _Book(failing_title=u'Two')
+        chapters = [_create_chapter(title, []) for title in (u'One', u'Two', u'Three')]
+        self.assertRaises(ValueError, self.run_coroutine,
+                          aio.add_chapters(book, chapters))
+        self.assertEqual([title for title, _ in book.added], [u'One'])
+
+    def test_chapters_without_soup(self):
+        fake = fetch.fetch = _FakeFetch()
+        c = _create_chapter(u'Read back', ['http://example.com/a.jpg'])
+        c.soup = None
+        self.assertEqual(self.run_coroutine(aio.fetch_images(c)), {})
+        self.assertEqual(fake.calls, [])
+
+    def test_close_default_fetcher(self):
+        async def use_default_fetcher():
+            fetcher = aio.get_default_fetcher()
+            self.assertTrue(aio.get_default_fetcher() is fetcher)
+            await aio.close_default_fetcher()
+            self.assertFalse(aio.get_default_fetcher() is fetcher)
+            await aio.close_default_fetcher()
+        self.run_coroutine(use_default_fetcher())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import archive
+
+
+class ArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_directory = os.path.join(self.directory, 'source')
+        self.files = {
+            'mimetype': b'application/epub+zip',
+            'META-INF/container.xml': b'<container/>',
+            'OEBPS/chapter_0001.xhtml': b''.join(
+                    b'<p>Paragraph %d of the chapter.</p>\n' % n for n in range(2000)),
+            'OEBPS/images/a.jpg': b'\xff\xd8\xff' + os.urandom(4096),
+        }
+        for name, data in self.files.items():
+            path = os.path.join(self.source_directory, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+        self.can_write_compressed_entries = archive._can_write_compressed_entries
+
+    def tearDown(self):
+        archive._can_write_compressed_entries = self.can_write_compressed_entries
+        shutil.rmtree(self.directory)
+
+    def write_archive(self, name='book.zip', **options):
+        return archive.write_epub_archive(self.source_directory,
+                                          os.path.join(self.directory, name),
+                                          **options)
+
+    def check_archive(self, zip_file_name):
+        with zipfile.ZipFile(zip_file_name) as z:
+            self.assertEqual(z.testzip(), None)
+            infos = z.infolist()
+            self.assertEqual(infos[0].filename, 'mimetype')
+            self.assertEqual(infos[0].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(sorted(z.namelist()), sorted(self.files))
+            for name, data in self.files.items():
+                self.assertEqual(z.read(name), data)
+            return dict((info.filename, info) for info in infos)
+
+    def test_layout(self):
+        infos = self.check_archive(self.write_archive())
+        self.assertEqual(infos['OEBPS/images/a.jpg'].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(infos['OEBPS/chapter_0001.xhtml'].compress_type,
+                         zipfile.ZIP_DEFLATED)
+
+    def test_store_media(self):
+        infos = self.check_archive(self.write_archive(store_media=False))
+        self.assertEqual(infos['OEBPS/images/a.jpg'].compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_compress_level(self):
+        infos = self.check_archive(self.write_archive(compress_level=0))
+        self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED
+                            for info in infos.values()))
+        fast = self.check_archive(self.write_archive('fast.zip', compress_level=1))
+        best = self.check_archive(self.write_archive('best.zip', compress_level=9))
+        self.assertTrue(best['OEBPS/chapter_0001.xhtml'].compress_size <=
+                        fast['OEBPS/chapter_0001.xhtml'].compress_size)
+
+    def test_writestr_fallback(self):
+        archive._can_write_compressed_entries = lambda zip_file: False
+        infos = self.check_archive(self.write_archive())
+        self.assertEqual(infos['OEBPS/chapter_0001.xhtml'].compress_type,
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(infos['OEBPS/images/a.jpg'].compress_type, zipfile.ZIP_STORED)
+
+    def test_reproducible(self):
+        date_time = (2017, 7, 14, 2, 40, 0)
+        first = self.write_archive('first.zip', date_time=date_time)
+        second = self.write_archive('second.zip', date_time=date_time,
+                                    compress_threads=1)
+        with open(first, 'rb') as f1, open(second, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_extra_entries(self):
+        cover = os.path.join(self.directory, 'cover.jpg')
+        with open(cover, 'wb') as f:
+            f.write(b'\xff\xd8\xff cover')
+        zip_file_name = self.write_archive(extra_entries={'OEBPS/cover.jpg': cover})
+        self.files['OEBPS/cover.jpg'] = b'\xff\xd8\xff cover'
+        self.check_archive(zip_file_name)
+
+    def test_batches(self):
+        entries = [(name, os.path.join(self.source_directory, *name.split('/')))
+                   for name in sorted(self.files)]
+        batches = list(archive._get_batches(entries, 3, 100))
+        self.assertEqual(sum(batches, []), entries)
+        for batch in batches:
+            self.assertTrue(0 < len(batch) <= 3)
+            if len(batch) > 1:
+                self.assertTrue(sum(os.path.getsize(path) for _, path in batch) <= 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
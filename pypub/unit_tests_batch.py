@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch
+
+
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.manifest_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.manifest_directory)
+
+    def write_manifest(self, jobs):
+        manifest_file = os.path.join(self.manifest_directory, 'books.json')
+        with open(manifest_file, 'w') as f:
+            json.dump(jobs, f)
+        return manifest_file
+
+    def test_load_manifest(self):
+        manifest_file = self.write_manifest([
+                {'title': 'Book One',
+                 'creator': 'Someone',
+                 'chapters': ['http://example.com',
+                              'chapters/one.html',
+                              {'url': 'http://example.org', 'title': 'Two'}]}])
+        jobs = batch.load_manifest(manifest_file)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['creator'], 'Someone')
+        self.assertEqual(jobs[0]['chapters'],
+                [{'url': 'http://example.com'},
+                 {'file': os.path.join(self.manifest_directory,
+                                       'chapters/one.html')},
+                 {'url': 'http://example.org', 'title': 'Two'}])
+
+    def test_load_manifest_books_key(self):
+        manifest_file = self.write_manifest(
+                {'books': [{'title': 'Book One', 'chapters': []}]})
+        self.assertEqual(len(batch.load_manifest(manifest_file)), 1)
+
+    def test_load_manifest_errors(self):
+        self.assertRaises(ValueError, batch.load_manifest,
+                          self.write_manifest({'title': 'Not a list'}))
+        self.assertRaises(ValueError, batch.load_manifest,
+                          self.write_manifest([{'chapters': []}]))
+        self.assertRaises(ValueError, batch.load_manifest,
+                          self.write_manifest([{'title': 'No chapters'}]))
+
+    def test_build_book_chapter_count(self):
+        text = ' '.join('word%d' % n for n in range(100))
+        for name in ('one.html', 'copy.html'):
+            with open(os.path.join(self.manifest_directory, name), 'w') as f:
+                f.write('<html><body><p>%s</p></body></html>' % text)
+        job = batch.load_manifest(self.write_manifest([
+                {'title': 'Book One', 'deduplicate': True,
+                 'chapters': ['one.html', 'copy.html']}]))[0]
+        result = batch.build_book(job, self.manifest_directory)
+        self.assertEqual(result['chapters'], 1)
+        self.assertEqual(result['duplicates'], 1)
+
+    def test_format_summary(self):
+        results = [{'title': 'A', 'chapters': 10, 'bytes': 1048576,
+                    'error': None},
+                   {'title': 'B', 'chapters': 0, 'bytes': 0,
+                    'error': 'ValueError: bad url'}]
+        summary = batch.format_summary(results, 2.0)
+        self.assertIn('Books built:    1 of 2', summary)
+        self.assertIn('5.00 chapters/s', summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
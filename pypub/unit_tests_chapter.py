@@ -1,6 +1,9 @@
 import os
+import shutil
+import tempfile
 import unittest
 
+import cache
 import chapter
 
 
@@ -33,6 +36,29 @@ class ChapterTests(unittest.TestCase):
         self.assertEqual(c.url, None)
         self.assertEqual(c.html_title, 'Example Domain')
 
+    def test_write_parts(self):
+        directory = tempfile.mkdtemp()
+        paragraphs = u''.join(u'<p>Paragraph %d</p>' % i for i in range(300))
+        c = chapter.Chapter(u'<html><body><div class="thread">%s</div>'
+                            u'<p>End</p></body></html>' % paragraphs, u'Long')
+        file_name = os.path.join(directory, 'chapter_0001.xhtml')
+        file_names = c.write(file_name, 3000)
+        self.assertEqual(c.part_count, len(file_names))
+        self.assertEqual(file_names[:2], [file_name,
+                                          os.path.join(directory, 'chapter_0001_02.xhtml')])
+        text = u''
+        for name in file_names:
+            with open(name, 'rb') as f:
+                part = f.read().decode('utf-8')
+            self.assertTrue(len(part.encode('utf-8')) < 3600)
+            self.assertTrue(u'<div class="thread">' in part)
+            text += part
+        self.assertTrue(u'Paragraph 0\n' in text and u'Paragraph 299\n' in text)
+        self.assertTrue(u'End' in text)
+        c = chapter.Chapter(u'<html><body><p>Short</p></body></html>', u'Short')
+        self.assertEqual(c.write(file_name, 3000), [file_name])
+        shutil.rmtree(directory)
+
     def test_html_title(self):
         test_file = os.path.join(test_directory, 'strategy&.html')
         c = self.factory.create_chapter_from_file(
@@ -55,6 +81,60 @@ class ChapterTests(unittest.TestCase):
                 test_file)
         self.assertRaises(ValueError, c.write, '')
 
+    def test_clean_cache(self):
+        cache_directory = tempfile.mkdtemp()
+        cleaned = []
+
+        def counting_clean(content):
+            cleaned.append(content)
+            return content
+        factory = chapter.ChapterFactory(
+                clean_function=counting_clean,
+                clean_cache=cache.FileCache(cache_directory))
+        html = u'<html><head><title>Cached</title></head><body><p>Hi</p></body></html>'
+        c1 = factory.create_chapter_from_string(html, clean_html=True)
+        c2 = factory.create_chapter_from_string(html, clean_html=True)
+        self.assertEqual(len(cleaned), 1)
+        self.assertEqual(c2.title, 'Cached')
+        self.assertEqual(c1.content, c2.content)
+        # the title of html chapters isn't part of the key
+        c3 = factory.create_chapter_from_string(html, u'Two\nlines', clean_html=True)
+        self.assertEqual(len(cleaned), 1)
+        self.assertEqual(c3.title, u'Two\nlines')
+        self.assertEqual(c3.content, c1.content)
+        counting_clean.version = 2
+        c4 = factory.create_chapter_from_string(html, u'Link title', clean_html=True)
+        c5 = factory.create_chapter_from_string(html, clean_html=True)
+        self.assertEqual(len(cleaned), 2)
+        self.assertEqual(c5.title, 'Cached')
+        self.assertEqual(c4.content, c5.content)
+        shutil.rmtree(cache_directory)
+
+    def test_clean_cache_stylesheets(self):
+        cache_directory = tempfile.mkdtemp()
+        collected = []
+        collect_stylesheets = chapter.css.collect_stylesheets
+
+        def counting_collect(*args):
+            collected.append(args[1])
+            return collect_stylesheets(*args)
+        factory = chapter.ChapterFactory(
+                clean_function=lambda content: content, collect_css=True,
+                clean_cache=cache.FileCache(cache_directory))
+        html = (u'<html><head><style>p { color: red; }</style></head>'
+                u'<body><p>Hi</p></body></html>')
+        chapter.css.collect_stylesheets = counting_collect
+        try:
+            c1 = factory.create_chapter_from_string(html, u'One', u'http://example.com/1',
+                                                    clean_html=True)
+            c2 = factory.create_chapter_from_string(html, u'Two', u'http://example.com/1',
+                                                    clean_html=True)
+        finally:
+            chapter.css.collect_stylesheets = collect_stylesheets
+            shutil.rmtree(cache_directory)
+        self.assertEqual(collected, [u'http://example.com/1'])
+        self.assertTrue(c1.stylesheets)
+        self.assertEqual(c2.stylesheets, c1.stylesheets)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
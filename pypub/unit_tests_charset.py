@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import codecs
+import unittest
+
+import charset
+
+
+class CharsetTests(unittest.TestCase):
+
+    def test_decode_bom(self):
+        content = codecs.BOM_UTF8 + u'<p>caf\xe9</p>'.encode('utf-8')
+        self.assertEqual(charset.decode(content, 'text/html; charset=iso-8859-1'),
+                         u'<p>caf\xe9</p>')
+        self.assertEqual(charset.decode(content), u'<p>caf\xe9</p>')
+
+    def test_decode_content_type(self):
+        content = b'<meta charset="utf-8"><p>caf\xe9\x93</p>'
+        self.assertEqual(charset.decode(content, 'text/html; charset="ISO-8859-1"'),
+                         u'<meta charset="utf-8"><p>caf\xe9\u201c</p>')
+        content = b'<meta charset="utf-8"><p>caf\xe9</p>'
+        self.assertEqual(charset.decode(content, 'text/html; charset=iso-8859-1'),
+                         u'<meta charset="utf-8"><p>caf\xe9</p>')
+
+    def test_decode_meta(self):
+        text = u'<html><head><meta http-equiv="Content-Type" ' \
+               u'content="text/html; charset=gb2312"></head><p>中文</p></html>'
+        content = text.encode('gbk')
+        self.assertEqual(charset.decode(content), text)
+        self.assertEqual(charset.decode(content, 'text/html'), text)
+        text = u'<meta charset=shift_jis><p>日本語</p>'
+        self.assertEqual(charset.decode(text.encode('shift_jis')), text)
+
+    def test_decode_xml_declaration(self):
+        text = u'<?xml version="1.0" encoding="euc-kr"?><p>한</p>'
+        self.assertEqual(charset.decode(text.encode('euc-kr')), text)
+
+    def test_decode_undeclared(self):
+        self.assertEqual(charset.decode(u'<p>caf\xe9</p>'.encode('utf-8')), u'<p>caf\xe9</p>')
+        self.assertEqual(charset.decode(b'<p>caf\xe9</p>'), u'<p>caf\xe9</p>')
+        self.assertEqual(charset.decode(b'<p>\x93caf\xe9\x94</p>'), u'<p>“caf\xe9”</p>')
+
+    def test_decode_unknown_label(self):
+        text = u'<meta charset="x-unknown"><p>caf\xe9</p>'
+        self.assertEqual(charset.decode(text.encode('utf-8'), 'text/html; charset=bogus'),
+                         text)
+
+
+if __name__ == '__main__':
+    unittest.main()
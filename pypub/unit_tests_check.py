@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import chapter
+import check
+import epub
+
+
+test_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                              'test_files')
+
+CONTAINER = b'''<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>'''
+
+OPF = b'''<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0">
+  <manifest>
+    <item href="toc.ncx" id="ncx" media-type="application/x-dtbncx+xml"/>
+    <item href="toc.html" id="toc" media-type="application/xhtml+xml"/>
+    <item href="images/a.png" id="image_a" media-type="image/png"/>
+    <item href="images/a.jpg" id="image_a" media-type="image/jpeg"/>
+    <item href="chapter_0001.xhtml" id="1" media-type="application/xhtml+xml"/>
+    <item href="chapter_0002.xhtml" id="2" media-type="application/xhtml+xml"/>
+  </manifest>
+  <spine toc="ncx">
+    <itemref idref="toc"/>
+    <itemref idref="1"/>
+    <itemref idref="3"/>
+  </spine>
+</package>'''
+
+NCX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <navMap>
+    <navPoint id="1" playOrder="1"><content src="chapter_0001.xhtml"/></navPoint>
+    <navPoint id="2" playOrder="2"><content src="chapter_0002.xhtml"/></navPoint>
+  </navMap>
+</ncx>'''
+
+TOC = b'''<html xmlns="http://www.w3.org/1999/xhtml"><body>
+<p><a href="chapter_0001.xhtml">One</a></p>
+</body></html>'''
+
+CHAPTER = b'<html xmlns="http://www.w3.org/1999/xhtml"><body><p>Text</p></body></html>'
+
+# a 1x1 png
+PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01'
+       b'\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f'
+       b'\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+class CheckTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_check_created_epub(self):
+        c = chapter.create_chapter_from_string(
+                u'<html><body><p>Text</p><img src="test image 1.jpg"/></body></html>',
+                u'One', url=os.path.join(test_directory, 'chapter.html'))
+        c2 = chapter.create_chapter_from_string(
+                u'<html><body><p>More</p><img src="test image 1.jpg"/></body></html>',
+                u'Two', url=os.path.join(test_directory, 'chapter.html'))
+        e = epub.Epub('Test Epub', check=True, toc_page_size=1)
+        e.add_chapter(c)
+        e.add_chapter(c2)
+        epub_file = e.create_epub(self.directory)
+        self.assertTrue(e.check_reports[0].ok, e.check_reports[0].format_report())
+        e.close()
+        self.assertTrue(check.check_epub(epub_file).ok)
+
+    def test_get_image_type_from_bytes(self):
+        self.assertEqual(check.get_image_type_from_bytes(PNG), 'image/png')
+        self.assertEqual(check.get_image_type_from_bytes(b'\xff\xd8\xff\xe0'), 'image/jpeg')
+        self.assertEqual(check.get_image_type_from_bytes(b'GIF89a'), 'image/gif')
+        self.assertEqual(check.get_image_type_from_bytes(b'<svg/>'), None)
+
+    def test_check_png_cover(self):
+        cover_file = os.path.join(self.directory, 'cover.png')
+        with open(cover_file, 'wb') as f:
+            f.write(PNG)
+        c = chapter.create_chapter_from_string(
+                u'<html><body><p>Text</p></body></html>', u'One',
+                url=os.path.join(test_directory, 'chapter.html'))
+        e = epub.Epub('Test Epub', cover_file=cover_file, check=True)
+        e.add_chapter(c)
+        epub_file = e.create_epub(self.directory)
+        self.assertTrue(e.check_reports[0].ok, e.check_reports[0].format_report())
+        with zipfile.ZipFile(epub_file) as z:
+            self.assertEqual(z.read('OEBPS/cover.png'), PNG)
+            self.assertFalse('OEBPS/cover.jpg' in z.namelist())
+            self.assertTrue(b'href="cover.png" id="cover_image" media-type="image/png"'
+                            in z.read('OEBPS/content.opf'))
+            self.assertTrue(b'src="cover.png"' in z.read('OEBPS/cover.xhtml'))
+
+    def test_check_problems(self):
+        epub_file = os.path.join(self.directory, 'broken.epub')
+        with zipfile.ZipFile(epub_file, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('META-INF/container.xml', CONTAINER)
+            z.writestr('mimetype', b'application/epub+zip')
+            z.writestr('OEBPS/content.opf', OPF)
+            z.writestr('OEBPS/toc.ncx', NCX)
+            z.writestr('OEBPS/toc.html', TOC)
+            z.writestr('OEBPS/images/a.png', b'\xff\xd8\xff\xe0 not a png')
+            z.writestr('OEBPS/chapter_0001.xhtml', CHAPTER)
+            z.writestr('OEBPS/chapter_0002.xhtml', b'<html><p>unclosed</html>')
+            z.writestr('OEBPS/notes.txt', b'stray')
+        report = check.check_epub(epub_file)
+        self.assertFalse(report.ok)
+        self.assertEqual(len(report.get_issues('mimetype')), 1)
+        self.assertEqual(len(report.get_issues('duplicate-id')), 1)
+        self.assertEqual([i.path for i in report.get_issues('unlisted-file')],
+                         ['OEBPS/notes.txt'])
+        self.assertEqual([i.path for i in report.get_issues('media-type')],
+                         ['OEBPS/images/a.png'])
+        self.assertEqual([i.path for i in report.get_issues('not-well-formed')],
+                         ['OEBPS/chapter_0002.xhtml'])
+        self.assertEqual(len(report.get_issues('spine')), 1)
+        # chapter 2 is in the NCX but neither in the spine nor in the toc
+        self.assertEqual(len(report.get_issues('ncx')), 1)
+        self.assertEqual(len(report.get_issues('toc')), 1)
+        self.assertIn('OEBPS/notes.txt', report.format_report())
+
+    def test_check_not_a_zip(self):
+        epub_file = os.path.join(self.directory, 'text.epub')
+        with open(epub_file, 'wb') as f:
+            f.write(b'not an epub')
+        self.assertEqual(len(check.check_epub(epub_file).get_issues('archive')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
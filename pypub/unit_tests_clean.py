@@ -4,7 +4,7 @@ import unittest
 
 from bs4 import BeautifulSoup
 
-from clean import clean, condense, create_html_from_fragment, html_to_xhtml
+from clean import clean, condense, create_html_from_fragment, html_to_xhtml, prefilter
 
 
 class CleanTests(unittest.TestCase):
@@ -148,6 +148,26 @@ class CleanTests(unittest.TestCase):
         self.assertRaises(TypeError, create_html_from_fragment, '')
         self.assertRaises(ValueError, create_html_from_fragment, test_tree1)
 
+    def test_prefilter(self):
+        s = u'''
+                <html>
+                 <head>
+                  <meta charset="utf-8" content="a>b">
+                  <script>if (a < b) { document.write("</p>"); }</script >
+                  <STYLE>p { color: red; }</STYLE>
+                 </head>
+                 <body>
+                  <!-- <script> in a comment -->
+                  <p>Hello &amp; welcome<br/><svg><g><svg/><svg></svg></g>text</svg></p>
+                  <noscript><p>Enable javascript</p></noscript>
+                 </body>
+                </html>
+                '''
+        s1 = u'<html><head></head><body><p>Hello &amp; welcome<br/></p></body></html>'
+        self.assertEqual(condense(prefilter(s)), s1)
+        self.assertEqual(prefilter(u'<p>text</p><script>unterminated'), u'<p>text</p>')
+        self.assertEqual(prefilter(u'<scripts>kept</scripts>'), u'<scripts>kept</scripts>')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import chapter
+import crawler
+import epub
+import fetch
+
+_PAGES = {
+    'http://serial.com/toc': u'<html><body><ul id="toc">'
+                             u'<li><a href="/chapter/1">One</a></li>'
+                             u'<li><a href="chapter/2#top">Two</a></li>'
+                             u'<li><a href="http://serial.com/chapter/1">One again</a></li>'
+                             u'</ul><a href="/toc?page=2" class="next">Next</a></body></html>',
+    'http://serial.com/toc?page=2': u'<html><body><ul id="toc">'
+                                    u'<li><a href="/chapter/3">Three</a></li>'
+                                    u'<li><a href="mailto:a@serial.com">Mail</a></li>'
+                                    u'</ul><a href="/toc" class="next">Next</a></body></html>',
+    }
+for _number in range(1, 4):
+    _PAGES['http://serial.com/chapter/%d' % _number] = (
+            u'<html><head><title>Page %d</title></head><body><p>Chapter %d</p></body></html>'
+            % (_number, _number))
+_PAGES['http://serial.com/chapter/4'] = (
+        u'<html><body><p>Chapter 4</p><img src="/images/a.jpg"/>'
+        u'<img src="http://images.serial.com/b.jpg"/></body></html>')
+
+
+class _RecordingLimiter(crawler._HostLimiter):
+
+    def __init__(self, *args, **kwargs):
+        super(_RecordingLimiter, self).__init__(*args, **kwargs)
+        self.urls = []
+
+    def limit(self, url):
+        self.urls.append(url)
+        return super(_RecordingLimiter, self).limit(url)
+
+
+class _LocalCrawler(crawler.Crawler):
+    # serves _PAGES instead of downloading, with chapter 1 the slowest
+
+    def __init__(self, *args, **kwargs):
+        super(_LocalCrawler, self).__init__(*args, **kwargs)
+        self.fetched = []
+
+    def _fetch(self, url):
+        with self._host_limiter.limit(url):
+            self.fetched.append(url)
+            if url.endswith('/1'):
+                time.sleep(0.1)
+            if url not in _PAGES:
+                raise fetch.FetchError(url, 'not found')
+            return fetch.FetchResult(url, _PAGES[url].encode('utf-8'), 'text/html')
+
+
+class CrawlerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = chapter.ChapterFactory(clean_function=lambda s: s)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_chapter_links(self):
+        c = _LocalCrawler(self.factory, host_delay=0)
+        links = c.find_chapter_links('http://serial.com/toc', '#toc a', 'a.next')
+        self.assertEqual(links, [
+                crawler.ChapterLink('http://serial.com/chapter/1', u'One'),
+                crawler.ChapterLink('http://serial.com/chapter/2', u'Two'),
+                crawler.ChapterLink('http://serial.com/chapter/3', u'Three')])
+        links = c.find_chapter_links('http://serial.com/toc', '#toc a')
+        self.assertEqual(len(links), 2)
+
+    def test_crawl_keeps_order(self):
+        c = _LocalCrawler(self.factory, max_concurrency=3, host_delay=0)
+        book = epub.Epub('Serial', epub_dir=self.directory)
+        self.assertEqual(c.crawl(book, 'http://serial.com/toc', '#toc a', 'a.next'), 3)
+        self.assertEqual([x.title for x in book.chapters], [u'One', u'Two', u'Three'])
+        book = epub.Epub('Serial', epub_dir=self.directory + '/titles')
+        c.crawl(book, 'http://serial.com/toc', '#toc a', use_link_titles=False)
+        self.assertEqual([x.title for x in book.chapters], [u'Page 1', u'Page 2'])
+
+    def test_skip_errors(self):
+        links = ['http://serial.com/chapter/1', 'http://serial.com/missing']
+        book = epub.Epub('Serial', epub_dir=self.directory)
+        c = _LocalCrawler(self.factory, host_delay=0)
+        self.assertRaises(ValueError, c.add_chapters, book, links)
+        c = _LocalCrawler(self.factory, host_delay=0, skip_errors=True)
+        book = epub.Epub('Serial', epub_dir=self.directory + '/skip')
+        self.assertEqual(c.add_chapters(book, links), 1)
+        self.assertEqual(c.failed, ['http://serial.com/missing'])
+
+    def test_images_limited(self):
+        images = []
+
+        def fetch_image(url, headers=None, cache=None):
+            images.append(url)
+            return fetch.FetchResult(url, b'\xff\xd8\xff' + url.encode('utf-8'), 'image/jpeg')
+        c = _LocalCrawler(self.factory, host_delay=0)
+        c._host_limiter = _RecordingLimiter(1, 0)
+        book = epub.Epub('Serial', epub_dir=self.directory)
+        original_fetch = fetch.fetch
+        fetch.fetch = fetch_image
+        try:
+            self.assertEqual(c.add_chapters(book, ['http://serial.com/chapter/4']), 1)
+        finally:
+            fetch.fetch = original_fetch
+        image_urls = ['http://serial.com/images/a.jpg', 'http://images.serial.com/b.jpg']
+        self.assertEqual(images, image_urls)
+        self.assertEqual(c._host_limiter.urls, ['http://serial.com/chapter/4'] + image_urls)
+        self.assertEqual(len(book.chapters[0].images), 2)
+
+    def test_host_limiter(self):
+        limiter = crawler._HostLimiter(1, 0.05)
+        starts = []
+
+        def download():
+            with limiter.limit('http://serial.com/a'):
+                starts.append(time.time())
+        threads = [threading.Thread(target=download) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        starts.sort()
+        self.assertTrue(starts[2] - starts[0] >= 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import css
+
+
+class CSSTests(unittest.TestCase):
+
+    def test_filter_stylesheet(self):
+        stylesheet = css.filter_stylesheet(
+                '/* comment */ @import url(other.css);\n'
+                'body { margin : 0 }\n'
+                'table td, p { color: red ; background: url(bg.png) }\n'
+                'div.header { color: blue }\n'
+                'ul.nav > li { list-style: none }\n'
+                '@media screen and (max-width: 600px) { p { width: calc(1em + 2px) } }\n'
+                '@font-face { font-family: f; src: url(f.woff) }\n')
+        self.assertEqual(stylesheet.split('\n'), [
+                'body{margin:0}',
+                'p{color:red}',
+                'ul.nav>li{list-style:none}',
+                '@media screen and (max-width:600px){p{width:calc(1em + 2px)}}'])
+
+    def test_merge_stylesheets(self):
+        self.assertEqual(css.merge_stylesheets(['p{a:b}\ni{c:d}', 'p{a:b}']),
+                         'i{c:d}\np{a:b}')
+
+    def test_collect_stylesheets(self):
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'site.css'), 'w') as f:
+            f.write('p { color: red } div.ad { display: none }')
+        html = ('<html><head><link rel="stylesheet" href="site.css">'
+                '<link rel="stylesheet" href="missing.css">'
+                '<style media="print">p { color: black }</style>'
+                '<style>i { color: blue }</style></head><body></body></html>')
+        cache = {}
+        stylesheets = css.collect_stylesheets(
+                html, os.path.join(directory, 'page.html'), cache=cache)
+        self.assertEqual(stylesheets, ['p{color:red}', 'i{color:blue}'])
+        self.assertEqual(len(cache), 2)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+import chapter
+import dedup
+
+
+def _get_page(words, title='Page'):
+    return u'<html><head><title>%s</title><script>var x = 1;</script></head>' \
+           u'<body><p>%s</p></body></html>' % (title, u' '.join(words))
+
+
+class DuplicateDetectorTests(unittest.TestCase):
+
+    def setUp(self):
+        generator = random.Random(7)
+        vocabulary = [u'word%d' % i for i in range(500)]
+        self.words = [generator.choice(vocabulary) for _ in range(400)]
+        self.other_words = [generator.choice(vocabulary) for _ in range(400)]
+
+    def test_get_tokens(self):
+        text = dedup.get_text(u'<head><title>Skipped</title></head>'
+                              u'<body><p>Hello&nbsp;<b>World</b></p>'
+                              u'<style>p {}</style>中文</body>')
+        self.assertEqual(dedup.get_tokens(text), [u'hello', u'world', u'中', u'文'])
+
+    def test_near_duplicates(self):
+        detector = dedup.DuplicateDetector()
+        self.assertEqual(detector.check(_get_page(self.words), 'a'), None)
+        self.assertEqual(detector.check(_get_page(self.other_words), 'b'), None)
+        reprint = list(self.words)
+        reprint[200] = u'changed'
+        record = detector.check(_get_page(reprint, 'Reprint'), 'c')
+        self.assertEqual(record.original, 'a')
+        self.assertTrue(record.distance <= 3)
+        self.assertEqual(detector.skipped, [record])
+        self.assertTrue('c (' in detector.format_report())
+
+    def test_exact_threshold(self):
+        detector = dedup.DuplicateDetector(threshold=0)
+        detector.check(_get_page(self.words), 'a')
+        self.assertEqual(detector.check(_get_page(self.words, 'Other'), 'b').distance, 0)
+
+    def test_short_pages(self):
+        detector = dedup.DuplicateDetector()
+        detector.check(_get_page(self.words[:10]), 'a')
+        self.assertEqual(detector.check(_get_page(self.words[:10]), 'b'), None)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, dedup.DuplicateDetector, 16)
+        self.assertRaises(ValueError, dedup.DuplicateDetector, 3, 'keep')
+
+    def test_chapter_factory(self):
+        factory = chapter.ChapterFactory(clean_function=lambda s: s,
+                                         duplicate_detector=dedup.DuplicateDetector())
+        factory.create_chapter_from_string(_get_page(self.words), url='http://a.com/1')
+        self.assertRaises(dedup.DuplicateChapterError, factory.create_chapter_from_string,
+                          _get_page(self.words), url='http://a.com/2')
+        factory.duplicate_detector.mode = dedup.LINK
+        c = factory.create_chapter_from_string(_get_page(self.words, 'Copy'),
+                                               url='http://a.com/3')
+        self.assertEqual(c.title, u'Copy')
+        self.assertTrue(u'href="http://a.com/1"' in c.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
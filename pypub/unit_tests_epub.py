@@ -5,10 +5,12 @@ import os.path
 import shutil
 import tempfile
 import time
+import zipfile
 
 import chapter
 from constants import *
 import epub
+import reader
 
 
 class TestEpub(unittest.TestCase):
@@ -102,6 +104,156 @@ class TestEpub(unittest.TestCase):
             e.add_chapter(c)
         e.create_epub('test_epub', epub_directory)
 
+    def test_create_epub_volumes(self):
+        volume_directory = tempfile.mkdtemp()
+        e = epub.Epub('Test Epub', max_volume_chapters=2,
+                      volume_directory=volume_directory)
+        for c in self.chapter_list[:3]:
+            e.add_chapter(c)
+        self.assertEqual(len(e.volume_files), 1)
+        volume_files = e.create_epub(None)
+        self.assertEqual([os.path.basename(f) for f in volume_files],
+                         ['Test Epub - Volume 1.epub',
+                          'Test Epub - Volume 2.epub'])
+        shutil.rmtree(volume_directory)
+
+    def test_add_epub(self):
+        output_directory = tempfile.mkdtemp()
+        e = epub.Epub('Source Epub')
+        for c in self.chapter_list[:2]:
+            e.add_chapter(c)
+        source_file = e.create_epub(output_directory)
+        with reader.EpubReader(source_file) as source:
+            self.assertEqual(source.title, 'Source Epub')
+            self.assertEqual([c.title for c in source.chapters],
+                             [c.title for c in self.chapter_list[:2]])
+            merged = epub.Epub('Merged Epub')
+            merged.add_epub(source)
+            merged.add_epub(source_file)
+        self.assertEqual(len(merged.chapters), 4)
+        merged.create_epub(output_directory)
+        shutil.rmtree(output_directory)
+
+    def test_add_epub_missing_image(self):
+        output_directory = tempfile.mkdtemp()
+        c = chapter.create_chapter_from_string(
+                u'<html><body><p>Text</p><img src="missing.png"/></body></html>',
+                u'Missing', url=os.path.join(TEST_DIR, 'missing.html'))
+        e = epub.Epub('Source Epub')
+        e.add_chapter(c)
+        source_file = e.create_epub(output_directory)
+        merged = epub.Epub('Merged Epub')
+        merged.add_epub(source_file)
+        self.assertEqual(merged.chapters[0].images, [])
+        merged.create_epub(output_directory, u'merged')
+        shutil.rmtree(output_directory)
+
+    def test_paginated_toc(self):
+        output_directory = tempfile.mkdtemp()
+        e = epub.Epub('Test Epub', toc_page_size=1)
+        for c in self.chapter_list[:3]:
+            e.add_chapter(c)
+        epub_file = e.create_epub(output_directory)
+        self.assertEqual(e.toc_html.get_page_names(),
+                         ['toc.html', 'toc_0002.html', 'toc_0003.html'])
+        with zipfile.ZipFile(epub_file) as z:
+            self.assertTrue('OEBPS/toc_0003.html' in z.namelist())
+            self.assertTrue(b'idref="toc_0002"' in z.read('OEBPS/content.opf'))
+        with reader.EpubReader(epub_file) as source:
+            self.assertEqual([c.title for c in source.chapters],
+                             [c.title for c in self.chapter_list[:3]])
+        shutil.rmtree(output_directory)
+
+    def test_split_chapters(self):
+        output_directory = tempfile.mkdtemp()
+        paragraphs = u''.join(u'<p>Paragraph %d of a long thread.</p>' % i
+                              for i in range(400))
+        long_chapter = chapter.create_chapter_from_string(
+                u'<html><body><div>%s</div></body></html>' % paragraphs, u'Long')
+        e = epub.Epub('Test Epub', max_chapter_bytes=4000)
+        e.add_chapter(long_chapter)
+        e.add_chapter(copy.deepcopy(self.chapter_list[0]))
+        self.assertTrue(long_chapter.part_count > 1)
+        epub_file = e.create_epub(output_directory)
+        with zipfile.ZipFile(epub_file) as z:
+            opf = z.read('OEBPS/content.opf')
+            self.assertTrue(b'idref="chapter_0001_02"' in opf)
+            self.assertTrue(b'chapter_0001_02' not in z.read('OEBPS/toc.ncx'))
+        with reader.EpubReader(epub_file) as source:
+            self.assertEqual(len(source.chapters), 2)
+            self.assertEqual(source.chapters[0].part_count, long_chapter.part_count)
+        shutil.rmtree(output_directory)
+
+    def test_cover_from_file(self):
+        output_directory = tempfile.mkdtemp()
+        cover_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                  'test_files', 'test image 1.jpg')
+        e = epub.Epub('Test Epub', cover_file=cover_file)
+        e.add_chapter(copy.deepcopy(self.chapter_list[0]))
+        epub_file = e.create_epub(output_directory)
+        with open(cover_file, 'rb') as f:
+            cover = f.read()
+        with zipfile.ZipFile(epub_file) as z:
+            self.assertEqual(z.read('OEBPS/cover.jpg'), cover)
+            self.assertTrue('OEBPS/main.css' in z.namelist())
+        shutil.rmtree(output_directory)
+
+    def test_resume_build(self):
+        work_dir = tempfile.mkdtemp()
+        e = epub.Epub('Test Epub', work_dir=work_dir, job_id='test')
+        for c in copy.deepcopy(self.chapter_list[:2]):
+            e.add_chapter(c)
+        # a crash while writing the second chapter
+        with open(os.path.join(e.OEBPS_DIR, 'chapter_0002.xhtml'), 'a') as f:
+            f.write('partial')
+        resumed = epub.Epub('Test Epub', work_dir=work_dir, job_id='test')
+        self.assertEqual(len(resumed.chapters), 1)
+        self.assertEqual(resumed.uid, e.uid)
+        self.assertTrue(resumed.resume_chapter(self.chapter_list[0].url or
+                                               self.chapter_list[0].title))
+        resumed.add_chapter(self.chapter_list[1])
+        epub_file = resumed.create_epub(self.output_directory)
+        with reader.EpubReader(epub_file) as source:
+            self.assertEqual(len(source.chapters), 2)
+        self.assertEqual(os.listdir(work_dir), [])
+        shutil.rmtree(work_dir)
+
+    def test_reproducible_epub(self):
+        epub_files = []
+        for _ in range(2):
+            e = epub.Epub('Test Epub', reproducible=True, timestamp=1500000000)
+            for c in copy.deepcopy(self.chapter_list[:2]):
+                e.add_chapter(c)
+            epub_files.append(e.create_epub(tempfile.mkdtemp()))
+            time.sleep(1)
+        with open(epub_files[0], 'rb') as f0, open(epub_files[1], 'rb') as f1:
+            self.assertEqual(f0.read(), f1.read())
+        with zipfile.ZipFile(epub_files[0]) as z:
+            self.assertEqual(z.infolist()[0].date_time, (2017, 7, 14, 2, 40, 0))
+            self.assertTrue(b'<dc:date>2017-07-14</dc:date>' in z.read('OEBPS/content.opf'))
+        for epub_file in epub_files:
+            shutil.rmtree(os.path.dirname(epub_file))
+
+    def test_workspace(self):
+        workspace_dir = tempfile.mkdtemp()
+        output_directory = tempfile.mkdtemp()
+        with epub.Epub('Test Epub', workspace_dir=workspace_dir) as e:
+            e.add_chapter(copy.deepcopy(self.chapter_list[0]))
+            self.assertEqual(os.path.dirname(e.EPUB_DIR), workspace_dir)
+            e.create_epub(output_directory)
+        self.assertEqual(os.listdir(workspace_dir), [])
+        e = epub.Epub('Test Epub', workspace_dir=workspace_dir,
+                      max_workspace_bytes=100)
+        self.assertRaises(epub.WorkspaceFullError, e.add_chapter,
+                          copy.deepcopy(self.chapter_list[0]))
+        self.assertEqual(os.listdir(workspace_dir), [])
+        shutil.rmtree(workspace_dir)
+        shutil.rmtree(output_directory)
+
+    def test_volume_directory_required(self):
+        self.assertRaises(ValueError, epub.Epub, 'Test Epub',
+                          max_volume_chapters=2)
+
 
 if __name__ == '__main__':
     unittest.main()
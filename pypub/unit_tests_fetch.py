@@ -0,0 +1,110 @@
+import threading
+import time
+import unittest
+
+import fetch
+
+
+class FetchTests(unittest.TestCase):
+
+    def test_normalize_url(self):
+        self.assertEqual(fetch.normalize_url('HTTP://Example.COM:80'),
+                         'http://example.com/')
+        self.assertEqual(fetch.normalize_url('https://example.com:443/a?b=1#c'),
+                         'https://example.com/a?b=1')
+        self.assertEqual(fetch.normalize_url('http://example.com:8080/A'),
+                         'http://example.com:8080/A')
+
+    def test_single_flight_shares_call(self):
+        single_flight = fetch._SingleFlight(10, 1024, 60)
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return fetch.FetchResult('http://example.com/', b'content', ''), True
+        results = []
+        threads = [threading.Thread(
+                target=lambda: results.append(single_flight.do('key', slow_fetch)))
+                for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.content for r in results], [b'content'] * 5)
+        single_flight.do('key', slow_fetch)
+        self.assertEqual(len(calls), 1)
+
+    def test_single_flight_lru(self):
+        single_flight = fetch._SingleFlight(2, 1024, 60)
+        for key in ('a', 'b', 'c'):
+            single_flight.do(key, lambda: (fetch.FetchResult(key, b'x', ''), True))
+        self.assertEqual(list(single_flight._results.keys()), ['b', 'c'])
+
+    def test_single_flight_error(self):
+        single_flight = fetch._SingleFlight(10, 1024, 60)
+
+        def failing_fetch():
+            raise fetch.FetchError('http://example.com', 'no network')
+        self.assertRaises(fetch.FetchError, single_flight.do, 'key', failing_fetch)
+        self.assertEqual(len(single_flight._results), 0)
+
+    def test_single_flight_interrupt(self):
+        single_flight = fetch._SingleFlight(10, 1024, 60)
+        started = threading.Event()
+        errors = []
+
+        def interrupted_fetch():
+            started.set()
+            time.sleep(0.2)
+            raise KeyboardInterrupt()
+
+        def wait_for_call():
+            started.wait()
+            try:
+                single_flight.do('key', interrupted_fetch)
+            except KeyboardInterrupt as e:
+                errors.append(e)
+        thread = threading.Thread(target=wait_for_call)
+        thread.start()
+        self.assertRaises(KeyboardInterrupt, single_flight.do, 'key', interrupted_fetch)
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(single_flight._results), 0)
+
+    def test_single_flight_unkept_result(self):
+        single_flight = fetch._SingleFlight(10, 1024, 60)
+        calls = []
+
+        def not_found_fetch():
+            calls.append(1)
+            return fetch.FetchResult('http://example.com/', b'not found', ''), False
+        single_flight.do('key', not_found_fetch)
+        single_flight.do('key', not_found_fetch)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(single_flight._results), 0)
+
+    def test_fetch_key(self):
+        calls = []
+
+        def counting_fetch(url, headers, cache):
+            calls.append((url, headers, cache))
+            return fetch.FetchResult(url, b'content', ''), True
+        original_fetch = fetch._fetch
+        fetch._fetch = counting_fetch
+        fetch.clear_result_cache()
+        try:
+            fetch.fetch('http://example.com/a')
+            fetch.fetch('HTTP://example.com/a#b')
+            fetch.fetch('http://example.com/a', headers={'Referer': 'http://example.com/'})
+            fetch.fetch('http://example.com/a', headers={'referer': 'http://example.com/'})
+            fetch.fetch('http://example.com/a', cache=object())
+        finally:
+            fetch._fetch = original_fetch
+            fetch.clear_result_cache()
+        self.assertEqual(len(calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
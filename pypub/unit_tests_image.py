@@ -1,7 +1,13 @@
 import os
+import shutil
+import tempfile
 import unittest
 
+from bs4 import BeautifulSoup
+
 import chapter
+import clean
+import utils
 
 
 test_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)),
@@ -34,6 +40,21 @@ class ChapterTests(unittest.TestCase):
                           test_directory,
                           'error image')
 
+    def test_save_local_image(self):
+        image_directory = tempfile.mkdtemp()
+        local_image = os.path.join(test_directory, 'test image 1.jpg')
+        with open(local_image, 'rb') as f:
+            content = f.read()
+        saved = chapter.save_image(local_image, image_directory, 'local.jpg')
+        with open(saved, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        # an image saved later with the same name leaves the local one alone
+        chapter.save_image('http://example.com/other.jpg', image_directory,
+                           'local.jpg', b'other')
+        with open(local_image, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        shutil.rmtree(image_directory)
+
     def test_get_image_urls(self):
         test_url_1 = 'http://example.com'
         test_chapter_1 = chapter.create_chapter_from_url(test_url_1)
@@ -53,5 +74,63 @@ class ChapterTests(unittest.TestCase):
 
 
 
+class ImageSourceTests(unittest.TestCase):
+
+    def _select(self, html, target_width=1200):
+        return utils.select_image_source(BeautifulSoup(html, 'html.parser').img,
+                                         target_width)
+
+    def test_parse_srcset(self):
+        self.assertEqual(utils.parse_srcset('a.jpg 480w, b.jpg, c.jpg 2x , d,e.jpg 3x'),
+                         [('a.jpg', '480w'), ('b.jpg', None), ('c.jpg', '2x'),
+                          ('d,e.jpg', '3x')])
+
+    def test_select_width_descriptors(self):
+        html = '<img src="big.jpg" srcset="s.jpg 400w, m.jpg 800w, l.jpg 1600w, xl.jpg 3200w">'
+        self.assertEqual(self._select(html), 'l.jpg')
+        self.assertEqual(self._select(html, 800), 'm.jpg')
+        self.assertEqual(self._select(html, 5000), 'xl.jpg')
+        html = '<img srcset="s.jpg 400w, m.jpg 800w, l.jpg 1600w" sizes="(max-width: 600px) 100vw, 600px">'
+        self.assertEqual(self._select(html), 'm.jpg')
+        html = '<img srcset="s.jpg 400w, m.jpg 800w, l.jpg 1600w" sizes="50vw">'
+        self.assertEqual(self._select(html), 'm.jpg')
+
+    def test_select_density_descriptors(self):
+        html = '<img src="a.jpg" width="500" srcset="a3.jpg 3x, a2.jpg 2x, a.jpg 0.5x">'
+        self.assertEqual(self._select(html), 'a2.jpg')
+        self.assertEqual(self._select(html, 200), 'a.jpg')
+        self.assertEqual(self._select('<img srcset="a.jpg, a2.jpg 2x">'), 'a.jpg')
+
+    def test_select_lazy_sources(self):
+        placeholder = 'data:image/gif;base64,R0lGODlhAQABAAAAACw='
+        self.assertEqual(self._select('<img src="%s" data-src="real.jpg">' % placeholder),
+                         'real.jpg')
+        self.assertEqual(self._select('<img src="blur.jpg" data-original="real.jpg">'),
+                         'real.jpg')
+        self.assertEqual(self._select('<img src="blur.jpg" data-srcset="a.jpg 800w, b.jpg 1400w">'),
+                         'b.jpg')
+        self.assertEqual(self._select('<img src="%s">' % placeholder), None)
+
+    def test_select_picture_sources(self):
+        html = ('<picture><source type="image/webp" srcset="a.webp 1600w">'
+                '<source srcset="a.jpg 1600w, b.jpg 2400w"><img src="small.jpg"></picture>')
+        self.assertEqual(self._select(html), 'a.jpg')
+
+    def test_clean_resolves_sources(self):
+        html = ('<html><body><p>Text</p><img src="data:image/gif;base64,R0lGOD" '
+                'data-src="real.jpg" srcset="s.jpg 400w, l.jpg 1400w"></body></html>')
+        cleaned = clean.clean(html)
+        self.assertTrue('src="l.jpg"' in cleaned)
+        self.assertFalse('srcset' in cleaned)
+        self.assertTrue('src="s.jpg"' in clean.clean(html, image_width=300))
+
+    def test_extract_urls(self):
+        c = chapter.Chapter(u'<html><body><img src="blur.jpg" data-src="real.jpg">'
+                            u'</body></html>', u'Title', 'http://example.com/a/page.html')
+        urls = [url for _, url in c._get_image_urls()]
+        self.assertEqual(urls, ['http://example.com/a/real.jpg'])
+        self.assertFalse('data-src' in str(c.soup))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import journal
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'job.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_read(self):
+        j = journal.Journal(self.file_name)
+        j.append({'type': 'book', 'uid': 'abc'})
+        j.append({'type': 'chapter', 'file': 'chapter_0001.xhtml'})
+        j.close()
+        self.assertEqual([r['type'] for r in journal.Journal(self.file_name).read()],
+                         ['book', 'chapter'])
+
+    def test_partial_record_dropped(self):
+        j = journal.Journal(self.file_name)
+        j.append({'type': 'book', 'uid': 'abc'})
+        j.close()
+        with open(self.file_name, 'ab') as f:
+            f.write(b'{"type": "chap')
+        self.assertEqual(len(journal.Journal(self.file_name).read()), 1)
+        j.append({'type': 'chapter', 'file': 'chapter_0001.xhtml'})
+        j.close()
+        self.assertEqual(len(journal.Journal(self.file_name).read()), 2)
+
+    def test_rewrite(self):
+        j = journal.Journal(self.file_name)
+        j.append({'type': 'book', 'uid': 'abc'})
+        j.append({'type': 'chapter', 'file': 'chapter_0001.xhtml'})
+        j.rewrite([{'type': 'book', 'uid': 'abc'}])
+        self.assertEqual(len(j.read()), 1)
+        j.remove()
+        self.assertFalse(os.path.exists(self.file_name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import chapter
+import epub
+import fetch
+import pipeline
+
+
+class _LocalBuilder(pipeline.PipelinedBuilder):
+    # serves made up pages after a random delay, counting the chapters in
+    # the pipeline
+
+    def __init__(self, *args, **kwargs):
+        super(_LocalBuilder, self).__init__(*args, **kwargs)
+        self.random = random.Random(3)
+        self.in_flight = 0
+        self.max_seen_in_flight = 0
+        self.count_lock = threading.Lock()
+
+    def _fetch(self, item):
+        with self.count_lock:
+            self.in_flight += 1
+            self.max_seen_in_flight = max(self.max_seen_in_flight, self.in_flight)
+            delay = self.random.random() * 0.02
+        if isinstance(item.source, chapter.Chapter):
+            return
+        time.sleep(delay)
+        if item.source.endswith('missing'):
+            raise ValueError('missing')
+        page = u'<html><head><title>%s</title></head><body><p>%s</p></body></html>' % (
+                item.source, item.source)
+        item.fetch_result = fetch.FetchResult(item.source, page.encode('utf-8'), 'text/html')
+
+
+class _CountingEpub(epub.Epub):
+    def __init__(self, builder, *args, **kwargs):
+        super(_CountingEpub, self).__init__(*args, **kwargs)
+        self.builder = builder
+
+    def add_chapter(self, c, image_content=None):
+        with self.builder.count_lock:
+            self.builder.in_flight -= 1
+        super(_CountingEpub, self).add_chapter(c, image_content)
+
+
+class PipelinedBuilderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = chapter.ChapterFactory(clean_function=lambda s: s)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_order_and_backpressure(self):
+        builder = _LocalBuilder(self.factory, fetch_workers=4, max_in_flight=5)
+        book = _CountingEpub(builder, 'Pipeline', epub_dir=self.directory)
+        urls = ['http://example.com/%d' % i for i in range(30)]
+        c = self.factory.create_chapter_from_string(u'<p>Last</p>', 'Last')
+        self.assertEqual(builder.add_chapters(book, urls + [c]), 31)
+        self.assertEqual([x.title for x in book.chapters], urls + ['Last'])
+        self.assertTrue(builder.max_seen_in_flight <= 5)
+        self.assertTrue(builder.busy_seconds['fetch'] > 0)
+        self.assertTrue(builder.busy_seconds['write'] > 0)
+
+    def test_error(self):
+        builder = _LocalBuilder(self.factory, max_in_flight=3)
+        book = _CountingEpub(builder, 'Pipeline', epub_dir=self.directory)
+        urls = ['http://example.com/0', 'http://example.com/missing',
+                'http://example.com/2']
+        self.assertRaises(ValueError, builder.add_chapters, book, urls)
+        self.assertEqual([x.title for x in book.chapters], urls[:1])
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, pipeline.PipelinedBuilder, fetch_workers=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
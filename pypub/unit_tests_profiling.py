@@ -0,0 +1,59 @@
+import threading
+import unittest
+
+import profiling
+
+
+class MemoryProfilerTests(unittest.TestCase):
+
+    def test_nested_stages(self):
+        with profiling.MemoryProfiler() as profiler:
+            with profiler.stage('outer', 'chapter one'):
+                kept = [bytearray(1024) for _ in range(100)]
+                with profiler.stage('inner', 'chapter one'):
+                    freed = [bytearray(1024) for _ in range(200)]
+                    del freed
+            with profiler.stage('outer', 'chapter two'):
+                pass
+        records = dict(((r.stage, r.chapter), r) for r in profiler.records)
+        inner = records[('inner', 'chapter one')]
+        outer = records[('outer', 'chapter one')]
+        self.assertTrue(inner.peak >= 200 * 1024)
+        self.assertTrue(inner.retained < 100 * 1024)
+        self.assertTrue(outer.peak >= 300 * 1024)
+        self.assertTrue(outer.retained >= 100 * 1024)
+        self.assertEqual(profiler.get_worst_chapters(1)[0][0], 'chapter one')
+        self.assertTrue('worst chapters:' in profiler.format_report())
+        del kept
+
+    def test_stages_on_threads(self):
+        allocated = threading.Event()
+        finished = threading.Event()
+
+        def run_stage_b():
+            with profiler.stage('b', 'chapter two'):
+                freed = [bytearray(1024) for _ in range(500)]
+                del freed
+                allocated.set()
+                finished.wait()
+        with profiling.MemoryProfiler(record_sites=False) as profiler:
+            thread = threading.Thread(target=run_stage_b)
+            # b starts after a and ends after it, and c runs in between
+            with profiler.stage('a', 'chapter one'):
+                thread.start()
+                allocated.wait()
+            with profiler.stage('c', 'chapter three'):
+                pass
+            finished.set()
+            thread.join()
+        records = dict((r.stage, r) for r in profiler.records)
+        self.assertTrue(records['b'].peak >= 500 * 1024)
+        self.assertTrue(records['c'].peak < 250 * 1024)
+
+    def test_null_stage(self):
+        with profiling.stage(None, 'parse'):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+import progress
+
+
+class ProgressTrackerTests(unittest.TestCase):
+
+    def test_events(self):
+        events = []
+        tracker = progress.ProgressTracker(events.append, total_chapters=4)
+        tracker.emit(progress.CHAPTER_FETCHED, 'one', 100)
+        self.assertEqual(events[-1].eta, None)
+        tracker.emit(progress.CHAPTER_WRITTEN, 'one', 10)
+        tracker.emit(progress.CHAPTER_WRITTEN, 'two', 20)
+        event = events[-1]
+        self.assertEqual(event.kind, progress.CHAPTER_WRITTEN)
+        self.assertEqual(event.count, 2)
+        self.assertEqual(event.total_bytes, 30)
+        self.assertEqual(event.chapters_written, 2)
+        self.assertEqual(event.total_chapters, 4)
+        self.assertTrue(event.eta >= 0)
+        self.assertEqual(tracker.last_event_time, event.time)
+
+    def test_emit_without_tracker(self):
+        self.assertEqual(progress.emit(None, progress.CHAPTER_WRITTEN), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from wsgiref.util import setup_testing_defaults
+
+import server
+
+
+class BuildServerTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.output_directory = tempfile.mkdtemp()
+        cls.chapter_directory = tempfile.mkdtemp()
+        for n in range(2):
+            with open(os.path.join(cls.chapter_directory, '%d.html' % n), 'w') as f:
+                f.write('<html><head><title>Chapter %d</title></head>'
+                        '<body><p>Text of chapter %d.</p></body></html>' % (n, n))
+        cls.server = server.BuildServer(
+                cls.output_directory, processes=1, max_queued_jobs=0,
+                base_directory=cls.chapter_directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        shutil.rmtree(cls.output_directory)
+        shutil.rmtree(cls.chapter_directory)
+
+    def request(self, method, path, body=None, query=''):
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+                   'QUERY_STRING': query}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            environ['CONTENT_LENGTH'] = str(len(body))
+            environ['wsgi.input'] = io.BytesIO(body)
+        setup_testing_defaults(environ)
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        response['body'] = b''.join(self.server(environ, start_response))
+        return response
+
+    def test_build(self):
+        job = {'title': 'Served', 'chapters': ['0.html', '1.html']}
+        response = self.request('POST', '/build', job)
+        self.assertEqual(response['status'], '200 OK')
+        result = json.loads(response['body'].decode('utf-8'))
+        self.assertEqual(result['chapters'], 2)
+        self.assertTrue(os.path.exists(result['path']))
+        response = self.request('POST', '/build', job, 'download=1')
+        self.assertEqual(response['headers']['Content-Type'], 'application/epub+zip')
+        with zipfile.ZipFile(io.BytesIO(response['body'])) as z:
+            self.assertEqual(z.namelist()[0], 'mimetype')
+        status = json.loads(self.request('GET', '/status')['body'].decode('utf-8'))
+        self.assertEqual(status['pending'], 0)
+        self.assertTrue(status['built'] >= 2)
+
+    def test_bad_jobs(self):
+        self.assertEqual(self.request('POST', '/build', {'chapters': []})['status'],
+                         '400 Bad Request')
+        self.assertEqual(self.request('POST', '/build')['status'], '400 Bad Request')
+        for job in ({'title': 'Number', 'chapters': [5]},
+                    {'title': 'List', 'chapters': [['0.html']]},
+                    {'title': 'Url', 'chapters': [{'url': 5}]},
+                    {'title': 'Cover', 'chapters': ['0.html'], 'cover_file': 5}):
+            self.assertEqual(self.request('POST', '/build', job)['status'],
+                             '400 Bad Request')
+        self.assertEqual(self.request('GET', '/build')['status'],
+                         '405 Method Not Allowed')
+        self.assertEqual(self.request('GET', '/')['status'], '404 Not Found')
+
+    def test_output_names(self):
+        job = {'title': 'Same', 'epub_name': '../escaped', 'chapters': ['0.html']}
+        paths = [self.server.build(dict(job))['path'] for _ in range(2)]
+        self.assertNotEqual(paths[0], paths[1])
+        for path in paths:
+            self.assertEqual(os.path.dirname(path), self.output_directory)
+            self.assertTrue(os.path.exists(path))
+
+    def test_files_outside_base_directory(self):
+        secret_directory = tempfile.mkdtemp()
+        secret_file = os.path.join(secret_directory, 'secret.html')
+        with open(secret_file, 'w') as f:
+            f.write('<html><body><p>Secret</p></body></html>')
+        link = os.path.join(self.chapter_directory, 'link.html')
+        os.symlink(secret_file, link)
+        try:
+            for job in ({'title': 'Absolute', 'chapters': [{'file': secret_file}]},
+                        {'title': 'Parent', 'chapters': [
+                            os.path.join('..', os.path.basename(secret_directory),
+                                         'secret.html')]},
+                        {'title': 'Link', 'chapters': ['link.html']},
+                        {'title': 'Cover', 'chapters': ['0.html'],
+                         'cover_file': secret_file}):
+                self.assertEqual(self.request('POST', '/build', job)['status'],
+                                 '400 Bad Request')
+        finally:
+            os.remove(link)
+            shutil.rmtree(secret_directory)
+
+    def test_resume(self):
+        work_directory = tempfile.mkdtemp()
+        missing_file = os.path.join(self.chapter_directory, 'missing.html')
+        job = {'title': 'Resumed', 'chapters': ['0.html', 'missing.html']}
+        try:
+            with server.BuildServer(self.output_directory, processes=1,
+                                    base_directory=self.chapter_directory,
+                                    work_directory=work_directory) as build_server:
+                # a build failing on its second chapter keeps the first
+                self.assertTrue(build_server.build(dict(job))['error'])
+                self.assertEqual(len(os.listdir(work_directory)), 2)
+                with open(missing_file, 'w') as f:
+                    f.write('<html><head><title>Late</title></head>'
+                            '<body><p>Late chapter.</p></body></html>')
+                result = build_server.build(dict(job))
+            self.assertEqual(result['error'], None)
+            self.assertEqual(result['chapters'], 2)
+            # the journal and the staged files of the first build were used
+            # and removed, not left behind
+            self.assertEqual(os.listdir(work_directory), [])
+        finally:
+            if os.path.exists(missing_file):
+                os.remove(missing_file)
+            shutil.rmtree(work_directory)
+
+    def test_queue_full(self):
+        self.server._pending = 1
+        try:
+            response = self.request('POST', '/build',
+                                    {'title': 'Refused', 'chapters': ['0.html']})
+        finally:
+            self.server._pending = 0
+        self.assertEqual(response['status'], '503 Service Unavailable')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,13 @@ from __future__ import print_function, unicode_literals
 import os
 import sys
 import codecs
+import hashlib
 import re
+import shutil
 import bs4
 from bs4 import BeautifulSoup
-from lxml import etree
+from .constants import (IMAGE_TARGET_WIDTH, LAZY_IMAGE_ATTRIBUTES,
+                        LAZY_SRCSET_ATTRIBUTES)
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
@@ -35,6 +38,7 @@ def get_html_title(html_string):
     return title.strip()
 
 def validate_xhtml(text):
+    from lxml import etree
     parser = etree.XMLParser()
     root = etree.fromstring(text, parser)
 
@@ -61,3 +65,189 @@ def remove_invalid_xml_chars(html_string):
     # return re.sub(r'[\xE4C6\x00-\x1F\x7F-\x9F%&<>]+','', text)
     # https://stackoverflow.com/questions/8733233/filtering-out-certain-bytes-in-python
     return ''.join(c for c in text if _valid_xml_char_ordinal(c))
+
+def get_file_digest(file_name):
+    """
+    Returns the sha1 hex digest of the content of file_name.
+    """
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+_templates = {}
+
+
+def load_template(template_file):
+    """
+    Returns the jinja2 template in template_file. Templates are compiled the
+    first time they are loaded, and reused by every later build of the
+    process.
+    """
+    template = _templates.get(template_file)
+    if template is None:
+        import jinja2
+        with codecs.open(template_file, 'r', 'utf-8') as f:
+            template = _templates[template_file] = jinja2.Template(f.read())
+    return template
+
+
+def link_or_copy(source, destination):
+    """
+    Puts the file source at destination without copying its content when
+    possible: destination is made a hard link to source, so it takes no space
+    or time whatever its size, and it is only copied when they are on
+    different file systems or the file system has no hard links. A file
+    already at destination is replaced rather than written over, since it may
+    itself be a link to another file.
+
+    Returns:
+        bool: True if destination is a link to source, False if a copy.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return True
+    except (AttributeError, OSError):
+        # os.link is missing on Windows under python 2
+        shutil.copy(source, destination)
+        return False
+
+
+_SIZES_LENGTH_PATTERN = re.compile(r'([\d.]+)(px|vw)\s*$', re.I)
+_SUPPORTED_SOURCE_TYPES = ['image/jpeg', 'image/png', 'image/gif']
+
+
+def parse_srcset(srcset):
+    """
+    Returns the candidates of a srcset attribute, as (url, descriptor)
+    tuples. The descriptor is a width such as "800w", a density such as
+    "2x", or None.
+    """
+    candidates = []
+    tokens = srcset.split()
+    i = 0
+    while i < len(tokens):
+        url = tokens[i].lstrip(',')
+        i += 1
+        if not url:
+            continue
+        descriptor = None
+        if url.endswith(','):
+            url = url.rstrip(',')
+        elif i < len(tokens) and not tokens[i].startswith(','):
+            descriptor = tokens[i].rstrip(',').lower()
+            i += 1
+        if url:
+            candidates.append((url, descriptor))
+    return candidates
+
+
+def _get_slot_width(sizes, target_width):
+    # the width the last, unconditional, length of a sizes attribute lays the
+    # image out at on a target_width wide screen
+    if not sizes:
+        return None
+    match = _SIZES_LENGTH_PATTERN.search(sizes.split(',')[-1])
+    if match is None:
+        return None
+    length = float(match.group(1))
+    if match.group(2).lower() == 'vw':
+        return target_width * length / 100
+    return length
+
+
+def _get_candidate_width(descriptor, layout_width, target_width):
+    try:
+        if descriptor is None:
+            return layout_width or target_width
+        if descriptor.endswith('w'):
+            return float(descriptor[:-1])
+        if descriptor.endswith('x'):
+            return float(descriptor[:-1]) * (layout_width or target_width)
+    except ValueError:
+        pass
+    return None
+
+
+def _get_srcset(node):
+    for attribute in LAZY_SRCSET_ATTRIBUTES + ['srcset']:
+        if node.get(attribute):
+            return node[attribute]
+    return None
+
+
+def _is_placeholder(url):
+    return not url or url.strip().lower().startswith('data:')
+
+
+def select_image_source(node, target_width=IMAGE_TARGET_WIDTH):
+    """
+    Returns the url of the image an img tag should be saved from. Lazy
+    loading attributes such as data-src are preferred to src, which usually
+    holds a placeholder then. If the img, or the source tags of its picture
+    tag, have a srcset, its smallest candidate at least target_width pixels
+    wide (as laid out by sizes) is picked, or its widest if none is that
+    wide.
+
+    Args:
+        node (bs4.element.Tag): The img tag.
+        target_width (Option[int]): The width in pixels to pick candidates
+            for.
+
+    Returns:
+        str: The url, relative to the page as in the tag, or None if the tag
+            only has a placeholder.
+    """
+    srcsets = []
+    parent = node.parent
+    if parent is not None and parent.name == 'picture':
+        for source in parent.find_all('source'):
+            source_type = source.get('type')
+            srcset = _get_srcset(source)
+            if srcset and (not source_type or source_type.lower() in _SUPPORTED_SOURCE_TYPES):
+                srcsets.append((srcset, source.get('sizes')))
+    srcset = _get_srcset(node)
+    if srcset:
+        srcsets.append((srcset, node.get('sizes')))
+    try:
+        layout_width = float(node.get('width'))
+    except (TypeError, ValueError):
+        layout_width = None
+    best = None
+    for srcset, sizes in srcsets:
+        slot_width = _get_slot_width(sizes, target_width) or layout_width
+        required_width = min(target_width, slot_width or target_width)
+        for url, descriptor in parse_srcset(srcset):
+            width = _get_candidate_width(descriptor, slot_width, target_width)
+            if width is None or _is_placeholder(url):
+                continue
+            # candidates wide enough beat narrower ones, and among those
+            # wide enough the narrowest wins
+            key = (width >= required_width, -width if width >= required_width else width)
+            if best is None or key > best[0]:
+                best = (key, url)
+    if best is not None:
+        return best[1]
+    for attribute in LAZY_IMAGE_ATTRIBUTES + ['src']:
+        url = node.get(attribute)
+        if not _is_placeholder(url):
+            return url.strip()
+    return None
+
+
+def resolve_image_source(node, target_width=IMAGE_TARGET_WIDTH):
+    """
+    Sets the src of an img tag to the url returned by select_image_source,
+    and removes its srcset and lazy loading attributes. Tags with only a
+    placeholder keep their src.
+    """
+    url = select_image_source(node, target_width)
+    if url is not None:
+        node['src'] = url
+    for attribute in LAZY_IMAGE_ATTRIBUTES + LAZY_SRCSET_ATTRIBUTES + ['srcset', 'sizes']:
+        if attribute in node.attrs:
+            del node[attribute]
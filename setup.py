@@ -1,10 +1,12 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='pypub',
     version='1.4',
     packages=['pypub',],
     package_data={'pypub': ['epub_templates/*',]},
+    entry_points={'console_scripts': ['pypub = pypub.batch:main',
+                                      'pypub-server = pypub.server:main',]},
     author = 'William Cember',
     author_email = 'wcember@gmail.com',
     url = 'https://github.com/wcember/pypub',